@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк клиентской части MKAI на локальном mock-сервере
+=====================================================
+Запуск: python benchmark.py --requests 50 --concurrency 4 --json bench.json
+Сравнение: python benchmark.py --baseline bench.json (код выхода 1 при регрессии)
+Отчёт: p50/p95/p99, пропускная способность и пик памяти по сценариям
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+# Кэши и сессии бенчмарка не должны попадать в профиль пользователя
+os.environ.setdefault("MKAI_DATA_DIR", tempfile.mkdtemp(prefix="mkai-bench-"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import task_solver_desktop as mkai
+from mock_server import MockServer, MockConfig
+
+SCENARIOS = [
+    "chat", "chat_stream", "search_cold", "search_cached",
+    "pdf_server", "pdf_local", "doc_select", "ui_messages",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, latencies: List[float], errors: int, wall: float,
+              peak_bytes: int, extra: Optional[Dict[str, float]] = None) -> dict:
+    result = {
+        "scenario": name,
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "peak_kb": peak_bytes / 1024,
+    }
+    result.update(extra or {})
+    return result
+
+
+def run_load(name: str, fn: Callable[[int], bool], count: int, concurrency: int) -> dict:
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    def one(i: int):
+        started = time.perf_counter()
+        ok = fn(i)
+        return time.perf_counter() - started, ok
+
+    latencies: List[float] = []
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, ok in pool.map(one, range(count)):
+            latencies.append(latency)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    return summarize(name, latencies, errors, wall, peak)
+
+
+def make_sample_pdf(path: Path, pages: int):
+    # Минимальный текстовый PDF без внешних зависимостей
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * i} 0 R" for i in range(pages)), pages
+        ),
+    ]
+    font_id = 3 + 2 * pages
+    for i in range(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        lines = " ".join(
+            f"(Page {i + 1} line {n} benchmark text for extraction) Tj T*" for n in range(30)
+        )
+        stream = f"BT /F1 10 Tf 14 TL 50 750 Td {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    path.write_text(out, encoding="latin-1")
+
+
+def bench_chat(api: mkai.APIClient, args) -> dict:
+    return run_load(
+        "chat",
+        lambda i: bool(api.chat(f"вопрос {i}", "analysis").get("success")),
+        args.requests, args.concurrency
+    )
+
+
+def bench_chat_stream(api: mkai.APIClient, args) -> dict:
+    ttft: List[float] = []
+
+    def one(i: int) -> bool:
+        started = time.perf_counter()
+        first = []
+
+        def on_chunk(_):
+            if not first:
+                first.append(time.perf_counter() - started)
+
+        ok = bool(api.chat_stream(f"поток {i}", "analysis", on_chunk=on_chunk).get("success"))
+        ttft.extend(first)
+        return ok
+
+    result = run_load("chat_stream", one, args.requests, args.concurrency)
+    result["ttft_p50_ms"] = percentile(ttft, 50) * 1000
+    result["ttft_p95_ms"] = percentile(ttft, 95) * 1000
+    return result
+
+
+def bench_search_cold(api: mkai.APIClient, args) -> dict:
+    return run_load(
+        "search_cold",
+        lambda i: bool(api.search(f"уникальный запрос {i} {time.time_ns()}")),
+        args.requests, args.concurrency
+    )
+
+
+def bench_search_cached(api: mkai.APIClient, args) -> dict:
+    api.search("повторный запрос")
+    result = run_load(
+        "search_cached",
+        lambda i: bool(api.search("повторный запрос")),
+        args.requests, args.concurrency
+    )
+    result.update({f"cache_{k}": v for k, v in api.search_cache.stats().items()})
+    return result
+
+
+def bench_pdf_server(api: mkai.APIClient, args) -> dict:
+    return run_load(
+        "pdf_server",
+        lambda i: api.extract_pdf(str(args.pdf_path)) is not None,
+        max(1, args.requests // 5), args.concurrency
+    )
+
+
+def bench_pdf_local(api: mkai.APIClient, args) -> dict:
+    extractor = mkai.PDFExtractor(api, cache=None)
+    try:
+        return run_load(
+            "pdf_local",
+            lambda i: extractor.extract(str(args.pdf_path)) is not None,
+            max(1, args.requests // 10), 1
+        )
+    finally:
+        extractor.shutdown()
+
+
+def bench_doc_select(api: mkai.APIClient, args) -> dict:
+    index = mkai.DocumentIndex()
+    words = ("нагрузка балка прочность материал расчёт метод схема опора "
+             "момент сила деформация напряжение").split()
+    for n in range(5):
+        text = " ".join(words[(i * 7 + n) % len(words)] for i in range(60000))
+        index.add(mkai.Document(filename=f"doc{n}.pdf", content=text, pages=100))
+    return run_load(
+        "doc_select",
+        lambda i: bool(index.select(f"{words[i % len(words)]} {words[(i + 3) % len(words)]}")),
+        args.requests * 4, 1
+    )
+
+
+def bench_ui_messages(api: mkai.APIClient, args) -> dict:
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+
+    started = time.perf_counter()
+    window = mkai.TaskSolverWindow(session_id=f"bench-{os.getpid()}")
+    window.resize(1200, 800)
+    window.show()
+    app.processEvents()
+    startup = time.perf_counter() - started
+
+    body = "Ответ ассистента с достаточно длинным текстом для переноса строк. " * 12
+    latencies: List[float] = []
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    for i in range(args.messages):
+        t0 = time.perf_counter()
+        window._add_message(mkai.Message(role='user' if i % 2 else 'assistant', content=body))
+        # Без ожидания кадра планировщика: замеряется сама вставка с раскладкой
+        window.ui.flush()
+        app.processEvents()
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    widgets = len(app.allWidgets())
+    window.close()
+    return summarize("ui_messages", latencies, 0, wall, peak, {
+        "window_startup_ms": startup * 1000,
+        "widgets": widgets,
+    })
+
+
+BENCHMARKS = {
+    "chat": bench_chat,
+    "chat_stream": bench_chat_stream,
+    "search_cold": bench_search_cold,
+    "search_cached": bench_search_cached,
+    "pdf_server": bench_pdf_server,
+    "pdf_local": bench_pdf_local,
+    "doc_select": bench_doc_select,
+    "ui_messages": bench_ui_messages,
+}
+
+
+def print_report(results: List[dict]):
+    print(f"\n{'='*86}")
+    print(f"  {'Сценарий':<16}{'N':>6}{'ошибки':>8}{'p50 мс':>10}{'p95 мс':>10}"
+          f"{'p99 мс':>10}{'RPS':>10}{'пик КБ':>12}")
+    print(f"{'='*86}")
+    for r in results:
+        print(f"  {r['scenario']:<16}{r['count']:>6}{r['errors']:>8}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['throughput_rps']:>10.1f}{r['peak_kb']:>12.0f}")
+    for r in results:
+        extra = {k: v for k, v in r.items() if k not in {
+            "scenario", "count", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_kb"
+        }}
+        if extra:
+            print(f"  {r['scenario']}: " + ", ".join(
+                f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in extra.items()
+            ))
+    print()
+
+
+def compare(results: List[dict], baseline_path: Path, threshold: float) -> bool:
+    baseline = {r["scenario"]: r for r in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    ok = True
+    for r in results:
+        old = baseline.get(r["scenario"])
+        if not old or not old["p95_ms"]:
+            continue
+        delta = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"]
+        mark = "✗ РЕГРЕССИЯ" if delta > threshold else "✓"
+        ok = ok and delta <= threshold
+        print(f"  {mark} {r['scenario']}: p95 {old['p95_ms']:.1f} → {r['p95_ms']:.1f} мс ({delta:+.0%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк MKAI на mock-сервере")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=500, help="сообщений в ui_messages")
+    parser.add_argument("--pdf-pages", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка mock-сервера, сек.")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--payload-size", type=int, default=2000)
+    parser.add_argument("--no-memory", action="store_true", help="не трассировать память")
+    parser.add_argument("--json", type=Path, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимый рост p95")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"✗ Неизвестные сценарии: {', '.join(unknown)}")
+        return 2
+
+    server = MockServer(MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        payload_size=args.payload_size,
+    )).start()
+    args.pdf_path = Path(mkai.DATA_DIR) / "benchmark.pdf"
+    args.pdf_path.parent.mkdir(parents=True, exist_ok=True)
+    make_sample_pdf(args.pdf_path, args.pdf_pages)
+
+    print(f"Mock-сервер: {server.url} (задержка {args.latency} ± {args.jitter} с, "
+          f"ошибки {args.error_rate:.0%})")
+    if not args.no_memory:
+        tracemalloc.start()
+
+    results = []
+    try:
+        for name in names:
+            api = mkai.APIClient(server.url, backoff_base=0.05)
+            api.session  # requests импортируется лениво — импорт не входит в замеры
+            print(f"  → {name}...")
+            results.append(BENCHMARKS[name](api, args))
+            api.session.close()
+    finally:
+        server.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    print_report(results)
+    if args.json:
+        args.json.write_text(json.dumps({
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "args": {k: str(v) for k, v in vars(args).items()},
+            "results": results,
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✓ Результаты сохранены: {args.json}")
+    if args.baseline:
+        return 0 if compare(results, args.baseline, args.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,15 +4,49 @@
 =====================================================
 Запуск: python build_exe.py
 Результат: dist/MKAI.exe
+Быстрый запуск: python build_exe.py --onedir --splash splash.png
+Результат: dist/MKAI/MKAI.exe (без распаковки во временный каталог при каждом старте)
+Перед сборкой приложение запускается в режиме MKAI_SMOKE_TEST: по списку реально
+загруженных модулей строятся hiddenimports/excludes для mkai.spec (build/mkai_modules.json).
+После сборки размер и время запуска сравниваются с прошлой сборкой (build/build_report.json).
 """
 import os
 import sys
+import json
+import time
 import shutil
+import argparse
+import tempfile
 import subprocess
 from pathlib import Path
 APP_NAME = "MKAI"
 MAIN_SCRIPT = "task_solver_desktop.py"
+SPEC_FILE = "mkai.spec"
 ICON_FILE = "image-Picsart-AiImageEnhancer.ico"
+SPLASH_FILE = "splash.png"
+EXE_SUFFIX = ".exe" if sys.platform == "win32" else ""
+BUILD_DIR = Path("build")
+MODULES_FILE = BUILD_DIR / "mkai_modules.json"
+REPORT_FILE = BUILD_DIR / "build_report.json"
+SMOKE_TIMEOUT = 120
+START_RUNS = 3
+
+# Модули, которые исключаются из сборки, если их нет в трассировке импортов
+EXCLUDE_CANDIDATES = [
+    "tkinter", "unittest", "pydoc", "doctest", "pdb", "lib2to3", "xmlrpc", "curses",
+    "idlelib", "turtle", "turtledemo", "ensurepip", "venv", "distutils", "setuptools",
+    "PIL", "PyQt6.uic", "PyQt6.lupdate",
+    "PyQt6.QtNetwork", "PyQt6.QtQml", "PyQt6.QtQuick", "PyQt6.QtQuickWidgets",
+    "PyQt6.QtSql", "PyQt6.QtTest", "PyQt6.QtOpenGL", "PyQt6.QtOpenGLWidgets",
+    "PyQt6.QtSvg", "PyQt6.QtSvgWidgets", "PyQt6.QtPrintSupport", "PyQt6.QtMultimedia",
+    "PyQt6.QtMultimediaWidgets", "PyQt6.QtPdf", "PyQt6.QtPdfWidgets", "PyQt6.QtDBus",
+    "PyQt6.QtBluetooth", "PyQt6.QtNfc", "PyQt6.QtPositioning", "PyQt6.QtSensors",
+    "PyQt6.QtSerialPort", "PyQt6.QtWebSockets", "PyQt6.QtWebChannel", "PyQt6.QtXml",
+    "PyQt6.QtDesigner", "PyQt6.QtHelp", "PyQt6.QtRemoteObjects", "PyQt6.QtSpatialAudio",
+    "PyQt6.QtTextToSpeech", "PyQt6.Qt3DCore", "PyQt6.QtCharts", "PyQt6.QtDataVisualization",
+]
+# Пакеты, импортируемые лениво внутри функций — явно в hiddenimports
+LAZY_PACKAGES = ["requests", "pypdf", "numpy"]
 
 def check_pyinstaller():
     try:
@@ -24,67 +58,187 @@ def check_pyinstaller():
         print("  Установка: pip install pyinstaller")
         return False
 
-def build():
+def dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def smoke_env(trace_path: Path, profile_path: Path) -> dict:
+    env = dict(os.environ)
+    env["MKAI_SMOKE_TEST"] = str(trace_path)
+    env["MKAI_PROFILE_STARTUP"] = str(profile_path)
+    # Отдельный каталог данных: прогон не трогает сессии пользователя
+    env["MKAI_DATA_DIR"] = tempfile.mkdtemp(prefix="mkai-smoke-")
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    return env
+
+def smoke_run(cmd: list) -> dict:
+    # Запуск до первой отрисовки и выход; возвращает модули и замеры запуска
+    with tempfile.TemporaryDirectory(prefix="mkai-trace-") as tmp:
+        trace_path = Path(tmp) / "trace.json"
+        profile_path = Path(tmp) / "startup.json"
+        started = time.perf_counter()
+        result = subprocess.run(
+            cmd, env=smoke_env(trace_path, profile_path), timeout=SMOKE_TIMEOUT,
+            capture_output=True, text=True
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+        if result.returncode != 0 or not trace_path.exists():
+            print(result.stderr[-2000:])
+            raise RuntimeError(f"smoke-прогон завершился с кодом {result.returncode}")
+        trace = json.loads(trace_path.read_text(encoding="utf-8"))
+        profile = json.loads(profile_path.read_text(encoding="utf-8")) if profile_path.exists() else {}
+    return {
+        "modules": trace["modules"],
+        "wall_ms": wall_ms,
+        "app_ms": profile.get("total_ms", 0.0),
+    }
+
+def trace_imports() -> bool:
+    print("Трассировка импортов (smoke-прогон)...")
+    try:
+        trace = smoke_run([sys.executable, MAIN_SCRIPT])
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f"✗ Трассировка не удалась: {e}")
+        return False
+
+    modules = set(trace["modules"])
+    hidden = sorted(
+        m for m in modules
+        if m == "PyQt6.sip" or (m.startswith("PyQt6.Qt") and m.count(".") == 1)
+    )
+    hidden += [p for p in LAZY_PACKAGES if p in modules]
+    excludes = [m for m in EXCLUDE_CANDIDATES if m not in modules]
+
+    BUILD_DIR.mkdir(exist_ok=True)
+    MODULES_FILE.write_text(json.dumps({
+        "hiddenimports": hidden,
+        "excludes": excludes,
+        "traced_modules": len(modules),
+    }, indent=2), encoding="utf-8")
+    print(f"✓ Модулей загружено: {len(modules)}, hiddenimports: {len(hidden)}, "
+          f"excludes: {len(excludes)} → {MODULES_FILE}")
+    return True
+
+def measure(exe_path: Path, onedir: bool) -> dict:
+    size = dir_size(exe_path.parent) if onedir else exe_path.stat().st_size
+    runs = []
+    for _ in range(START_RUNS):
+        try:
+            runs.append(smoke_run([str(exe_path)]))
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"⚠ Замер запуска не удался: {e}")
+            break
+    # Минимум из нескольких запусков — меньше шума от диска и антивируса
+    wall_ms = min((r["wall_ms"] for r in runs), default=0.0)
+    app_ms = min((r["app_ms"] for r in runs), default=0.0)
+    return {
+        "size_mb": round(size / (1024 * 1024), 2),
+        "start_ms": round(wall_ms, 1),
+        "app_startup_ms": round(app_ms, 1),
+        # Распаковка (onefile) и запуск интерпретатора до первой строки приложения
+        "unpack_ms": round(max(0.0, wall_ms - app_ms), 1),
+        "built": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def report(profile: str, metrics: dict):
+    history = json.loads(REPORT_FILE.read_text(encoding="utf-8")) if REPORT_FILE.exists() else {}
+    previous = history.get(profile)
+
+    print(f"\n{'='*50}")
+    print(f"  Отчёт сборки ({profile})")
+    print(f"{'='*50}")
+    labels = {
+        "size_mb": ("Размер", "MB"),
+        "start_ms": ("Запуск до окна", "мс"),
+        "app_startup_ms": ("  из них приложение", "мс"),
+        "unpack_ms": ("  распаковка и Python", "мс"),
+    }
+    for key, (label, unit) in labels.items():
+        line = f"  {label:<22}{metrics[key]:>10.1f} {unit}"
+        if previous and previous.get(key):
+            delta = metrics[key] - previous[key]
+            line += f"   ({delta:+.1f} {unit}, {delta / previous[key]:+.0%})"
+        print(line)
+    print(f"{'='*50}\n")
+
+    history[profile] = metrics
+    REPORT_FILE.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def build(onedir: bool = False, splash: str = "", trace: bool = True):
     if not check_pyinstaller():
         return False
-    
+
+    profile = "onedir" if onedir else "onefile"
     print(f"\n{'='*50}")
-    print(f"  Сборка {APP_NAME}")
+    print(f"  Сборка {APP_NAME} ({profile})")
     print(f"{'='*50}\n")
 
-    cmd = [
-        sys.executable, "-m", "PyInstaller",
-        "--onefile",
-        "--windowed",
-        "--name", APP_NAME,
-        "--clean",
-        "--noconfirm",
-    ]
-
-    if ICON_FILE and Path(ICON_FILE).exists():
-        cmd.extend(["--icon", ICON_FILE])
-
-    hidden_imports = [
-        "PyQt6",
-        "PyQt6.QtCore",
-        "PyQt6.QtWidgets", 
-        "PyQt6.QtGui",
-        "requests",
-    ]
-    for imp in hidden_imports:
-        cmd.extend(["--hidden-import", imp])
-
-    cmd.append(MAIN_SCRIPT)
-    
+    if trace and not trace_imports():
+        return False
+    if not MODULES_FILE.exists():
+        print(f"⚠ {MODULES_FILE} нет — сборка с полным набором модулей PyQt6")
+
+    env = dict(os.environ)
+    env["MKAI_ONEDIR"] = "1" if onedir else "0"
+    env["MKAI_MODULES"] = str(MODULES_FILE)
+    if splash:
+        if Path(splash).exists():
+            # Заставка показывается загрузчиком до старта Python и закрывается из close_splash()
+            env["MKAI_SPLASH"] = splash
+        else:
+            print(f"⚠ Заставка {splash} не найдена, сборка без неё")
+
+    cmd = [sys.executable, "-m", "PyInstaller", SPEC_FILE, "--clean", "--noconfirm"]
+
     print("Выполняю команду:")
     print(" ".join(cmd))
     print()
 
-    result = subprocess.run(cmd, capture_output=False)
-    
+    result = subprocess.run(cmd, env=env, capture_output=False)
+
     if result.returncode == 0:
-        exe_path = Path("dist") / f"{APP_NAME}.exe"
+        if onedir:
+            exe_path = Path("dist") / APP_NAME / f"{APP_NAME}{EXE_SUFFIX}"
+        else:
+            exe_path = Path("dist") / f"{APP_NAME}{EXE_SUFFIX}"
         if exe_path.exists():
-            size_mb = exe_path.stat().st_size / (1024 * 1024)
             print(f"\n{'='*50}")
             print(f"  ✓ Сборка успешна!")
             print(f"  Файл: {exe_path.absolute()}")
-            print(f"  Размер: {size_mb:.1f} MB")
             print(f"{'='*50}\n")
+            report(profile, measure(exe_path, onedir))
             return True
-    
+
     print("\n✗ Ошибка сборки")
     return False
 
 def main():
+    parser = argparse.ArgumentParser(description=f"Сборка {APP_NAME}")
+    parser.add_argument("--onedir", action="store_true",
+                        help="каталог вместо одного .exe: быстрее холодный старт")
+    parser.add_argument("--splash", nargs="?", const=SPLASH_FILE, default="",
+                        help=f"картинка заставки (по умолчанию {SPLASH_FILE})")
+    parser.add_argument("--no-trace", dest="trace", action="store_false",
+                        help=f"не запускать трассировку, взять готовый {MODULES_FILE}")
+    parser.add_argument("--clean", action="store_true", help="удалить build/ и dist/ перед сборкой")
+    args = parser.parse_args()
+
     script_dir = Path(__file__).parent
     os.chdir(script_dir)
 
     if not Path(MAIN_SCRIPT).exists():
         print(f"✗ Файл {MAIN_SCRIPT} не найден")
         return
-    
-    build()
+
+    if args.clean:
+        # Отчёт прошлых сборок сохраняется для сравнения
+        saved = REPORT_FILE.read_text(encoding="utf-8") if REPORT_FILE.exists() else None
+        shutil.rmtree(BUILD_DIR, ignore_errors=True)
+        shutil.rmtree("dist", ignore_errors=True)
+        if saved:
+            BUILD_DIR.mkdir(exist_ok=True)
+            REPORT_FILE.write_text(saved, encoding="utf-8")
+
+    build(onedir=args.onedir, splash=args.splash, trace=args.trace)
 
 if __name__ == "__main__":
     main()
@@ -1,39 +1,114 @@
-# -*- mode: python ; coding: utf-8 -*-
-
-
-a = Analysis(
-    ['task_solver_desktop.py'],
-    pathex=[],
-    binaries=[],
-    datas=[],
-    hiddenimports=['PyQt6', 'PyQt6.QtCore', 'PyQt6.QtWidgets', 'PyQt6.QtGui', 'requests'],
-    hookspath=[],
-    hooksconfig={},
-    runtime_hooks=[],
-    excludes=[],
-    noarchive=False,
-    optimize=0,
-)
-pyz = PYZ(a.pure)
-
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='MKAI',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-    icon=['image-Picsart-AiImageEnhancer.ico'],
-)
+# -*- mode: python ; coding: utf-8 -*-
+import os
+import json
+
+# MKAI_ONEDIR=1 — каталог вместо одного файла (без распаковки при каждом запуске)
+# MKAI_SPLASH=splash.png — заставка загрузчика, закрывается из close_splash()
+# MKAI_MODULES — hiddenimports/excludes из трассировки импортов build_exe.py
+ONEDIR = os.environ.get('MKAI_ONEDIR') == '1'
+SPLASH_IMAGE = os.environ.get('MKAI_SPLASH', '')
+MODULES_FILE = os.environ.get('MKAI_MODULES', os.path.join('build', 'mkai_modules.json'))
+
+if os.path.exists(MODULES_FILE):
+    with open(MODULES_FILE, encoding='utf-8') as f:
+        modules = json.load(f)
+    HIDDEN_IMPORTS = modules['hiddenimports']
+    EXCLUDES = modules['excludes']
+else:
+    HIDDEN_IMPORTS = ['PyQt6', 'PyQt6.QtCore', 'PyQt6.QtWidgets', 'PyQt6.QtGui', 'requests']
+    EXCLUDES = []
+
+# Плагины Qt, нужные виджетному приложению; переводы — только для русского интерфейса
+QT_PLUGIN_DIRS = {
+    'platforms', 'platformthemes', 'platforminputcontexts', 'styles', 'imageformats',
+    'iconengines', 'generic', 'xcbglintegrations', 'egldeviceintegrations',
+    'wayland-decoration-client', 'wayland-graphics-integration-client', 'wayland-shell-integration',
+}
+QT_TRANSLATIONS = ('qtbase_ru',)
+
+
+def keep_qt_file(dest):
+    parts = dest.replace('\\', '/').split('/')
+    if 'Qt6' not in parts:
+        return True
+    sub = parts[parts.index('Qt6') + 1:]
+    if sub[:1] == ['translations']:
+        return sub[-1].startswith(QT_TRANSLATIONS)
+    if sub[:1] == ['plugins']:
+        return len(sub) < 3 or sub[1] in QT_PLUGIN_DIRS
+    return sub[:1] not in (['qml'], ['qsci'])
+
+
+a = Analysis(
+    ['task_solver_desktop.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=HIDDEN_IMPORTS,
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=EXCLUDES,
+    noarchive=False,
+    optimize=2,
+)
+a.binaries = [entry for entry in a.binaries if keep_qt_file(entry[0])]
+a.datas = [entry for entry in a.datas if keep_qt_file(entry[0])]
+pyz = PYZ(a.pure)
+
+splash = None
+if SPLASH_IMAGE and os.path.exists(SPLASH_IMAGE):
+    splash = Splash(
+        SPLASH_IMAGE,
+        binaries=a.binaries,
+        datas=a.datas,
+        text_pos=None,
+    )
+
+# UPX выключен: распаковка сжатых Qt-библиотек замедляет каждый запуск
+exe_options = dict(
+    name='MKAI',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['image-Picsart-AiImageEnhancer.ico'],
+)
+
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        *([splash] if splash else []),
+        [],
+        exclude_binaries=True,
+        **exe_options,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        *([splash.binaries] if splash else []),
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='MKAI',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        *([splash, splash.binaries] if splash else []),
+        [],
+        runtime_tmpdir=None,
+        **exe_options,
+    )
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Локальная замена API-сервера MKAI для тестов и бенчмарков
+=====================================================
+Запуск: python mock_server.py --port 3000 --latency 0.3 --jitter 0.1
+Эндпоинты: /api, /api/chat (JSON, SSE или NDJSON), /api/chat/cancel, /api/search, /api/pdf,
+/api/documents (реестр документов: /chat принимает documentRefs вместо текста)
+"""
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+from typing import Optional
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+WORDS = (
+    "задача решение анализ цель план поиск работа результат метод модель "
+    "данные система процесс условие вывод этап ограничение критерий оценка"
+).split()
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.2         # сек. до первого байта ответа
+    jitter: float = 0.05         # ± сек. к задержке
+    error_rate: float = 0.0      # доля ответов 502/503
+    payload_size: int = 2000     # символов в ответе /chat
+    chunk_chars: int = 24        # символов в одном событии стрима
+    chunk_delay: float = 0.01    # сек. между событиями стрима
+    stream_format: str = "sse"   # sse | ndjson
+    documents_status: int = 0    # ≠ 0 — /documents отвечает этим кодом (сервер без реестра)
+    accept_gzip: bool = True     # False — тело с Content-Encoding: gzip отклоняется (415)
+    report_missing: bool = True  # False — 409 без списка missingDocuments
+    seed: int = 0
+
+
+def make_text(size: int, rng: random.Random) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят разными write(): без TCP_NODELAY Nagle
+    # задерживает второй сегмент до ACK и добавляет ~40 мс к каждому ответу
+    disable_nagle_algorithm = True
+    server: "MockHTTPServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def _delay(self):
+        delay = self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _maybe_fail(self) -> bool:
+        if random.random() >= self.config.error_rate:
+            return False
+        self._send_json({"success": False, "error": "mock upstream error"},
+                        status=random.choice([502, 503]))
+        return True
+
+    def _read_body(self) -> Optional[bytes]:
+        # None — сжатое тело, которое сервер принимать не должен
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if body and self.headers.get("Content-Encoding") == "gzip":
+            if not self.config.accept_gzip:
+                return None
+            body = gzip.decompress(body)
+        return body
+
+    def _send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _route(self) -> str:
+        path = urlsplit(self.path).path.rstrip("/")
+        return path[len("/api"):] if path.startswith("/api") else path
+
+    def do_GET(self):
+        route = self._route()
+        if route == "":
+            self._send_json({"status": "ok", "server": "mkai-mock"})
+        elif route == "/search":
+            self._search()
+        else:
+            self._send_json({"success": False, "error": "not found"}, status=404)
+
+    def do_POST(self):
+        route = self._route()
+        body = self._read_body()
+        if body is None:
+            self._send_json({"success": False, "error": "unsupported encoding"}, status=415)
+        elif route == "/chat":
+            self._chat(json.loads(body or b"{}"))
+        elif route == "/chat/cancel":
+            self._cancel(json.loads(body or b"{}"))
+        elif route == "/documents":
+            self._documents(json.loads(body or b"{}"))
+        elif route == "/pdf":
+            self._pdf(body)
+        else:
+            self._send_json({"success": False, "error": "not found"}, status=404)
+
+    def _chat(self, payload: dict):
+        self.server.last_chat = payload
+        request_id = payload.get("requestId")
+        refs = payload.get("documentRefs") or []
+        missing = sorted({ref["sha256"] for ref in refs} - self.server.documents.keys())
+        if missing:
+            # Клиент должен загрузить документы заново и повторить запрос
+            self._send_json({"success": False, "error": "unknown documents",
+                             **({"missingDocuments": missing} if self.config.report_missing else {})},
+                            status=409)
+            return
+        self._delay()
+        if self.server.is_cancelled(request_id):
+            self._send_json({"success": False, "cancelled": True, "error": "cancelled"})
+            return
+        if self._maybe_fail():
+            return
+        rng = random.Random(f"{payload.get('message', '')}:{self.config.seed}")
+        text = make_text(self.config.payload_size, rng)
+        if not payload.get("stream"):
+            self._send_json({"success": True, "response": text})
+            return
+
+        sse = self.config.stream_format == "sse"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            step = self.config.chunk_chars
+            for start in range(0, len(text), step):
+                if self.server.is_cancelled(request_id):
+                    # Генерация остановлена по /chat/cancel
+                    self.server.stopped += 1
+                    self._write_chunk(b"")
+                    return
+                event = json.dumps({"delta": text[start:start + step]}, ensure_ascii=False)
+                self._write_chunk((f"data: {event}\n\n" if sse else f"{event}\n").encode("utf-8"))
+                if self.config.chunk_delay:
+                    time.sleep(self.config.chunk_delay)
+            self._write_chunk(b"data: [DONE]\n\n" if sse else b'{"done": true}\n')
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отменил запрос
+            self.close_connection = True
+
+    def _documents(self, payload: dict):
+        if self.config.documents_status:
+            self._send_json({"success": False, "error": "not supported"},
+                            status=self.config.documents_status)
+            return
+        stored = 0
+        for doc in payload.get("documents", []):
+            content = doc.get("content", "")
+            if hashlib.sha256(content.encode("utf-8")).hexdigest() != doc.get("sha256"):
+                self._send_json({"success": False, "error": "sha256 mismatch"}, status=400)
+                return
+            self.server.documents[doc["sha256"]] = content
+            stored += 1
+        self._send_json({"success": True, "stored": stored})
+
+    def _cancel(self, payload: dict):
+        request_id = payload.get("requestId")
+        if not request_id:
+            self._send_json({"success": False, "error": "requestId required"}, status=400)
+            return
+        self.server.cancel(request_id)
+        self._send_json({"success": True})
+
+    def _search(self):
+        self._delay()
+        if self._maybe_fail():
+            return
+        params = parse_qs(urlsplit(self.path).query)
+        query = params.get("q", [""])[0]
+        num = int(params.get("num", ["10"])[0])
+        page = int(params.get("page", ["1"])[0])
+        source = params.get("source", ["general"])[0]
+        rng = random.Random(f"{query}:{source}:{page}")
+        results = []
+        for i in range(num):
+            domain = f"{source}{rng.randint(1, 6)}.example.org"
+            results.append({
+                "title": f"{query} — {make_text(40, rng)}",
+                "url": f"https://{domain}/{page}/{i}/{rng.randint(0, 10 ** 6)}",
+                "snippet": make_text(180, rng),
+                "domain": domain,
+            })
+        self._send_json({"success": True, "results": results})
+
+    def _pdf(self, body: bytes):
+        self._delay()
+        if self._maybe_fail():
+            return
+        match = re.search(rb'filename="([^"]+)"', body)
+        filename = match.group(1).decode("utf-8", "replace") if match else "document.pdf"
+        pages = max(1, len(body) // 3000)
+        text = make_text(pages * 1500, random.Random(len(body)))
+        self._send_json({
+            "success": True,
+            "text": text,
+            "metadata": {"filename": filename, "pages": pages},
+        })
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stopped = 0  # генераций, прерванных отменой
+        self.documents: dict = {}  # sha256 текста → текст
+        self.last_chat: dict = {}  # тело последнего /chat
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def cancel(self, request_id: str):
+        # Отмена может прийти раньше самого запроса — id запоминается
+        with self._lock:
+            self._cancelled.add(request_id)
+
+    def is_cancelled(self, request_id) -> bool:
+        with self._lock:
+            return request_id in self._cancelled
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл keep-alive соединение — это не ошибка сервера
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockServer:
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.httpd = MockHTTPServer((host, port), self.config)
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock API-сервер MKAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=MockConfig.latency)
+    parser.add_argument("--jitter", type=float, default=MockConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate)
+    parser.add_argument("--payload-size", type=int, default=MockConfig.payload_size)
+    parser.add_argument("--chunk-chars", type=int, default=MockConfig.chunk_chars)
+    parser.add_argument("--chunk-delay", type=float, default=MockConfig.chunk_delay)
+    parser.add_argument("--stream-format", choices=["sse", "ndjson"], default=MockConfig.stream_format)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        payload_size=args.payload_size,
+        chunk_chars=args.chunk_chars,
+        chunk_delay=args.chunk_delay,
+        stream_format=args.stream_format,
+    )
+    server = MockServer(config, host=args.host, port=args.port)
+    print(f"✓ Mock-сервер запущен: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nОстановка...")
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,10 +15,22 @@ echo "║     🧠 НЕЙРОСЕТЬ-ЧАТБОТ ДЛЯ РЕШЕНИЯ ЗАД
 echo "╚══════════════════════════════════════════════════════════════╝"
 echo -e "${NC}"
 
-# Проверяем, что сервер запущен
+# Проверяем, что запущен хотя бы один сервер (MKAI_API_URLS — несколько бэкендов через запятую)
 echo -e "${YELLOW}Проверка сервера...${NC}"
-if curl -s http://localhost:3000/api > /dev/null 2>&1; then
-    echo -e "${GREEN}✓ Сервер запущен${NC}"
+ALIVE=0
+IFS=',' read -ra API_URLS <<< "${MKAI_API_URLS:-http://localhost:3000/api}"
+for URL in "${API_URLS[@]}"; do
+    URL="${URL// /}"
+    [ -z "$URL" ] && continue
+    if curl -s -f --max-time 2 "$URL" > /dev/null 2>&1; then
+        echo -e "${GREEN}✓ $URL${NC}"
+        ALIVE=$((ALIVE + 1))
+    else
+        echo -e "${RED}✗ $URL не отвечает${NC}"
+    fi
+done
+if [ $ALIVE -gt 0 ]; then
+    echo -e "${GREEN}✓ Серверов доступно: $ALIVE${NC}"
 else
     echo -e "${RED}✗ Сервер не запущен!${NC}"
     echo -e "${YELLOW}Запустите сервер командой: bun run dev${NC}"
@@ -39,10 +51,10 @@ echo -e "${GREEN}✓ Python найден: $($PYTHON_CMD --version)${NC}"
 
 # Проверяем зависимости Python
 echo -e "${YELLOW}Проверка зависимостей...${NC}"
-$PYTHON_CMD -c "import requests, rich" 2>/dev/null
+$PYTHON_CMD -c "import requests, rich, pypdf" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo -e "${YELLOW}Установка зависимостей...${NC}"
-    pip install requests rich
+    pip install -r "$(dirname "$0")/requirements.txt"
 fi
 echo -e "${GREEN}✓ Зависимости установлены${NC}"
 
@@ -53,5 +65,7 @@ echo "                      Запуск чат-бота
 echo "═══════════════════════════════════════════════════════════════"
 echo -e "${NC}"
 
-cd "$(dirname "$0")"
-$PYTHON_CMD task_solver_bot.py
+# Без аргументов — интерактивный режим, с файлом задач — пакетный:
+#   ./run_bot.sh tasks.jsonl -o results.jsonl --concurrency 4
+# Каталог не меняем, чтобы относительные пути к задачам работали
+$PYTHON_CMD "$(dirname "$0")/task_solver_bot.py" "$@"
@@ -27,16 +27,28 @@ fi
 
 # Проверка зависимостей
 echo -e "${CYAN}Проверка зависимостей...${NC}"
-$PYTHON -c "import PyQt6, requests" 2>/dev/null
+$PYTHON -c "import PyQt6, requests, numpy" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo -e "${CYAN}Установка зависимостей...${NC}"
-    pip install PyQt6 requests
+    pip install PyQt6 requests numpy
 fi
 
-# Проверка сервера
+# Проверка серверов (MKAI_API_URLS — несколько бэкендов через запятую)
 echo -e "${CYAN}Проверка сервера API...${NC}"
-if curl -s http://localhost:3000/api > /dev/null 2>&1; then
-    echo -e "${GREEN}✓ Сервер запущен${NC}"
+ALIVE=0
+IFS=',' read -ra API_URLS <<< "${MKAI_API_URLS:-http://localhost:3000/api}"
+for URL in "${API_URLS[@]}"; do
+    URL="${URL// /}"
+    [ -z "$URL" ] && continue
+    if curl -s -f --max-time 2 "$URL" > /dev/null 2>&1; then
+        echo -e "${GREEN}✓ $URL${NC}"
+        ALIVE=$((ALIVE + 1))
+    else
+        echo -e "${RED}✗ $URL не отвечает${NC}"
+    fi
+done
+if [ $ALIVE -gt 0 ]; then
+    echo -e "${GREEN}✓ Серверов доступно: $ALIVE${NC}"
 else
     echo -e "${RED}✗ Сервер не запущен!${NC}"
     echo -e "  Запустите сервер: cd /home/z/my-project && bun run dev"
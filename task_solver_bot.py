@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Пакетное решение задач по методике MKAI без графического интерфейса
+=====================================================
+Запуск: python task_solver_bot.py tasks.jsonl -o results.jsonl --concurrency 4
+Без файла задач — интерактивный режим: задача вводится в консоли
+Формат задачи (одна JSON-строка): {"id": "...", "task": "..."} или {"request_id", "title", "body"}
+Повторный запуск с тем же -o продолжает с места остановки
+"""
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from rich.console import Console
+from rich.progress import Progress, BarColumn, MofNCompleteColumn, TimeElapsedColumn, TextColumn
+
+from task_solver_core import API_URLS, METRICS, AnswerCache, APIClient, Stage, StagePipeline
+
+console = Console()
+
+
+# ============================================================
+# ЗАДАЧИ И ЧЕКПОИНТЫ
+# ============================================================
+
+def load_tasks(path: Path) -> List[dict]:
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                console.print(f"[yellow]⚠ Строка {n} пропущена: {e}[/yellow]")
+                continue
+            text = record.get("task") or record.get("message") or "\n\n".join(
+                part for part in (record.get("title"), record.get("body")) if part
+            )
+            if not text:
+                console.print(f"[yellow]⚠ Строка {n} пропущена: нет текста задачи[/yellow]")
+                continue
+            tasks.append({
+                "id": str(record.get("id") or record.get("request_id") or n),
+                "task": text,
+                "context": record.get("context", ""),
+            })
+    return tasks
+
+
+def parse_stages(value: str) -> List[Stage]:
+    by_id = {stage.value[0]: stage for stage in Stage}
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in by_id]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"неизвестные этапы: {', '.join(unknown)} (есть: {', '.join(by_id)})"
+        )
+    return [by_id[name] for name in names]
+
+
+class JsonlLog:
+    # Append-only JSONL: каждая запись сразу сбрасывается на диск
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def read(path: Path) -> List[dict]:
+        if not path.exists():
+            return []
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # строка, оборванная при аварийной остановке
+        return records
+
+
+class Checkpoint:
+    # Готовые задачи — успешные записи в файле результатов;
+    # ответы отдельных этапов — в соседнем .checkpoint.jsonl
+
+    def __init__(self, output: Path):
+        self.path = output.with_name(output.name + ".checkpoint.jsonl")
+        self.completed = {r["id"] for r in JsonlLog.read(output) if r.get("success")}
+        self.stages: Dict[str, Dict[str, str]] = {}
+        for record in JsonlLog.read(self.path):
+            self.stages.setdefault(record["id"], {})[record["stage"]] = record["response"]
+        self._log = JsonlLog(self.path)
+
+    def save_stage(self, task_id: str, stage: Stage, response: str):
+        self._log.write({"id": task_id, "stage": stage.value[0], "response": response})
+
+    def close(self):
+        self._log.close()
+
+
+# ============================================================
+# ПРОГОН
+# ============================================================
+
+def solve(pipeline: StagePipeline, task: dict, checkpoint: Checkpoint) -> dict:
+    def on_stage(stage: Stage, answer):
+        if not answer.content.startswith("❌"):
+            checkpoint.save_stage(task["id"], stage, answer.content)
+
+    started = time.perf_counter()
+    result = pipeline.run(
+        task["task"], context=task["context"],
+        session_id=f"bot-{task['id']}-{uuid.uuid4().hex[:6]}",
+        done=checkpoint.stages.get(task["id"]), on_stage=on_stage,
+    )
+    return {
+        "id": task["id"],
+        **result,
+        "elapsed": round(time.perf_counter() - started, 2),
+        "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def run_batch(args) -> int:
+    tasks = load_tasks(args.tasks)
+    if args.limit:
+        tasks = tasks[:args.limit]
+    if not args.resume:
+        for path in (args.output, args.output.with_name(args.output.name + ".checkpoint.jsonl")):
+            path.unlink(missing_ok=True)
+
+    checkpoint = Checkpoint(args.output)
+    pending = [t for t in tasks if t["id"] not in checkpoint.completed]
+    console.print(
+        f"[cyan]Задач: {len(tasks)}, уже решено: {len(tasks) - len(pending)}, "
+        f"в очереди: {len(pending)}[/cyan]"
+    )
+    if not pending:
+        checkpoint.close()
+        return 0
+
+    api = APIClient(args.api_url, pool_size=max(8, args.concurrency),
+                    answer_cache=AnswerCache() if args.answer_cache else None)
+    pipeline = StagePipeline(api, stages=args.stages)
+    output = JsonlLog(args.output)
+    failed = 0
+
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    try:
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(), MofNCompleteColumn(), TimeElapsedColumn(),
+            console=console,
+        ) as progress:
+            bar = progress.add_task("Решение задач", total=len(pending))
+            futures = {pool.submit(solve, pipeline, task, checkpoint): task for task in pending}
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"id": task["id"], "success": False, "error": str(e)}
+                output.write(record)
+                if not record.get("success"):
+                    failed += 1
+                    progress.console.print(
+                        f"[red]✗ {task['id']}: {record.get('error', '')[:120]}[/red]"
+                    )
+                progress.advance(bar)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        console.print("\n[yellow]Остановлено. Повторный запуск продолжит с места остановки.[/yellow]")
+        return 130
+    finally:
+        pool.shutdown(wait=True)
+        output.close()
+        checkpoint.close()
+
+    console.print(f"[green]✓ Готово: {len(pending) - failed}[/green], "
+                  f"[red]ошибок: {failed}[/red] → {args.output}")
+    return 1 if failed else 0
+
+
+def run_interactive(args) -> int:
+    api = APIClient(args.api_url, answer_cache=AnswerCache() if args.answer_cache else None)
+    pipeline = StagePipeline(api, stages=args.stages)
+
+    def on_stage(stage: Stage, answer):
+        console.print()
+        console.rule(f"[cyan]✓ {stage.value[1]}[/cyan]")
+
+    console.print("[cyan]Введите задачу (пустая строка — выход):[/cyan]")
+    while True:
+        try:
+            task = console.input("[bold]> [/bold]").strip()
+        except (EOFError, KeyboardInterrupt):
+            return 0
+        if not task:
+            return 0
+        result = pipeline.run(
+            task, session_id=f"bot-{uuid.uuid4().hex[:8]}",
+            on_stage=on_stage,
+            on_chunk=lambda text: console.print(text, end="", markup=False, highlight=False),
+        )
+        if not result["success"]:
+            console.print(f"[red]{result['error']}[/red]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное решение задач MKAI")
+    parser.add_argument("tasks", nargs="?", type=Path, help="JSONL-файл задач")
+    parser.add_argument("-o", "--output", type=Path, help="JSONL-файл результатов")
+    parser.add_argument("--concurrency", type=int, default=4, help="задач одновременно")
+    parser.add_argument("--stages", type=parse_stages, default=list(Stage),
+                        help="этапы через запятую (по умолчанию все: analysis..solution)")
+    parser.add_argument("--api-url", type=lambda value: [u.strip() for u in value.split(",") if u.strip()],
+                        default=API_URLS, help="адрес API; несколько бэкендов — через запятую")
+    parser.add_argument("--limit", type=int, default=0, help="решить только первые N задач")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="начать заново, удалив прошлые результаты")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="отвечать на повторные и почти те же вопросы этапа из локального кэша")
+    parser.add_argument("--metrics", type=Path,
+                        help="выгрузить метрики по завершении (.json или текст Prometheus)")
+    args = parser.parse_args()
+
+    if not args.tasks:
+        return run_interactive(args)
+    if not args.tasks.exists():
+        console.print(f"[red]✗ Файл задач не найден: {args.tasks}[/red]")
+        return 2
+    args.output = args.output or args.tasks.with_name(args.tasks.stem + ".results.jsonl")
+    try:
+        return run_batch(args)
+    finally:
+        if args.metrics:
+            text = METRICS.to_json() if args.metrics.suffix == ".json" else METRICS.to_prometheus()
+            args.metrics.write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
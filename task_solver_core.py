@@ -0,0 +1,2091 @@
+"""
+Ядро MKAI без Qt: API-клиент, кэши, хранилища, контекст диалога и конвейер этапов
+=====================================================
+Общее для task_solver_desktop.py (GUI) и task_solver_bot.py (пакетный режим):
+импорт этого модуля не тянет PyQt6 и графический стек
+"""
+import os
+import re
+import time
+import json
+import math
+import heapq
+import uuid
+import zlib
+import gzip
+import codecs
+import sqlite3
+import hashlib
+import random
+import socket
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from typing import Optional, List, Dict, Callable, Iterator, Any, Union, TYPE_CHECKING
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, Future, FIRST_COMPLETED, as_completed,
+    wait as wait_futures
+)
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from enum import Enum
+from datetime import datetime
+
+if TYPE_CHECKING:
+    # requests (~100 мс импорта) загружается при первом сетевом запросе, см. APIClient.session
+    import requests
+
+
+# ============================================================
+# КОНСТАНТЫ И ТИПЫ
+# ============================================================
+
+API_URL = "http://localhost:3000/api"
+# Несколько экземпляров сервера: MKAI_API_URLS=http://a:3000/api,http://b:3000/api
+API_URLS = [
+    url.strip() for url in os.environ.get("MKAI_API_URLS", "").split(",") if url.strip()
+] or [API_URL]
+HEALTH_INTERVAL = 10         # сек. между проверками здоровья бэкендов
+HEALTH_TIMEOUT = 2           # сек. на ответ проверки
+LATENCY_EWMA_ALPHA = 0.3     # вес нового замера в скользящей средней задержки
+HEDGE_MIN_DELAY = 0.1        # сек. до дублирующего /search на второй бэкенд
+HEDGE_EWMA_FACTOR = 2.0      # …или столько средних задержек основного бэкенда
+HEDGE_POLL = 0.05            # сек. между проверками отмены при дублированном поиске
+CONNECT_TIMEOUT = 5          # сек. на установку соединения
+CHAT_READ_TIMEOUT = 120      # сек. ожидания ответа модели
+SEARCH_READ_TIMEOUT = 30
+SEARCH_CACHE_TTL = 15 * 60   # сек. жизни закэшированной выдачи
+SEARCH_CACHE_SIZE = 256      # запросов в памяти
+SEARCH_PAGE_SIZE = 10
+SEARCH_SOURCES = ("general", "scholar")
+SEARCH_FANOUT_PAGES = 2      # страниц выдачи каждого источника в режиме «Везде»
+SEARCH_RESULTS_LIMIT = 50    # результатов, хранимых после слияния
+SEARCH_PER_DOMAIN = 3        # не больше результатов с одного домена
+SEARCH_PREFETCH_QUERIES = 3  # упреждающих запросов по ответу этапа «Цели»
+SEARCH_QUERY_WORDS = 10      # слов в одном упреждающем запросе
+ANSWER_CACHE_ENABLED = os.environ.get("MKAI_ANSWER_CACHE") == "1"  # кэш ответов — по желанию
+ANSWER_CACHE_TTL = 24 * 60 * 60   # сек. жизни закэшированного ответа
+ANSWER_CACHE_SIZE = 512           # ответов в памяти
+ANSWER_CACHE_THRESHOLD = 0.9      # косинусная близость «почти того же» вопроса
+ANSWER_VECTOR_DIM = 4096          # размерность хэшированного вектора n-грамм
+ANSWER_NGRAM = 3                  # символьные n-граммы
+PDF_READ_TIMEOUT = 60
+GZIP_MIN_BYTES = 4096        # тела запросов крупнее сжимаются gzip
+DOCUMENTS_RETRY_AFTER = 5 * 60  # сек. без повторной загрузки документов после её ошибки
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+PDF_CHUNK_PAGES = 8          # страниц на одну задачу процесса-извлекателя
+PDF_POOL_MIN_PAGES = 24      # меньшие PDF разбираются в текущем процессе
+PDF_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+SESSION_ID = os.environ.get("MKAI_SESSION") or str(uuid.uuid4())[:8]
+DATA_DIR = Path(os.environ.get("MKAI_DATA_DIR") or Path.home() / ".mkai")
+DOC_CACHE_MAX_BYTES = 256 * 1024 * 1024  # сжатого текста в кэше документов
+DOC_CHUNK_CHARS = 1200       # размер фрагмента документа в индексе
+DOC_CHUNK_OVERLAP = 200
+DOC_TOP_K = 6                # фрагментов документов в запросе
+DOC_TOKEN_BUDGET = 1500      # бюджет токенов на фрагменты документов
+HISTORY_PAGE_SIZE = 50       # сообщений, подгружаемых из истории за раз
+CONTEXT_TOKEN_BUDGET = 6000  # общий бюджет токенов запроса к /chat
+SUMMARY_TOKEN_LIMIT = 800    # сводка старых реплик
+NOTE_TOKEN_LIMIT = 300       # закреплённая заметка одного этапа
+METRICS_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class Stage(Enum):
+    ANALYSIS = ("analysis", "Анализ", "Постановка проблемы")
+    GOALS = ("goals", "Цели", "Формулирование целей")
+    PLANNING = ("planning", "План", "Планирование работы")
+    RESEARCH = ("research", "Поиск", "Исследование материалов")
+    WORK = ("work", "Работа", "Выполнение задач")
+    SOLUTION = ("solution", "Решение", "Итоговый ответ")
+
+
+# ============================================================
+# МОДЕЛИ ДАННЫХ
+# ============================================================
+
+@dataclass
+class Message:
+    role: str  # 'user' | 'assistant'
+    content: str
+    timestamp: datetime = field(default_factory=datetime.now)
+    stage: str = ""              # этап, на котором задан вопрос/получен ответ
+    id: Optional[int] = None     # rowid в хранилище сессий
+    tokens: int = 0              # оценка токенов, считается при попадании в контекст
+    cached: bool = False         # ответ взят из локального кэша, без запроса к /chat
+
+
+@dataclass
+class Document:
+    filename: str
+    content: str
+    pages: int = 0
+    sha256: str = ""             # хэш исходного файла
+    content_sha256: str = ""     # хэш текста — ключ в реестре документов сервера
+
+
+@dataclass
+class SearchResult:
+    title: str
+    url: str
+    snippet: str
+    domain: str
+
+
+# ============================================================
+# МЕТРИКИ
+# ============================================================
+
+class Histogram:
+    # Кумулятивные корзины в стиле Prometheus, значения в миллисекундах
+
+    def __init__(self, buckets: tuple = METRICS_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        # Верхняя граница корзины, в которую попадает квантиль
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 1),
+            "max_ms": round(self.max, 1),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    # Счётчики, гистограммы и gauge-функции процесса; потокобезопасно.
+    # Ключ — имя метрики и отсортированные метки.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[tuple, float] = defaultdict(float)
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.gauges: Dict[tuple, Callable[[], float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name: str, value_ms: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value_ms)
+
+    def gauge(self, name: str, fn: Callable[[], float], **labels):
+        # Значение считается в момент снимка: размеры кэшей, число виджетов
+        with self._lock:
+            self.gauges[self._key(name, labels)] = fn
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000, **labels)
+
+    def total(self, name: str, **labels) -> float:
+        # Сумма счётчика по всем сериям, метки которых включают заданные
+        want = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(value for (n, l), value in self.counters.items()
+                       if n == name and want <= set(l))
+
+    def series(self, name: str) -> List[tuple]:
+        with self._lock:
+            return [(dict(labels), h.to_dict())
+                    for (n, labels), h in sorted(self.histograms.items()) if n == name]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: h.to_dict() for key, h in self.histograms.items()}
+            gauges = dict(self.gauges)
+        gauge_values = {}
+        for key, fn in gauges.items():
+            try:
+                gauge_values[key] = float(fn())
+            except Exception:
+                continue  # источник gauge уже закрыт
+
+        def label_str(labels: tuple) -> str:
+            return ",".join(f"{k}={v}" for k, v in labels)
+
+        def flatten(items: dict) -> dict:
+            return {f"{name}{{{label_str(labels)}}}" if labels else name: value
+                    for (name, labels), value in sorted(items.items())}
+
+        return {
+            "counters": flatten(counters),
+            "gauges": flatten(gauge_values),
+            "histograms": flatten(histograms),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            **self.snapshot()
+        }, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        def labels_text(labels: tuple, extra: str = "") -> str:
+            parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.count, h.sum))
+                for key, h in self.histograms.items()
+            )
+            gauges = sorted(self.gauges.items())
+
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{labels_text(labels)} {value:g}")
+        for (name, labels), fn in gauges:
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{labels_text(labels)} {value:g}")
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{labels_text(labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{labels_text(labels, le)} {count}")
+            lines.append(f"{name}_sum{labels_text(labels)} {total:.3f}")
+            lines.append(f"{name}_count{labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+# ============================================================
+# КЭШ ПОИСКА
+# ============================================================
+
+class SearchCache:
+    # TTL + LRU в памяти, опционально SQLite на диске.
+    # Одинаковые запросы «в полёте» объединяются в один HTTP-вызов.
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_SIZE,
+                 path: Optional[Path] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, expires REAL NOT NULL, results TEXT NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM search_cache WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(query: str, num: int, source: str, page: int = 1) -> str:
+        return json.dumps([" ".join(query.casefold().split()), num, source, page], ensure_ascii=False)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], List[SearchResult]]) -> List[SearchResult]:
+        with self._lock:
+            cached = self._get(key)
+            if cached is not None:
+                self.hits += 1
+                METRICS.inc("mkai_cache_requests_total", cache="search", result="hit")
+                return cached
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        METRICS.inc("mkai_cache_requests_total", cache="search",
+                    result="miss" if owner else "coalesced")
+        if not owner:
+            try:
+                return list(future.result())
+            except RequestCancelled:
+                # Владелец запроса отменён (вытеснен новым поиском) — запрашиваем сами
+                return self.get_or_fetch(key, fetch)
+
+        try:
+            results = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._put(key, results)
+            self._inflight.pop(key, None)
+        future.set_result(results)
+        return list(results)
+
+    def _get(self, key: str) -> Optional[List[SearchResult]]:
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, results = entry
+            if expires > now:
+                self.entries.move_to_end(key)
+                return list(results)
+            del self.entries[key]
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT expires, results FROM search_cache WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        results = [SearchResult(**r) for r in json.loads(row[1])]
+        self._remember(key, row[0], results)
+        return list(results)
+
+    def _put(self, key: str, results: List[SearchResult]):
+        expires = time.time() + self.ttl
+        self._remember(key, expires, results)
+        if self._conn is not None:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?)",
+                (key, expires, json.dumps([asdict(r) for r in results], ensure_ascii=False))
+            )
+            self._conn.commit()
+
+    def _remember(self, key: str, expires: float, results: List[SearchResult]):
+        self.entries[key] = (expires, list(results))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.entries),
+        }
+
+
+# ============================================================
+# КЭШ ОТВЕТОВ
+# ============================================================
+
+# Числа (с дробной частью и %), латинские идентификаторы, операторы
+_ANSWER_ANCHOR_RE = re.compile(r"\d+(?:[.,]\d+)*%?|[a-z_][a-z0-9_]*|[-+*/^=<>]")
+
+
+@dataclass
+class CachedAnswer:
+    bucket: str      # этап + отпечаток контекста
+    text: str        # нормализованный вопрос
+    anchors: str     # числа, идентификаторы и операторы вопроса, см. AnswerCache.anchors
+    response: str
+    expires: float
+    vector: Any      # numpy-вектор n-грамм, единичной длины
+
+
+class AnswerCache:
+    # Ответы /chat по ключу «этап + нормализованный вопрос + отпечаток документов
+    # и выдачи поиска». Сначала точное совпадение, затем почти тот же вопрос:
+    # косинусная близость хэшированных векторов символьных n-грамм (NumPy, локально).
+    # Близость не различает «2024» и «2025» или «10%» и «40%» в длинном общем
+    # промпте, поэтому «якоря» вопроса — числа, латинские идентификаторы и
+    # операторы — должны совпадать точно. TTL + LRU, как у SearchCache.
+
+    def __init__(self, ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_SIZE,
+                 threshold: float = ANSWER_CACHE_THRESHOLD, dim: int = ANSWER_VECTOR_DIM):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dim = dim
+        self.entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._buckets: Dict[str, tuple] = {}  # bucket → (ключи, матрица векторов)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        return " ".join(re.findall(r"\w+", message.casefold().replace("ё", "е")))
+
+    @staticmethod
+    def anchors(message: str) -> str:
+        # normalize() выбрасывает знаки: без них x^2-5x+6 и x^2+5x-6 неотличимы
+        return " ".join(_ANSWER_ANCHOR_RE.findall(message.casefold()))
+
+    @staticmethod
+    def fingerprint(context: str, docs: Optional[list]) -> str:
+        # Набор документов, а не выбранные фрагменты: они зависят от формулировки вопроса
+        digest = hashlib.sha256(context.encode("utf-8"))
+        parts = sorted({
+            DocumentRegistry.content_hash(d.doc) if isinstance(d, DocumentChunk)
+            else hashlib.sha256(d.encode("utf-8")).hexdigest()
+            for d in docs or []
+        })
+        for part in parts:
+            digest.update(part.encode("ascii"))
+        return digest.hexdigest()
+
+    def _vector(self, text: str):
+        import numpy as np
+
+        padded = f" {text} "
+        grams = [padded[i:i + ANSWER_NGRAM] for i in range(max(1, len(padded) - ANSWER_NGRAM + 1))]
+        indices = [zlib.crc32(gram.encode("utf-8")) % self.dim for gram in grams]
+        vector = np.bincount(indices, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, stage: str, message: str, fingerprint: str) -> Optional[str]:
+        text = self.normalize(message)
+        anchors = self.anchors(message)
+        bucket = f"{stage}:{fingerprint}"
+        key = f"{bucket}:{text}|{anchors}"
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires > now:
+                self.entries.move_to_end(key)
+                METRICS.inc("mkai_cache_requests_total", cache="answers", result="hit")
+                return entry.response
+            if entry is not None:
+                self._remove(key)
+            keys, matrix = self._matrix(bucket)
+        if keys:
+            import numpy as np
+
+            scores = matrix @ self._vector(text)
+            with self._lock:
+                for index in np.argsort(scores)[::-1]:
+                    if scores[index] < self.threshold:
+                        break
+                    entry = self.entries.get(keys[index])
+                    if entry is None or entry.expires <= now or entry.anchors != anchors:
+                        continue
+                    self.entries.move_to_end(keys[index])
+                    METRICS.inc("mkai_cache_requests_total", cache="answers", result="near")
+                    return entry.response
+        METRICS.inc("mkai_cache_requests_total", cache="answers", result="miss")
+        return None
+
+    def put(self, stage: str, message: str, fingerprint: str, response: str):
+        text = self.normalize(message)
+        anchors = self.anchors(message)
+        bucket = f"{stage}:{fingerprint}"
+        key = f"{bucket}:{text}|{anchors}"
+        entry = CachedAnswer(bucket, text, anchors, response, time.time() + self.ttl,
+                             self._vector(text))
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self._buckets.pop(bucket, None)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self._buckets.pop(entry.bucket, None)
+
+    def _matrix(self, bucket: str) -> tuple:
+        # Матрица векторов группы собирается заново только после её изменения
+        cached = self._buckets.get(bucket)
+        if cached is None:
+            keys = [key for key, entry in self.entries.items() if entry.bucket == bucket]
+            matrix = None
+            if keys:
+                import numpy as np
+                matrix = np.stack([self.entries[key].vector for key in keys])
+            cached = self._buckets[bucket] = (keys, matrix)
+        return cached
+
+
+# ============================================================
+# СЛИЯНИЕ РЕЗУЛЬТАТОВ ПОИСКА
+# ============================================================
+
+TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "ref", "ref_src"}
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ))
+    return f"{host}{parts.path.rstrip('/')}" + (f"?{query}" if query else "")
+
+
+class SearchAggregator:
+    # Reciprocal rank fusion по нормализованным URL: результат, найденный
+    # несколькими источниками, поднимается выше; домены ограничены квотой
+    RRF_K = 60
+
+    def __init__(self, per_domain: int = SEARCH_PER_DOMAIN, limit: int = SEARCH_RESULTS_LIMIT):
+        self.per_domain = per_domain
+        self.limit = limit
+        self.entries: Dict[str, list] = {}
+        self.fresh: set = set()
+
+    def add(self, results: List[SearchResult], offset: int = 0, weight: float = 1.0,
+            fresh: bool = True):
+        for rank, result in enumerate(results, start=offset):
+            key = normalize_url(result.url)
+            score = weight / (self.RRF_K + rank + 1)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [score, result]
+            else:
+                entry[0] += score
+                if len(result.snippet) > len(entry[1].snippet):
+                    entry[1] = result
+            if fresh:
+                self.fresh.add(key)
+
+    def ranked(self) -> List[SearchResult]:
+        per_domain: Counter = Counter()
+        ranked: List[SearchResult] = []
+        for _, result in sorted(self.entries.values(), key=lambda entry: -entry[0]):
+            domain = result.domain.lower()
+            if domain.startswith("www."):
+                domain = domain[4:]
+            if per_domain[domain] >= self.per_domain:
+                continue
+            per_domain[domain] += 1
+            ranked.append(result)
+            if len(ranked) >= self.limit:
+                break
+        return ranked
+
+
+def format_search_context(results: List[SearchResult], limit: int = 5) -> str:
+    return "\n".join(
+        f"[{r.domain}] {r.title}: {r.snippet[:150]}" for r in results[:limit]
+    )
+
+
+# ============================================================
+# API КЛИЕНТ
+# ============================================================
+
+class RequestCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    # Отмена запроса из другого потока. cancel() обрывает соединение текущего
+    # ответа; до прихода заголовков запрос прерывается сразу после них,
+    # а генерацию на сервере останавливает APIClient.cancel_chat(token).
+
+    def __init__(self):
+        self.request_id = uuid.uuid4().hex
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self.route: Optional[str] = None  # бэкенд, на который ушёл запрос
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise RequestCancelled()
+
+    def wait(self, seconds: float):
+        # Пауза между повторами, прерываемая отменой
+        if self._event.wait(seconds):
+            raise RequestCancelled()
+
+    def attach(self, response: "requests.Response"):
+        with self._lock:
+            self._response = response
+        if self._event.is_set():
+            self._abort(response)
+            raise RequestCancelled()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            response, self._response = self._response, None
+        if response is not None:
+            self._abort(response)
+
+    @staticmethod
+    def _abort(response: "requests.Response"):
+        # shutdown() будит поток, заблокированный в recv; одного close() для этого мало
+        connection = getattr(response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+
+class DocumentRegistry:
+    # Какие документы уже лежат на сервере. Текст документа загружается на
+    # /documents один раз, а в /chat уходят только хэш и границы фрагментов.
+
+    def __init__(self):
+        self.supported: Optional[bool] = None  # None — сервер ещё не проверялся
+        self.retry_at = 0.0  # time.monotonic(), до которого загрузка не повторяется
+        self._uploaded: set = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(doc: Document) -> str:
+        if not doc.content_sha256:
+            doc.content_sha256 = hashlib.sha256(doc.content.encode("utf-8")).hexdigest()
+        return doc.content_sha256
+
+    def missing(self, docs: List[Document]) -> List[Document]:
+        with self._lock:
+            return [doc for doc in docs if self.content_hash(doc) not in self._uploaded]
+
+    def mark(self, docs: List[Document]):
+        with self._lock:
+            self._uploaded.update(self.content_hash(doc) for doc in docs)
+
+    def forget(self, hashes: List[str]):
+        with self._lock:
+            self._uploaded.difference_update(hashes)
+
+
+@dataclass(eq=False)
+class Backend:
+    url: str
+    healthy: bool = True
+    inflight: int = 0
+    failures: int = 0
+    latency: Dict[str, float] = field(default_factory=dict)  # эндпоинт → EWMA, мс; "/" — проверки
+    documents: DocumentRegistry = field(default_factory=DocumentRegistry)  # у каждого сервера свой
+
+
+class BackendPool:
+    # Запрос идёт на здоровый бэкенд с наименьшей EWMA задержки с поправкой на
+    # запросы в полёте. Сбой соединения выводит бэкенд из ротации до следующей
+    # успешной фоновой проверки здоровья.
+
+    def __init__(self, urls: List[str], alpha: float = LATENCY_EWMA_ALPHA,
+                 interval: float = HEALTH_INTERVAL):
+        self.backends = [Backend(url.rstrip("/")) for url in urls]
+        self.alpha = alpha
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def healthy(self) -> List[Backend]:
+        return [backend for backend in self.backends if backend.healthy]
+
+    def pick(self, path: str = "/", exclude: tuple = ()) -> Optional[Backend]:
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if not candidates:
+                # Все помечены недоступными — пробуем любой, а не отказываем сразу
+                candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            # Задержки сравнимы, только если у всех кандидатов есть замер этого эндпоинта
+            key = path if all(path in b.latency for b in candidates) else "/"
+            # Ещё не измеренный бэкенд получает запрос первым — так появляется оценка
+            return min(candidates, key=lambda b: b.latency.get(key, 0.0) * (1 + b.inflight))
+
+    def hedge_delay(self, backend: Backend, path: str) -> float:
+        # EWMA вместо перцентиля: дубль уходит, когда ответ заметно медленнее обычного
+        ewma = backend.latency.get(path, backend.latency.get("/", 0.0))
+        return max(HEDGE_MIN_DELAY, HEDGE_EWMA_FACTOR * ewma / 1000)
+
+    @contextmanager
+    def track(self, backend: Backend):
+        with self._lock:
+            backend.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                backend.inflight -= 1
+
+    def observe(self, backend: Backend, path: str, elapsed_ms: float, ok: bool = True):
+        # ok=False — замер без ответа (проигравший дублированный запрос):
+        # задержка учитывается как нижняя оценка, здоровье не меняется
+        with self._lock:
+            previous = backend.latency.get(path)
+            backend.latency[path] = elapsed_ms if previous is None else (
+                self.alpha * elapsed_ms + (1 - self.alpha) * previous
+            )
+            if ok:
+                backend.healthy = True
+                backend.failures = 0
+
+    def fail(self, backend: Backend):
+        with self._lock:
+            backend.healthy = False
+            backend.failures += 1
+
+    def start(self, probe: Callable[[str], Any]):
+        # probe(url) бросает исключение, если бэкенд недоступен.
+        # С одним бэкендом выбирать не из чего — проверки не запускаются.
+        with self._lock:
+            if len(self.backends) < 2 or self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._probe_loop, args=(probe,), name="mkai-health", daemon=True
+            )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _probe_loop(self, probe: Callable[[str], Any]):
+        while True:
+            for backend in self.backends:
+                started = time.perf_counter()
+                try:
+                    probe(backend.url)
+                except Exception:
+                    self.fail(backend)
+                    continue
+                self.observe(backend, "/", (time.perf_counter() - started) * 1000)
+            if self._stop.wait(self.interval):
+                return
+
+
+class APIClient:
+    
+    def __init__(self, urls: Union[str, List[str]] = API_URLS,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = CHAT_READ_TIMEOUT, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, pool_size: int = 8,
+                 search_cache: Optional[SearchCache] = None,
+                 answer_cache: Optional[AnswerCache] = None):
+        self.pool = BackendPool([urls] if isinstance(urls, str) else list(urls))
+        self.session_id = SESSION_ID
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.search_cache = search_cache or SearchCache()
+        self.answer_cache = answer_cache
+        self._session: Optional["requests.Session"] = None
+        self._session_lock = threading.Lock()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        METRICS.gauge("mkai_search_cache_entries", lambda: len(self.search_cache.entries))
+        METRICS.gauge("mkai_backends_healthy", lambda: len(self.pool.healthy()))
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session(self.pool_size)
+            # Проверки здоровья стартуют вместе с первым сетевым запросом
+            self.pool.start(self._probe)
+        return self._session
+
+    def _probe(self, url: str):
+        self.session.get(url, timeout=(HEALTH_TIMEOUT, HEALTH_TIMEOUT)).raise_for_status()
+
+    @staticmethod
+    def _create_session(pool_size: int) -> "requests.Session":
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        # pool_block=True: при исчерпании пула запросы ждут свободное соединение
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=0, pool_block=True
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        return session
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _request(self, method: str, path: str, read_timeout: Optional[float] = None,
+                 cancel: Optional[CancelToken] = None, backend: Optional[Backend] = None,
+                 failover: bool = True, **kwargs) -> "requests.Response":
+        # backend — предпочтительный бэкенд; при сбое запрос уходит на другой.
+        # Ответивший бэкенд — в response.backend.
+        import requests
+
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        sleep = cancel.wait if cancel else time.sleep
+        backend = backend or self.pool.pick(path)
+        tried: List[Backend] = []
+        attempt = 0
+        while True:
+            if cancel:
+                cancel.check()
+                cancel.route = backend.url
+            started = time.perf_counter()
+            try:
+                with self.pool.track(backend):
+                    response = self.session.request(
+                        method, f"{backend.url}{path}", timeout=timeout, **kwargs
+                    )
+            except requests.ConnectionError:
+                # Обрыв/сброс соединения — повторяем; таймаут чтения не повторяем
+                METRICS.inc("mkai_http_errors_total", endpoint=path, error="connection")
+                if cancel:
+                    # Оборванный отменой запрос — не сбой бэкенда
+                    cancel.check()
+                self.pool.fail(backend)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                METRICS.inc("mkai_http_retries_total", endpoint=path)
+                backend, switched = self._next_backend(backend, tried, path, failover)
+                if not switched:
+                    sleep(self._backoff(attempt - 1))
+                continue
+            except requests.Timeout:
+                METRICS.inc("mkai_http_errors_total", endpoint=path, error="timeout")
+                raise
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            response.backend = backend
+            self._record(path, response, started, streamed=kwargs.get("stream", False))
+            if cancel:
+                cancel.attach(response)
+            if response.status_code >= 500:
+                # Ошибка сервера выводит бэкенд из ротации, как и обрыв соединения
+                self.pool.fail(backend)
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                response.close()
+                attempt += 1
+                METRICS.inc("mkai_http_retries_total", endpoint=path)
+                backend, switched = self._next_backend(backend, tried, path, failover)
+                if not switched:
+                    sleep(delay)
+                continue
+            if response.status_code < 500:
+                self.pool.observe(backend, path, elapsed_ms)
+            return response
+
+    def _next_backend(self, backend: Backend, tried: List[Backend], path: str,
+                      failover: bool) -> tuple:
+        # (бэкенд, сменился ли): на другой бэкенд повтор уходит сразу, без паузы
+        tried.append(backend)
+        if not failover:
+            return backend, False
+        other = self.pool.pick(path, exclude=tuple(tried))
+        if other is None:
+            return backend, False
+        METRICS.inc("mkai_http_failovers_total", endpoint=path)
+        return other, True
+
+    @staticmethod
+    def _record(path: str, response: "requests.Response", started: float, streamed: bool):
+        # Для потоковых ответов — время до заголовков; тело считается в chat_stream
+        METRICS.observe("mkai_http_request_ms", (time.perf_counter() - started) * 1000,
+                        endpoint=path)
+        METRICS.inc("mkai_http_requests_total", endpoint=path, status=response.status_code)
+        body = response.request.body if response.request is not None else None
+        if body:
+            METRICS.inc("mkai_http_sent_bytes_total",
+                        len(body.encode("utf-8") if isinstance(body, str) else body),
+                        endpoint=path)
+        if not streamed:
+            METRICS.inc("mkai_http_received_bytes_total", len(response.content), endpoint=path)
+
+    @staticmethod
+    def _json(response: "requests.Response") -> dict:
+        try:
+            return response.json()
+        except ValueError:
+            return {"success": False, "error": f"HTTP {response.status_code}"}
+    
+    @staticmethod
+    def _gzip_json(data: Any, compress: bool = True) -> tuple:
+        # (тело, заголовки): мелкие тела дешевле отправить как есть
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if compress and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def upload_documents(self, docs: List[Document], cancel: Optional[CancelToken] = None,
+                         backend: Optional[Backend] = None) -> bool:
+        # Реестр у каждого бэкенда свой: загрузка на один сервер не видна другому
+        backend = backend or self.pool.pick("/documents")
+        missing = backend.documents.missing(docs)
+        if not missing:
+            return True
+        body, headers = self._gzip_json({
+            "sessionId": self.session_id,
+            "documents": [
+                {"sha256": DocumentRegistry.content_hash(doc), "filename": doc.filename,
+                 "pages": doc.pages, "content": doc.content}
+                for doc in missing
+            ]
+        })
+        response = self._request("POST", "/documents", data=body, headers=headers,
+                                 read_timeout=PDF_READ_TIMEOUT, cancel=cancel, backend=backend)
+        # При сбое загрузка могла уйти на другой бэкенд — отмечаем в его реестре
+        registry = response.backend.documents
+        if response.status_code in (404, 405, 501):
+            # Старый сервер без реестра — документы уходят текстом в каждом /chat
+            registry.supported = False
+            return False
+        response.raise_for_status()
+        registry.supported = True
+        registry.mark(missing)
+        return True
+
+    def _document_fields(self, docs: Optional[list], cancel: Optional[CancelToken] = None,
+                         backend: Optional[Backend] = None) -> dict:
+        # docs — фрагменты DocumentChunk (по возможности отправляются ссылками) или готовый текст
+        docs = docs or []
+        chunks = [d for d in docs if isinstance(d, DocumentChunk)]
+        texts = [d for d in docs if not isinstance(d, DocumentChunk)]
+        backend = backend or self.pool.pick("/chat")
+        registry = backend.documents
+        # После ошибки загрузки (413, 5xx) документы какое-то время идут текстом,
+        # а не загружаются заново с каждым сообщением
+        if chunks and registry.supported is not False and time.monotonic() >= registry.retry_at:
+            try:
+                uploaded = self.upload_documents(
+                    list({id(chunk.doc): chunk.doc for chunk in chunks}.values()), cancel, backend
+                )
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                METRICS.inc("mkai_errors_total", op="documents", error=type(e).__name__)
+                registry.retry_at = time.monotonic() + DOCUMENTS_RETRY_AFTER
+                uploaded = False
+            if uploaded:
+                return {
+                    "documents": texts,
+                    "documentRefs": [
+                        {"sha256": DocumentRegistry.content_hash(chunk.doc),
+                         "start": chunk.start, "end": chunk.end}
+                        for chunk in chunks
+                    ],
+                }
+        return {"documents": [chunk.formatted for chunk in chunks] + texts}
+
+    def _post_chat(self, payload: dict, docs: Optional[list], cancel: Optional[CancelToken] = None,
+                   backend: Optional[Backend] = None, headers: Optional[dict] = None,
+                   **kwargs) -> "requests.Response":
+        # Тело /chat (история, сводка, заметки) — UTF-8 без \uXXXX. gzip — только для
+        # бэкенда с реестром документов: старый сервер сжатое тело не разбирает
+        backend = backend or self.pool.pick("/chat")
+
+        def send(payload: dict, backend: Backend) -> "requests.Response":
+            compress = backend.documents.supported is True
+            body, body_headers = self._gzip_json(payload, compress)
+            return self._request("POST", "/chat", data=body,
+                                 headers={**body_headers, **(headers or {})},
+                                 cancel=cancel, backend=backend, **kwargs)
+
+        response = send(payload, backend)
+        if response.status_code == 409 and "documentRefs" in payload:
+            # Сервер потерял документы (перезапуск, вытеснение) или запрос ушёл
+            # на другой бэкенд после сбоя — загружаем их туда, где ждут ответа
+            backend = response.backend
+            # Без списка missingDocuments забываем все документы запроса
+            missing = self._json(response).get("missingDocuments") or [
+                ref["sha256"] for ref in payload["documentRefs"]
+            ]
+            response.close()
+            METRICS.inc("mkai_documents_reuploads_total")
+            backend.documents.forget(missing)
+            # Если загрузка не удалась, документы уходят текстом — старые ссылки убираем
+            payload = {key: value for key, value in payload.items() if key != "documentRefs"}
+            payload.update(self._document_fields(docs, cancel, backend))
+            response = send(payload, backend)
+        return response
+
+    def _chat_payload(self, message: str, stage: str, context: str, docs: Optional[list],
+                      conversation: Optional[dict], session_id: Optional[str] = None,
+                      cancel: Optional[CancelToken] = None,
+                      backend: Optional[Backend] = None) -> dict:
+        payload = {
+            "message": message,
+            "sessionId": session_id or self.session_id,
+            "stage": stage,
+            "context": context,
+            **self._document_fields(docs, cancel, backend)
+        }
+        if cancel:
+            # По requestId сервер находит генерацию для /chat/cancel
+            payload["requestId"] = cancel.request_id
+        if conversation:
+            # history/summary/notes — сервер может не хранить историю сам
+            payload.update(conversation)
+        return payload
+
+    def _cached_answer(self, message: str, stage: str, fingerprint: str) -> Optional[dict]:
+        if self.answer_cache is None:
+            return None
+        try:
+            response = self.answer_cache.get(stage, message, fingerprint)
+        except Exception as e:
+            # Кэш — ускорение, а не условие ответа (например, нет numpy): идём на сервер
+            METRICS.inc("mkai_errors_total", op="answer_cache", error=type(e).__name__)
+            return None
+        if response is None:
+            return None
+        return {"success": True, "response": response, "cached": True}
+
+    def _remember_answer(self, message: str, stage: str, fingerprint: str, result: dict) -> dict:
+        if self.answer_cache is not None and result.get("success") and result.get("response"):
+            try:
+                self.answer_cache.put(stage, message, fingerprint, result["response"])
+            except Exception as e:
+                METRICS.inc("mkai_errors_total", op="answer_cache", error=type(e).__name__)
+        return result
+
+    def chat(self, message: str, stage: str, context: str = "", docs: Optional[list] = None,
+             conversation: Optional[dict] = None, session_id: Optional[str] = None,
+             cancel: Optional[CancelToken] = None) -> dict:
+        fingerprint = AnswerCache.fingerprint(context, docs) if self.answer_cache else ""
+        cached = self._cached_answer(message, stage, fingerprint)
+        if cached is not None:
+            return cached
+        # Документы и сам вопрос — на один бэкенд, иначе ссылки на документы там не найдутся
+        backend = self.pool.pick("/chat")
+        try:
+            response = self._post_chat(
+                self._chat_payload(message, stage, context, docs, conversation,
+                                   session_id, cancel, backend),
+                docs, cancel=cancel, backend=backend
+            )
+            return self._remember_answer(message, stage, fingerprint, self._json(response))
+        except Exception as e:
+            if cancel and cancel.cancelled:
+                return {"success": False, "cancelled": True, "error": "Запрос отменён"}
+            METRICS.inc("mkai_errors_total", op="chat", error=type(e).__name__)
+            return {"success": False, "error": str(e)}
+    
+    def chat_stream(self, message: str, stage: str, context: str = "", docs: Optional[list] = None,
+                    on_chunk: Optional[Callable[[str], None]] = None,
+                    conversation: Optional[dict] = None, session_id: Optional[str] = None,
+                    cancel: Optional[CancelToken] = None) -> dict:
+        started = time.perf_counter()
+        first_token: List[float] = []
+
+        def emit(text: str):
+            if not first_token:
+                first_token.append(time.perf_counter())
+                METRICS.observe("mkai_chat_first_token_ms", (first_token[0] - started) * 1000)
+            if on_chunk:
+                on_chunk(text)
+
+        fingerprint = AnswerCache.fingerprint(context, docs) if self.answer_cache else ""
+        cached = self._cached_answer(message, stage, fingerprint)
+        if cached is not None:
+            emit(cached["response"])
+            return cached
+        backend = self.pool.pick("/chat")
+        try:
+            response = self._post_chat(
+                {
+                    **self._chat_payload(message, stage, context, docs, conversation,
+                                         session_id, cancel, backend),
+                    "stream": True
+                },
+                docs,
+                cancel=cancel,
+                backend=backend,
+                headers={"Accept": "text/event-stream, application/x-ndjson, application/json"},
+                stream=True
+            )
+            with response, METRICS.timer("mkai_chat_stream_ms"):
+                content_type = response.headers.get("Content-Type", "")
+                if "text/event-stream" in content_type:
+                    events = self._iter_sse(response)
+                elif "ndjson" in content_type or "jsonl" in content_type:
+                    events = self._iter_ndjson(response)
+                else:
+                    # Сервер не умеет стримить — обычный JSON-ответ целиком
+                    return self._remember_answer(message, stage, fingerprint, self._json(response))
+
+                parts: List[str] = []
+                for event in events:
+                    if event.get("error"):
+                        return {"success": False, "error": event["error"]}
+                    if event.get("done"):
+                        # Финальное событие может содержать полный текст ответа
+                        if isinstance(event.get("response"), str) and not parts:
+                            parts.append(event["response"])
+                            emit(event["response"])
+                        break
+                    delta = self._extract_delta(event)
+                    if delta:
+                        parts.append(delta)
+                        emit(delta)
+                if cancel:
+                    # Закрытый при отмене поток может закончиться без исключения
+                    cancel.check()
+                return self._remember_answer(
+                    message, stage, fingerprint, {"success": True, "response": "".join(parts)}
+                )
+        except Exception as e:
+            if cancel and cancel.cancelled:
+                METRICS.inc("mkai_http_cancelled_total", endpoint="/chat")
+                return {"success": False, "cancelled": True, "error": "Запрос отменён"}
+            METRICS.inc("mkai_errors_total", op="chat", error=type(e).__name__)
+            return {"success": False, "error": str(e)}
+
+    def cancel_chat(self, cancel: CancelToken) -> bool:
+        # Без повторов и с коротким таймаутом: отмена — подсказка серверу, а не гарантия.
+        # Генерация идёт на том бэкенде, куда ушёл запрос, — туда и отправляется отмена.
+        if cancel.route is None:
+            return False
+        try:
+            response = self.session.post(
+                f"{cancel.route}/chat/cancel",
+                json={"requestId": cancel.request_id, "sessionId": self.session_id},
+                timeout=(self.connect_timeout, SEARCH_READ_TIMEOUT)
+            )
+            return response.ok
+        except Exception as e:
+            METRICS.inc("mkai_errors_total", op="chat_cancel", error=type(e).__name__)
+            return False
+
+    @staticmethod
+    def _iter_lines(response, endpoint: str = "/chat") -> Iterator[str]:
+        # chunk_size=None отдаёт данные по мере прихода chunked-блоков
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        for chunk in response.iter_content(chunk_size=None):
+            METRICS.inc("mkai_http_received_bytes_total", len(chunk), endpoint=endpoint)
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+        buffer += decoder.decode(b"", final=True)
+        if buffer:
+            yield buffer
+
+    def _iter_sse(self, response) -> Iterator[dict]:
+        data_lines: List[str] = []
+        for line in self._iter_lines(response):
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip(" "))
+                continue
+            if line or not data_lines:
+                continue
+            data = "\n".join(data_lines)
+            data_lines = []
+            if data == "[DONE]":
+                return
+            yield self._parse_event(data)
+        if data_lines and data_lines != ["[DONE]"]:
+            yield self._parse_event("\n".join(data_lines))
+
+    def _iter_ndjson(self, response) -> Iterator[dict]:
+        for line in self._iter_lines(response):
+            if line.strip():
+                yield self._parse_event(line)
+
+    @staticmethod
+    def _parse_event(data: str) -> dict:
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return {"delta": data}
+        return event if isinstance(event, dict) else {"delta": str(event)}
+
+    @staticmethod
+    def _extract_delta(event: dict) -> str:
+        for key in ("delta", "content", "token", "text"):
+            value = event.get(key)
+            if isinstance(value, str):
+                return value
+        choices = event.get("choices")
+        if choices:
+            return (choices[0].get("delta") or {}).get("content") or ""
+        return ""
+
+    def search(self, query: str, source: str = "general", num: int = SEARCH_PAGE_SIZE,
+               page: int = 1, cancel: Optional[CancelToken] = None) -> List[SearchResult]:
+        try:
+            return self.search_cache.get_or_fetch(
+                SearchCache.make_key(query, num, source, page),
+                lambda: self._fetch_search(query, source, num, page, cancel)
+            )
+        except RequestCancelled:
+            METRICS.inc("mkai_http_cancelled_total", endpoint="/search")
+            return []
+        except Exception as e:
+            # Поиск не должен ронять интерфейс: пустая выдача, причина — в метриках
+            METRICS.inc("mkai_errors_total", op="search", error=type(e).__name__)
+            return []
+
+    def _fetch_search(self, query: str, source: str, num: int, page: int = 1,
+                      cancel: Optional[CancelToken] = None) -> List[SearchResult]:
+        params = {"q": query, "num": num, "source": source}
+        if page > 1:
+            params["page"] = page
+        hedge = len(self.pool.healthy()) > 1
+        streamed = hedge or cancel is not None
+        if hedge:
+            response = self._hedged_search(params, cancel)
+        else:
+            response = self._request(
+                "GET", "/search",
+                params=params,
+                read_timeout=SEARCH_READ_TIMEOUT,
+                # stream: тело читается после attach(), и отмена обрывает его чтение
+                stream=streamed,
+                cancel=cancel
+            )
+        with response:
+            try:
+                if streamed:
+                    # _record не видит тела потоковых ответов — считаем после чтения
+                    METRICS.inc("mkai_http_received_bytes_total", len(response.content),
+                                endpoint="/search")
+                response.raise_for_status()
+                data = response.json()
+            except Exception:
+                if cancel:
+                    cancel.check()
+                raise
+        return [
+            SearchResult(
+                title=r["title"],
+                url=r["url"],
+                snippet=r.get("snippet", ""),
+                domain=r["domain"]
+            )
+            for r in data.get("results", [])
+        ]
+    
+    def _hedged_search(self, params: dict, cancel: Optional[CancelToken] = None) -> "requests.Response":
+        # /search идемпотентен: если основной бэкенд отвечает дольше обычного,
+        # тот же запрос уходит на второй; побеждает первый успешный ответ
+        if self._hedge_executor is None:
+            with self._session_lock:
+                if self._hedge_executor is None:
+                    # Каждый поиск занимает до двух потоков, а pool_size не меньше
+                    # числа одновременных запросов — иначе дубль ждёт в очереди
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=2 * self.pool_size, thread_name_prefix="mkai-hedge"
+                    )
+        attempts: Dict[Future, tuple] = {}  # future → (токен, бэкенд, момент отправки)
+
+        def send(backend: Backend) -> Future:
+            token = CancelToken()
+            future = self._hedge_executor.submit(
+                self._request, "GET", "/search", params=params, read_timeout=SEARCH_READ_TIMEOUT,
+                stream=True, cancel=token, backend=backend, failover=False
+            )
+            attempts[future] = (token, backend, time.perf_counter())
+            return future
+
+        primary = self.pool.pick("/search")
+        pending = {send(primary)}
+        deadline = time.monotonic() + self.pool.hedge_delay(primary, "/search")
+        hedged = False
+        fallback, error = None, None
+        try:
+            while pending:
+                if cancel:
+                    cancel.check()
+                timeout = HEDGE_POLL if hedged else min(HEDGE_POLL, max(0.0, deadline - time.monotonic()))
+                done, pending = wait_futures(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if response.ok:
+                        if response.backend is not primary:
+                            METRICS.inc("mkai_http_hedge_wins_total", endpoint="/search")
+                        attempts.pop(future)
+                        if cancel:
+                            cancel.attach(response)
+                        return response
+                    if fallback is not None:
+                        fallback.close()
+                    fallback = response
+                    attempts.pop(future)
+                if not hedged and (done or time.monotonic() >= deadline):
+                    hedged = True
+                    secondary = self.pool.pick("/search", exclude=(primary,))
+                    if secondary is not None:
+                        METRICS.inc("mkai_http_hedged_total", endpoint="/search")
+                        pending.add(send(secondary))
+        finally:
+            # Проигравшие запросы обрываются, их ответы закрываются. Время ожидания
+            # проигравшего — нижняя оценка его задержки: иначе бэкенд, быстрый на
+            # проверках и медленный на поиске, так и остался бы основным
+            for future, (token, backend, started) in attempts.items():
+                if not future.done():
+                    self.pool.observe(
+                        backend, "/search", (time.perf_counter() - started) * 1000, ok=False
+                    )
+                token.cancel()
+                future.add_done_callback(
+                    lambda f: f.result().close() if not f.cancelled() and f.exception() is None else None
+                )
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def extract_pdf(self, file_path: str) -> Optional[Document]:
+        try:
+            # Читаем файл целиком, чтобы повторная попытка могла отправить его заново
+            payload = Path(file_path).read_bytes()
+            response = self._request(
+                "POST", "/pdf",
+                files={"file": (Path(file_path).name, payload, "application/pdf")},
+                read_timeout=PDF_READ_TIMEOUT
+            )
+            data = response.json()
+            if data.get("success"):
+                return Document(
+                    filename=data["metadata"]["filename"],
+                    content=data["text"],
+                    pages=data["metadata"]["pages"]
+                )
+            METRICS.inc("mkai_errors_total", op="pdf", error="server")
+        except Exception as e:
+            METRICS.inc("mkai_errors_total", op="pdf", error=type(e).__name__)
+        return None
+
+
+# ============================================================
+# КЭШ ДОКУМЕНТОВ
+# ============================================================
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    # Извлечённый текст по SHA-256 файла; вытеснение по давности доступа
+
+    def __init__(self, path: Path = DATA_DIR / "documents.db",
+                 max_bytes: int = DOC_CACHE_MAX_BYTES):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                sha256 TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_accessed ON documents(accessed)")
+        self._conn.commit()
+
+    def get(self, sha256: str) -> Optional[Document]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, pages, content FROM documents WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is None:
+                METRICS.inc("mkai_cache_requests_total", cache="documents", result="miss")
+                return None
+            self._conn.execute(
+                "UPDATE documents SET accessed = ? WHERE sha256 = ?", (time.time(), sha256)
+            )
+            self._conn.commit()
+        METRICS.inc("mkai_cache_requests_total", cache="documents", result="hit")
+        filename, pages, blob = row
+        return Document(
+            filename=filename,
+            content=zlib.decompress(blob).decode("utf-8"),
+            pages=pages,
+            sha256=sha256
+        )
+
+    def put(self, doc: Document):
+        blob = zlib.compress(doc.content.encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                (doc.sha256, doc.filename, doc.pages, blob, len(blob), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT sha256, size FROM documents ORDER BY accessed").fetchall()
+        for sha256, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM documents WHERE sha256 = ?", (sha256,))
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ============================================================
+# ХРАНИЛИЩЕ СЕССИЙ
+# ============================================================
+
+class SessionStore:
+    # SQLite в режиме WAL: каждое сообщение — одна вставка в конец журнала,
+    # история читается страницами с конца, а не целиком
+
+    def __init__(self, path: Path = DATA_DIR / "sessions.db"):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                stage TEXT NOT NULL DEFAULT '',
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, id);
+            CREATE TABLE IF NOT EXISTS documents (
+                session_id TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                content BLOB NOT NULL,
+                added REAL NOT NULL,
+                PRIMARY KEY (session_id, sha256)
+            );
+            CREATE TABLE IF NOT EXISTS session_state (
+                session_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (session_id, key)
+            );
+        """)
+        self._conn.commit()
+
+    def _touch(self, session_id: str):
+        # Строка сессии появляется с первым сохранённым сообщением/документом
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR IGNORE INTO sessions (id, created, updated) VALUES (?, ?, ?)",
+            (session_id, now, now)
+        )
+        self._conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+
+    def list_sessions(self, limit: int = 50) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute("""
+                SELECT s.id, s.title, s.updated,
+                       (SELECT COUNT(*) FROM messages m WHERE m.session_id = s.id)
+                FROM sessions s ORDER BY s.updated DESC LIMIT ?
+            """, (limit,)).fetchall()
+
+    def append_message(self, session_id: str, message: Message):
+        with self._lock:
+            self._touch(session_id)
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, role, content, stage, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, message.role, message.content, message.stage,
+                 message.timestamp.timestamp())
+            )
+            message.id = cursor.lastrowid
+            if message.role == 'user':
+                # Заголовок сессии — первый вопрос пользователя
+                self._conn.execute(
+                    "UPDATE sessions SET title = ? WHERE id = ? AND title = ''",
+                    (message.content[:60], session_id)
+                )
+            self._conn.commit()
+
+    def load_messages(self, session_id: str, before_id: Optional[int] = None,
+                      limit: int = HISTORY_PAGE_SIZE) -> List[Message]:
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT id, role, content, stage, timestamp FROM messages
+                WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+            """, (session_id, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [
+            Message(
+                role=role,
+                content=content,
+                timestamp=datetime.fromtimestamp(ts),
+                stage=stage,
+                id=message_id
+            )
+            for message_id, role, content, stage, ts in reversed(rows)
+        ]
+
+    def add_document(self, session_id: str, doc: Document):
+        with self._lock:
+            self._touch(session_id)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, doc.sha256 or hashlib.sha256(doc.content.encode("utf-8")).hexdigest(),
+                 doc.filename, doc.pages, zlib.compress(doc.content.encode("utf-8"), 6), time.time())
+            )
+            self._conn.commit()
+
+    def load_documents(self, session_id: str) -> List[Document]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha256, filename, pages, content FROM documents "
+                "WHERE session_id = ? ORDER BY added", (session_id,)
+            ).fetchall()
+        return [
+            Document(
+                filename=filename,
+                content=zlib.decompress(blob).decode("utf-8"),
+                pages=pages,
+                sha256=sha256
+            )
+            for sha256, filename, pages, blob in rows
+        ]
+
+    def save_state(self, session_id: str, key: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_state VALUES (?, ?, ?)",
+                (session_id, key, json.dumps(value, ensure_ascii=False))
+            )
+            self._conn.commit()
+
+    def load_state(self, session_id: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_state WHERE session_id = ? AND key = ?",
+                (session_id, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ============================================================
+# ПОИСК ПО ДОКУМЕНТАМ
+# ============================================================
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STEM_LEN = 6  # грубый стемминг обрезкой: «задачи»/«задачей» → «задача»
+
+
+def estimate_tokens(text: str) -> int:
+    # Кириллица токенизируется плотнее латиницы — ~3 символа на токен
+    return max(1, len(text) // 3)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token[:STEM_LEN] for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+@dataclass
+class DocumentChunk:
+    doc: Document
+    start: int
+    end: int
+
+    @property
+    def text(self) -> str:
+        return self.doc.content[self.start:self.end]
+
+    @property
+    def formatted(self) -> str:
+        # Вид фрагмента в запросе к серверу без реестра документов
+        return f"[{self.doc.filename}, символы {self.start}–{self.end}]\n{self.text}"
+
+
+class DocumentIndex:
+    # Инвертированный индекс BM25 по фрагментам документов, пополняется по одному документу
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[DocumentChunk] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: List[int] = []
+        self.total_length = 0
+
+    @classmethod
+    def build(cls, docs: List[Document]) -> "DocumentIndex":
+        index = cls()
+        for doc in docs:
+            index.add(doc)
+        return index
+
+    def add(self, doc: Document):
+        for start, end in self._split(doc.content):
+            chunk_id = len(self.chunks)
+            self.chunks.append(DocumentChunk(doc, start, end))
+            terms = tokenize(doc.content[start:end])
+            self.lengths.append(len(terms))
+            self.total_length += len(terms)
+            for term, count in Counter(terms).items():
+                self.postings.setdefault(term, {})[chunk_id] = count
+
+    @staticmethod
+    def _split(text: str) -> Iterator[tuple]:
+        start = 0
+        while start < len(text):
+            end = min(start + DOC_CHUNK_CHARS, len(text))
+            if end < len(text):
+                # Режем по границе абзаца или предложения во второй половине фрагмента
+                cut = max(text.rfind("\n\n", start, end), text.rfind(". ", start, end))
+                if cut > start + DOC_CHUNK_CHARS // 2:
+                    end = cut + 1
+            yield start, end
+            if end >= len(text):
+                break
+            start = max(end - DOC_CHUNK_OVERLAP, start + 1)
+
+    def search(self, query: str, k: int = DOC_TOP_K) -> List[DocumentChunk]:
+        if not self.chunks:
+            return []
+        n = len(self.chunks)
+        avg_length = self.total_length / n or 1
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = 1 - self.b + self.b * self.lengths[chunk_id] / avg_length
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [self.chunks[chunk_id] for chunk_id, _ in best]
+
+    def select(self, query: str, k: int = DOC_TOP_K,
+               token_budget: int = DOC_TOKEN_BUDGET) -> List[DocumentChunk]:
+        chunks = self.search(query, k)
+        if not chunks:
+            # Запрос не пересекается с документами — отдаём их начала
+            chunks = [chunk for chunk in self.chunks if chunk.start == 0]
+        selected: List[DocumentChunk] = []
+        used = 0
+        for chunk in chunks:
+            cost = estimate_tokens(chunk.text)
+            if used + cost > token_budget:
+                continue
+            selected.append(chunk)
+            used += cost
+        return selected
+
+
+# ============================================================
+# КОНТЕКСТ ДИАЛОГА
+# ============================================================
+
+def truncate_tokens(text: str, limit: int) -> str:
+    if estimate_tokens(text) <= limit:
+        return text
+    return text[:limit * 3].rsplit(" ", 1)[0] + "…"
+
+
+def summarize_turn(message: Message) -> str:
+    # Экстрактивная сводка: первая фраза реплики
+    text = " ".join(message.content.split())
+    match = re.search(r"[.!?…](\s|$)", text)
+    sentence = text[:match.end()].strip() if match else text
+    role = "Пользователь" if message.role == 'user' else "Ассистент"
+    return f"[{message.stage}] {role}: {truncate_tokens(sentence, 60)}"
+
+
+class ConversationContext:
+    # Скользящее окно последних реплик + инкрементальная сводка вытесненных
+    # + закреплённые заметки по этапам. Собирает запрос в пределах бюджета.
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.turns: List[Message] = []
+        self.summary_lines: List[str] = []
+        self.notes: Dict[str, str] = {}
+        self.summarized_until = 0  # id последнего сообщения, попавшего в сводку
+
+    @staticmethod
+    def _tokens(message: Message) -> int:
+        if not message.tokens:
+            message.tokens = estimate_tokens(message.content)
+        return message.tokens
+
+    def add(self, message: Message):
+        if not message.stage:
+            return  # служебные сообщения (поиск, документы) в диалог не входят
+        self.turns.append(message)
+        if message.role == 'assistant' and not message.content.startswith("❌"):
+            self.notes[message.stage] = truncate_tokens(message.content, NOTE_TOKEN_LIMIT)
+        self._compact()
+
+    def pin(self, stage: str, note: str):
+        self.notes[stage] = truncate_tokens(note, NOTE_TOKEN_LIMIT)
+
+    def _compact(self):
+        # Окну достаётся половина бюджета; остальное — заметкам, сводке, документам
+        window_budget = self.budget // 2
+        total = sum(self._tokens(m) for m in self.turns)
+        while len(self.turns) > 2 and total > window_budget:
+            oldest = self.turns.pop(0)
+            total -= self._tokens(oldest)
+            self.summary_lines.append(summarize_turn(oldest))
+            if oldest.id is not None:
+                self.summarized_until = max(self.summarized_until, oldest.id)
+        while self.summary_lines and estimate_tokens("\n".join(self.summary_lines)) > SUMMARY_TOKEN_LIMIT:
+            self.summary_lines.pop(0)
+
+    def build(self, reserved_tokens: int = 0) -> dict:
+        remaining = self.budget - reserved_tokens
+        notes = dict(self.notes)
+        remaining -= sum(estimate_tokens(note) for note in notes.values())
+
+        # Сводке — не больше трети остатка, при нехватке теряются самые старые строки
+        summary_lines = list(self.summary_lines)
+        while summary_lines and estimate_tokens("\n".join(summary_lines)) > max(0, remaining // 3):
+            summary_lines.pop(0)
+        summary = "\n".join(summary_lines)
+        remaining -= estimate_tokens(summary) if summary else 0
+
+        history: List[dict] = []
+        for message in reversed(self.turns):
+            cost = self._tokens(message)
+            if cost > remaining:
+                break
+            history.append({"role": message.role, "content": message.content})
+            remaining -= cost
+        history.reverse()
+        return {"history": history, "summary": summary, "notes": notes}
+
+    def to_state(self) -> dict:
+        return {
+            "summary": self.summary_lines,
+            "notes": self.notes,
+            "summarized_until": self.summarized_until,
+        }
+
+    @classmethod
+    def from_state(cls, state: Optional[dict], messages: List[Message]) -> "ConversationContext":
+        context = cls()
+        if state:
+            context.summary_lines = list(state.get("summary", []))
+            context.notes = dict(state.get("notes", {}))
+            context.summarized_until = state.get("summarized_until", 0)
+        for message in messages:
+            if message.id is None or message.id > context.summarized_until:
+                context.add(message)
+        return context
+
+
+# ============================================================
+# КОНВЕЙЕР ЭТАПОВ
+# ============================================================
+
+def derive_search_queries(text: str, limit: int = SEARCH_PREFETCH_QUERIES) -> List[str]:
+    # Пункты списков из ответа этапа, а если списков нет — первые фразы
+    items = re.findall(r"^\s*(?:[-*•]|\d+[.)])\s+(.+)$", text, re.MULTILINE)
+    if not items:
+        items = re.split(r"(?<=[.!?…])\s+", " ".join(text.split()))
+    queries: List[str] = []
+    seen = set()
+    for item in items:
+        words = re.sub(r"[*_`#>\[\]]", "", item).split()[:SEARCH_QUERY_WORDS]
+        query = " ".join(words).strip(" .,:;")
+        if len(query.split()) < 2 or query.casefold() in seen:
+            continue
+        seen.add(query.casefold())
+        queries.append(query)
+        if len(queries) >= limit:
+            break
+    return queries
+
+
+class StagePipeline:
+    # Прогон задачи по этапам методики без UI: ответ каждого этапа
+    # закрепляется в ConversationContext и уходит в запросы следующих.
+    # Поиск для «Поиска» стартует сразу после «Целей», параллельно с «Планом».
+
+    def __init__(self, api: APIClient, stages: Optional[List[Stage]] = None,
+                 doc_index: Optional[DocumentIndex] = None, stream: bool = False,
+                 prefetch: bool = True):
+        self.api = api
+        self.stages = list(stages or Stage)
+        self.doc_index = doc_index
+        self.stream = stream
+        self.prefetch = prefetch
+
+    @staticmethod
+    def stage_prompt(stage: Stage, task: str, first: bool) -> str:
+        if first:
+            return task
+        _, name, description = stage.value
+        return (
+            f"Этап «{name}»: {description.lower()}. "
+            f"Продолжи работу над задачей с учётом предыдущих этапов.\n\n"
+            f"Задача: {truncate_tokens(task, NOTE_TOKEN_LIMIT)}"
+        )
+
+    def run_stage(self, stage: Stage, task: str, conversation: ConversationContext,
+                  context: str = "", first: bool = False, session_id: Optional[str] = None,
+                  on_chunk: Optional[Callable[[str], None]] = None) -> Message:
+        stage_id = stage.value[0]
+        prompt = self.stage_prompt(stage, task, first)
+        docs = self.doc_index.select(prompt) if self.doc_index else []
+        payload = conversation.build(
+            reserved_tokens=estimate_tokens(prompt) + estimate_tokens(context)
+            + sum(estimate_tokens(d.text) for d in docs)
+        )
+        conversation.add(Message(role='user', content=prompt, stage=stage_id))
+
+        if self.stream or on_chunk:
+            result = self.api.chat_stream(prompt, stage_id, context, docs, on_chunk=on_chunk,
+                                          conversation=payload, session_id=session_id)
+        else:
+            result = self.api.chat(prompt, stage_id, context, docs,
+                                   conversation=payload, session_id=session_id)
+
+        if result.get("success"):
+            answer = Message(role='assistant', content=result.get("response", ""), stage=stage_id,
+                             cached=bool(result.get("cached")))
+        else:
+            answer = Message(
+                role='assistant', stage=stage_id,
+                content=f"❌ Ошибка: {result.get('error', 'Неизвестная ошибка')}"
+            )
+        conversation.add(answer)
+        return answer
+
+    def run(self, task: str, context: str = "", session_id: Optional[str] = None,
+            done: Optional[Dict[str, str]] = None,
+            on_stage: Optional[Callable[[Stage, Message], None]] = None,
+            on_chunk: Optional[Callable[[str], None]] = None) -> dict:
+        # done — ответы этапов, уже полученных в прошлом прогоне (возобновление)
+        conversation = ConversationContext()
+        answers: Dict[str, str] = {}
+        research: Optional[Future] = None
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="mkai-prefetch") as prefetch:
+            for i, stage in enumerate(self.stages):
+                stage_id = stage.value[0]
+                if done and stage_id in done:
+                    answers[stage_id] = done[stage_id]
+                    conversation.pin(stage_id, done[stage_id])
+                else:
+                    stage_context = context
+                    if stage == Stage.RESEARCH and research is not None:
+                        stage_context = "\n".join(filter(None, [context, research.result()]))
+                    answer = self.run_stage(stage, task, conversation, stage_context,
+                                            first=i == 0, session_id=session_id,
+                                            on_chunk=on_chunk)
+                    if on_stage:
+                        on_stage(stage, answer)
+                    if answer.content.startswith("❌"):
+                        return {
+                            "success": False,
+                            "stages": answers,
+                            "failed_stage": stage_id,
+                            "error": answer.content,
+                        }
+                    answers[stage_id] = answer.content
+
+                if stage == Stage.GOALS and self.prefetch and Stage.RESEARCH in self.stages[i + 1:]:
+                    research = prefetch.submit(self._research_context, answers[stage_id])
+
+        final = answers.get(self.stages[-1].value[0], "")
+        return {"success": True, "stages": answers, "answer": final}
+
+    def _research_context(self, goals: str) -> str:
+        aggregator = SearchAggregator()
+        for query in derive_search_queries(goals):
+            aggregator.add(self.api.search(query))
+        return format_search_context(aggregator.ranked())
+
+
+# ============================================================
+# ИЗВЛЕЧЕНИЕ PDF
+# ============================================================
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    # Выполняется в дочернем процессе, поэтому функция модульного уровня
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+class PDFExtractor:
+    # Локальный разбор через pypdf; сервер /pdf — только запасной путь
+
+    def __init__(self, api: APIClient, cache: Optional[DocumentCache] = None,
+                 workers: int = PDF_WORKERS):
+        self.api = api
+        self.cache = cache
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def extract(self, file_path: str,
+                on_progress: Optional[Callable[[int, int], None]] = None) -> Optional[Document]:
+        sha256 = file_sha256(file_path)
+        if self.cache is not None:
+            doc = self.cache.get(sha256)
+            if doc is not None:
+                doc.filename = Path(file_path).name
+                if on_progress:
+                    on_progress(doc.pages, doc.pages)
+                return doc
+
+        doc = None
+        try:
+            with METRICS.timer("mkai_pdf_extract_ms", source="local"):
+                doc = self._extract_local(file_path, on_progress)
+        except Exception as e:
+            # Повреждённый/зашифрованный файл или упавший пул процессов
+            METRICS.inc("mkai_errors_total", op="pdf_local", error=type(e).__name__)
+            self._reset_pool()
+        if doc is None or not doc.content.strip():
+            # Например, отсканированный PDF без текстового слоя — пусть разбирает сервер
+            doc = self.api.extract_pdf(file_path)
+        if doc is None:
+            return None
+
+        doc.sha256 = sha256
+        if self.cache is not None:
+            self.cache.put(doc)
+        return doc
+
+    def _extract_local(self, file_path: str,
+                       on_progress: Optional[Callable[[int, int], None]]) -> Document:
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        total = len(reader.pages)
+        pages: List[str] = [""] * total
+
+        if total < PDF_POOL_MIN_PAGES or self.workers < 2:
+            for i, page in enumerate(reader.pages):
+                pages[i] = page.extract_text() or ""
+                if on_progress:
+                    on_progress(i + 1, total)
+        else:
+            pool = self._get_pool()
+            futures = {
+                pool.submit(_extract_page_range, file_path, start, min(start + PDF_CHUNK_PAGES, total)): start
+                for start in range(0, total, PDF_CHUNK_PAGES)
+            }
+            done = 0
+            try:
+                for future in as_completed(futures):
+                    start = futures[future]
+                    texts = future.result()
+                    pages[start:start + len(texts)] = texts
+                    done += len(texts)
+                    if on_progress:
+                        on_progress(done, total)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        content = "\n\n".join(text.strip() for text in pages if text.strip())
+        return Document(filename=Path(file_path).name, content=content, pages=total)
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._reset_pool()
+        if self.cache is not None:
+            self.cache.close()
@@ -1,25 +1,49 @@
+import time
+_STARTUP_T0 = time.perf_counter()  # точка отсчёта для MKAI_PROFILE_STARTUP
+
+import os
+import re
 import sys
 import json
+import html
+import math
 import uuid
-import requests
+import argparse
+import importlib
+import asyncio
+import functools
+import threading
+import multiprocessing
 from pathlib import Path
-from typing import Optional, List, Dict
-from dataclasses import dataclass, field
-from enum import Enum
+from typing import Optional, List, Dict, Callable, Awaitable, Any
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
 from datetime import datetime
 
 from PyQt6.QtCore import (
-    Qt, QTimer, QThread, pyqtSignal, 
-    QPropertyAnimation, QEasingCurve, QSize
+    Qt, QTimer, QObject, pyqtSignal, 
+    QPropertyAnimation, QEasingCurve, QSize,
+    QAbstractListModel, QModelIndex, QRectF
 )
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QTextEdit, QLineEdit, QPushButton, QLabel, QFrame, QScrollArea,
-    QStackedWidget, QFileDialog, QMessageBox, QSizePolicy, QSpacerItem
+    QStackedWidget, QFileDialog, QMessageBox, QSizePolicy, QSpacerItem, QInputDialog,
+    QListView, QAbstractItemView, QStyledItemDelegate, QMenu
 )
 from PyQt6.QtGui import (
     QColor, QPalette, QFont, QTextCursor, QKeyEvent, 
-    QLinearGradient, QPainter, QPen, QBrush
+    QLinearGradient, QPainter, QPen, QBrush,
+    QTextDocument, QTextOption, QAbstractTextDocumentLayout, QKeySequence, QFontMetrics
+)
+
+from task_solver_core import (
+    ANSWER_CACHE_ENABLED, APIClient, AnswerCache, CancelToken, ConversationContext,
+    DATA_DIR, Document, DocumentCache, DocumentIndex, HISTORY_PAGE_SIZE, METRICS, Message,
+    PDFExtractor, SEARCH_FANOUT_PAGES, SEARCH_PAGE_SIZE, SEARCH_SOURCES, SESSION_ID,
+    SearchAggregator, SearchCache, SearchResult, SessionStore, Stage, StagePipeline,
+    derive_search_queries, estimate_tokens, format_search_context
 )
 
 
@@ -27,8 +51,18 @@ from PyQt6.QtGui import (
 # КОНСТАНТЫ И ТИПЫ
 # ============================================================
 
-API_URL = "http://localhost:3000/api"
-SESSION_ID = str(uuid.uuid4())[:8]
+ENGINE_CONCURRENCY = 4       # одновременных фоновых запросов к API (поиск, PDF)
+ENGINE_PRIORITY_SLOTS = 2    # отдельные слоты чата и его отмены: не ждут поиск «Везде»
+LAYOUT_CACHE_SIZE = 256      # сообщений с готовой раскладкой текста
+MARKDOWN_CACHE_SIZE = 2048   # блоков Markdown с готовым HTML
+CODE_LAZY_LINES = 40         # длинный код размечается только при первом показе
+DOCS_LIST_MIN_HEIGHT = 64    # px, около двух строк списка документов
+DOC_TOOLTIP_PREVIEW = 300    # символов начала документа в подсказке
+STALL_TICK_MS = 50           # период таймера-детектора зависаний GUI
+STALL_THRESHOLD_MS = 200     # опоздание тика, считающееся зависанием
+METRICS_REFRESH_MS = 1000    # обновление панели метрик
+UI_FRAME_MS = 16             # не чаще одного применения обновлений GUI за кадр
+FOLLOW_SLACK_PX = 24         # насколько можно не докрутить до конца, оставаясь «внизу»
 COLORS = {
     'bg_primary': '#0D0D0D',       # Почти чёрный
     'bg_secondary': '#161616',     # Тёмно-серый
@@ -42,188 +76,1101 @@ COLORS = {
     'border': '#2A2A2A',           # Границы
 }
 
-class Stage(Enum):
-    ANALYSIS = ("analysis", "Анализ", "Постановка проблемы")
-    GOALS = ("goals", "Цели", "Формулирование целей")
-    PLANNING = ("planning", "План", "Планирование работы")
-    RESEARCH = ("research", "Поиск", "Исследование материалов")
-    WORK = ("work", "Работа", "Выполнение задач")
-    SOLUTION = ("solution", "Решение", "Итоговый ответ")
+
+# ============================================================
+# ФОНОВЫЙ ДВИЖОК ЗАПРОСОВ
+# ============================================================
+
+class EngineTask(QObject):
+    chunk = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.future: Optional[Future] = None
+        self.is_cancelled = False
+        self.delivered = False  # результат уже передан в GUI-поток
+        self.token = CancelToken()
+
+    def is_running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def cancel(self):
+        # future.cancel() не прерывает поток пула — соединение обрывает токен
+        self.is_cancelled = True
+        self.token.cancel()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class AsyncEngine(QObject):
+    # Один asyncio-цикл в фоновом потоке вместо QThread на каждый запрос.
+    # Блокирующие вызовы APIClient выполняются в ограниченном пуле потоков,
+    # общем с пулом соединений requests.Session. Задачи с priority=True
+    # (чат, отмена) идут по своему семафору и не стоят в очереди за поиском.
+    _completed = pyqtSignal(object, object, object)
+
+    def __init__(self, max_concurrency: int = ENGINE_CONCURRENCY,
+                 priority_slots: int = ENGINE_PRIORITY_SLOTS):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency + priority_slots, thread_name_prefix="mkai-io"
+        )
+        self.loop.set_default_executor(self.executor)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.priority_semaphore = asyncio.Semaphore(priority_slots)
+        self.tasks: set = set()
+        self._completed.connect(self._dispatch)
+
+        self._thread = threading.Thread(target=self._run_loop, name="mkai-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def run_blocking(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self.loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def submit(self, factory: Callable[[EngineTask], Awaitable], priority: bool = False,
+               **slots) -> EngineTask:
+        # Слоты подключаются до запуска, чтобы не потерять ранние chunk-сигналы
+        task = EngineTask()
+        for name, slot in slots.items():
+            getattr(task, name).connect(slot)
+        semaphore = self.priority_semaphore if priority else self.semaphore
+
+        async def runner():
+            async with semaphore:
+                return await factory(task)
+
+        # Держим ссылку до доставки результата в GUI-поток
+        self.tasks.add(task)
+        task.future = asyncio.run_coroutine_threadsafe(runner(), self.loop)
+        task.future.add_done_callback(lambda future: self._on_done(task, future))
+        return task
+
+    def _on_done(self, task: EngineTask, future: Future):
+        if future.cancelled():
+            self._completed.emit(task, None, None)
+            return
+        error = future.exception()
+        self._completed.emit(task, None if error else future.result(), error)
+
+    def _dispatch(self, task: EngineTask, result: Any, error: Optional[BaseException]):
+        self.tasks.discard(task)
+        task.delivered = True
+        if task.is_cancelled:
+            task.cancelled.emit()
+        elif error is not None:
+            task.failed.emit(str(error) or type(error).__name__)
+        else:
+            task.finished.emit(result)
+
+    def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 # ============================================================
-# МОДЕЛИ ДАННЫХ
+# СТИЛИ
 # ============================================================
 
-@dataclass
-class Message:
-    role: str  # 'user' | 'assistant'
-    content: str
-    timestamp: datetime = field(default_factory=datetime.now)
+def build_stylesheet(colors: Dict[str, str] = COLORS) -> str:
+    # Одна таблица стилей на всё приложение. Состояния виджетов задаются
+    # objectName и динамическими свойствами, поэтому смена состояния —
+    # это только repolish, без повторного разбора CSS.
+    return f"""
+        QMainWindow {{
+            background-color: {colors['bg_primary']};
+        }}
+        QWidget {{
+            background-color: {colors['bg_primary']};
+            color: {colors['text_primary']};
+        }}
+        QScrollBar:vertical {{
+            background-color: {colors['bg_secondary']};
+            width: 6px;
+            border-radius: 3px;
+        }}
+        QScrollBar::handle:vertical {{
+            background-color: {colors['accent']};
+            border-radius: 3px;
+        }}
+        QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {{
+            height: 0px;
+        }}
 
+        QLabel#header {{
+            font-size: 18px;
+            font-weight: 600;
+            color: {colors['text_primary']};
+            padding: 4px 0;
+        }}
+        QLabel#statusLabel {{
+            font-size: 11px;
+            color: {colors['text_muted']};
+        }}
+        QListView#transcript {{
+            border: none;
+            background-color: {colors['bg_primary']};
+        }}
+        QFrame#inputContainer {{
+            background-color: {colors['bg_secondary']};
+            border: 1px solid {colors['border']};
+            border-radius: 12px;
+        }}
+        QLineEdit#inputField {{
+            background: transparent;
+            border: none;
+            color: {colors['text_primary']};
+            font-size: 14px;
+        }}
+        QPushButton#sendButton {{
+            background-color: {colors['highlight']};
+            color: white;
+            border: none;
+            border-radius: 18px;
+            font-size: 16px;
+            font-weight: bold;
+        }}
+        QPushButton#sendButton:hover {{
+            background-color: #2563EB;
+        }}
+        QPushButton#sendButton:disabled {{
+            background-color: {colors['accent']};
+            color: {colors['text_muted']};
+        }}
+        QFrame#separator {{
+            background-color: {colors['border']};
+        }}
 
-@dataclass
-class Document:
-    filename: str
-    content: str
-    pages: int = 0
+        QWidget#sidebar, QWidget#sidebar QWidget {{
+            background-color: {colors['bg_secondary']};
+        }}
+        QLabel#sectionLabel {{
+            font-size: 10px;
+            font-weight: 600;
+            color: {colors['text_muted']};
+            letter-spacing: 1.5px;
+        }}
+        QLineEdit#searchInput {{
+            background-color: {colors['bg_tertiary']};
+            border: 1px solid {colors['border']};
+            border-radius: 6px;
+            padding: 10px 12px;
+            color: {colors['text_primary']};
+            font-size: 12px;
+        }}
+        QPushButton#actionButton {{
+            background-color: {colors['bg_tertiary']};
+            color: {colors['text_secondary']};
+            border: 1px solid {colors['border']};
+            border-radius: 6px;
+            text-align: left;
+            padding-left: 12px;
+            font-size: 12px;
+        }}
+        QPushButton#actionButton:hover {{
+            background-color: {colors['accent']};
+            color: {colors['text_primary']};
+            border-color: {colors['highlight']};
+        }}
+        QPushButton#stageButton {{
+            background-color: transparent;
+            color: {colors['text_secondary']};
+            border: none;
+            border-radius: 6px;
+            text-align: left;
+            padding-left: 12px;
+            font-size: 12px;
+        }}
+        QPushButton#stageButton[state="idle"]:hover {{
+            background-color: {colors['accent']};
+            color: {colors['text_primary']};
+        }}
+        QPushButton#stageButton[state="active"] {{
+            background-color: {colors['highlight']};
+            color: white;
+            font-weight: 500;
+        }}
+        QPushButton#stageButton[state="completed"] {{
+            background-color: {colors['success']};
+            color: white;
+        }}
+        QListView#docsList {{
+            background: transparent;
+            border: none;
+            color: {colors['text_secondary']};
+            font-size: 11px;
+        }}
+        QListView#docsList::item {{
+            padding: 3px 0;
+        }}
+        QLabel#modelInfo {{
+            font-size: 10px;
+            color: {colors['text_muted']};
+            padding: 8px;
+        }}
+        QPushButton#headerButton {{
+            background: transparent;
+            border: none;
+            color: {colors['text_muted']};
+            font-size: 14px;
+        }}
+        QPushButton#headerButton:checked, QPushButton#headerButton:hover {{
+            color: {colors['text_primary']};
+        }}
+        QScrollArea#metricsPanel {{
+            border: 1px solid {colors['border']};
+            border-radius: 6px;
+        }}
+        QLabel#metricsText {{
+            font-family: Consolas, "DejaVu Sans Mono", monospace;
+            font-size: 10px;
+            color: {colors['text_secondary']};
+        }}
+        QPushButton#metricsButton {{
+            background-color: {colors['bg_tertiary']};
+            color: {colors['text_secondary']};
+            border: 1px solid {colors['border']};
+            border-radius: 4px;
+            padding: 4px 8px;
+            font-size: 10px;
+        }}
+    """
 
 
-@dataclass
-class SearchResult:
-    title: str
-    url: str
-    snippet: str
-    domain: str
+_STYLESHEET: Optional[str] = None
+
+
+def apply_stylesheet(app: QApplication):
+    global _STYLESHEET
+    if _STYLESHEET is None:
+        _STYLESHEET = build_stylesheet()
+    if app.styleSheet() != _STYLESHEET:
+        app.setStyleSheet(_STYLESHEET)
+
+
+def repolish(widget: QWidget):
+    widget.style().unpolish(widget)
+    widget.style().polish(widget)
 
 
 # ============================================================
-# API КЛИЕНТ
+# MARKDOWN
 # ============================================================
 
-class APIClient:
-    
-    def __init__(self, base_url: str = API_URL):
-        self.base_url = base_url
-        self.timeout = 120
-    
-    def chat(self, message: str, stage: str, context: str = "", docs: List[str] = None) -> dict:
-        try:
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json={
-                    "message": message,
-                    "sessionId": SESSION_ID,
-                    "stage": stage,
-                    "context": context,
-                    "documents": docs or []
-                },
-                timeout=self.timeout
-            )
-            return response.json()
-        except Exception as e:
-            return {"success": False, "error": str(e)}
-    
-    def search(self, query: str, source: str = "general") -> List[SearchResult]:
-        try:
-            response = requests.get(
-                f"{self.base_url}/search",
-                params={"q": query, "num": 10, "source": source},
-                timeout=30
-            )
-            data = response.json()
-            return [
-                SearchResult(
-                    title=r["title"],
-                    url=r["url"],
-                    snippet=r.get("snippet", ""),
-                    domain=r["domain"]
+_MD_FENCE = re.compile(r"^\s*(```|~~~)")
+_MD_FENCE_CLOSE = re.compile(r"^\s*(`{3,}|~{3,})\s*$")
+_MD_HEADING = re.compile(r"^\s*(#{1,6})\s+(.*)$")
+_MD_BULLET = re.compile(r"^\s*[-*+•]\s+(.*)$")
+_MD_NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+_MD_QUOTE = re.compile(r"^\s*>\s?(.*)$")
+_MD_INLINE_CODE = re.compile(r"(`[^`\n]+`)")
+_MD_INLINE = re.compile(
+    r"\*\*(.+?)\*\*|__(.+?)__"
+    r"|(?<![\w*])\*(?![\s*])(.+?)(?<![\s*])\*(?![\w*])"
+    r"|\[([^\]]+)\]\((https?://[^)\s\"]+)\)"
+)
+_MD_HEADING_PX = {1: 18, 2: 16, 3: 15}
+
+
+@dataclass
+class MarkdownBlock:
+    offset: int    # начало блока в исходном тексте
+    source: str
+    kind: str      # text | code | plain
+
+
+def split_markdown(text: str, offset: int = 0) -> List[MarkdownBlock]:
+    # Блоки — абзацы между пустыми строками и огороженный код целиком.
+    # Граница блока не зависит от текста после него, поэтому дописанный
+    # текст требует разбора только с начала последнего блока.
+    blocks: List[MarkdownBlock] = []
+    start, fence, pos = -1, "", 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if fence:
+            if pos != start and stripped.startswith(fence) and _MD_FENCE_CLOSE.match(line):
+                blocks.append(MarkdownBlock(offset + start, text[start:pos + len(line)], "code"))
+                start, fence = -1, ""
+        elif _MD_FENCE.match(line):
+            if start >= 0:
+                blocks.append(MarkdownBlock(offset + start, text[start:pos], "text"))
+            start, fence = pos, stripped[:3]
+        elif not stripped:
+            if start >= 0:
+                blocks.append(MarkdownBlock(offset + start, text[start:pos], "text"))
+                start = -1
+        elif start < 0:
+            start = pos
+        pos += len(line)
+    if start >= 0:
+        blocks.append(MarkdownBlock(offset + start, text[start:], "code" if fence else "text"))
+    return blocks
+
+
+def markdown_code(block: MarkdownBlock) -> str:
+    lines = block.source.splitlines()[1:]
+    if lines and _MD_FENCE_CLOSE.match(lines[-1]):
+        lines.pop()  # закрывающая ограда; у недописанного блока её ещё нет
+    return "\n".join(lines)
+
+
+class MarkdownRenderer:
+    # Markdown → HTML подмножества, которое понимает QTextDocument.
+    # HTML кэшируется по исходнику блока: неизменные блоки не разбираются повторно.
+
+    def __init__(self, cache_size: int = MARKDOWN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def render(self, block: MarkdownBlock) -> str:
+        cached = self._cache.get(block.source)
+        if cached is not None:
+            self._cache.move_to_end(block.source)
+            return cached
+        result = self._render_text(block.source)
+        self._cache[block.source] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _render_text(self, source: str) -> str:
+        parts: List[str] = []
+        lines: List[str] = []
+        items: List[str] = []
+        list_tag = ""
+
+        def flush():
+            if lines:
+                parts.append('<p style="margin:0">' + "<br>".join(lines) + "</p>")
+                lines.clear()
+            if items:
+                parts.append(
+                    f'<{list_tag} style="margin-top:0; margin-bottom:0; -qt-list-indent:1">'
+                    + "".join(f"<li>{item}</li>" for item in items) + f"</{list_tag}>"
                 )
-                for r in data.get("results", [])
-            ]
-        except:
-            return []
-    
-    def extract_pdf(self, file_path: str) -> Optional[Document]:
-        try:
-            with open(file_path, "rb") as f:
-                response = requests.post(
-                    f"{self.base_url}/pdf",
-                    files={"file": (Path(file_path).name, f, "application/pdf")},
-                    timeout=60
+                items.clear()
+
+        for line in source.splitlines():
+            if not line.strip():
+                continue
+            heading = _MD_HEADING.match(line)
+            if heading:
+                flush()
+                size = _MD_HEADING_PX.get(len(heading.group(1)), 14)
+                parts.append(
+                    f'<p style="margin:0; font-size:{size}px; font-weight:600">'
+                    f"{self._inline(heading.group(2))}</p>"
                 )
-            data = response.json()
-            if data.get("success"):
-                return Document(
-                    filename=data["metadata"]["filename"],
-                    content=data["text"],
-                    pages=data["metadata"]["pages"]
+                continue
+            bullet = _MD_BULLET.match(line)
+            numbered = None if bullet else _MD_NUMBERED.match(line)
+            if bullet or numbered:
+                tag = "ul" if bullet else "ol"
+                if lines or (items and tag != list_tag):
+                    flush()
+                list_tag = tag
+                items.append(self._inline((bullet or numbered).group(1)))
+                continue
+            if items:
+                flush()
+            quote = _MD_QUOTE.match(line)
+            if quote:
+                lines.append(
+                    f'<span style="color:{COLORS["text_secondary"]}"><i>'
+                    f"{self._inline(quote.group(1))}</i></span>"
                 )
-        except:
-            pass
-        return None
+            else:
+                lines.append(self._inline(line.strip()))
+        flush()
+        return "".join(parts)
+
+    @classmethod
+    def _inline(cls, text: str) -> str:
+        # Внутри `кода` разметка не действует — он отделяется до остальных правил
+        out: List[str] = []
+        for n, part in enumerate(_MD_INLINE_CODE.split(text)):
+            if n % 2:
+                out.append(
+                    f'<code style="background-color:{COLORS["bg_secondary"]}">'
+                    f"{html.escape(part[1:-1], quote=False)}</code>"
+                )
+            elif part:
+                out.append(_MD_INLINE.sub(cls._inline_match, html.escape(part, quote=False)))
+        return "".join(out)
+
+    @staticmethod
+    def _inline_match(match: re.Match) -> str:
+        bold = match.group(1) or match.group(2)
+        if bold:
+            return f"<b>{bold}</b>"
+        if match.group(3):
+            return f"<i>{match.group(3)}</i>"
+        return f'<a href="{match.group(5)}">{match.group(4)}</a>'
 
 
 # ============================================================
-# WORKER ПОТОКИ
+# UI КОМПОНЕНТЫ
 # ============================================================
 
-class ChatWorker(QThread):
-    finished = pyqtSignal(dict)
-    
-    def __init__(self, api: APIClient, message: str, stage: str, context: str, docs: List[str]):
-        super().__init__()
-        self.api = api
-        self.message = message
-        self.stage = stage
-        self.context = context
-        self.docs = docs
-    
-    def run(self):
-        result = self.api.chat(self.message, self.stage, self.context, self.docs)
-        self.finished.emit(result)
+class MessageListModel(QAbstractListModel):
+    MessageRole = Qt.ItemDataRole.UserRole + 1
 
+    def __init__(self, messages: List[Message], parent=None):
+        super().__init__(parent)
+        self.messages = messages
 
-class SearchWorker(QThread):
-    finished = pyqtSignal(list)
-    
-    def __init__(self, api: APIClient, query: str, source: str):
-        super().__init__()
-        self.api = api
-        self.query = query
-        self.source = source
-    
-    def run(self):
-        results = self.api.search(self.query, self.source)
-        self.finished.emit(results)
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.messages)
 
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.messages[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message.content
+        if role == self.MessageRole:
+            return message
+        return None
 
-# ============================================================
-# UI КОМПОНЕНТЫ
-# ============================================================
+    def append(self, message: Message) -> int:
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.messages.append(message)
+        self.endInsertRows()
+        return row
 
-class MessageBubble(QFrame):
-    
-    def __init__(self, message: Message, parent=None):
+    def extend(self, messages: List[Message]):
+        # Пачка сообщений — одна вставка и один проход раскладки представления
+        if not messages:
+            return
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row + len(messages) - 1)
+        self.messages.extend(messages)
+        self.endInsertRows()
+
+    def prepend(self, messages: List[Message]):
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.messages[:0] = messages
+        self.endInsertRows()
+
+    def reset(self, messages: List[Message]):
+        self.beginResetModel()
+        self.messages[:] = messages
+        self.endResetModel()
+
+    def row_of(self, message: Message) -> int:
+        # Обновляются почти всегда последние сообщения — ищем с конца
+        for row in range(len(self.messages) - 1, -1, -1):
+            if self.messages[row] is message:
+                return row
+        return -1
+
+    def append_text(self, message: Message, text: str):
+        message.content += text
+        self.refresh(message)
+
+    def set_text(self, message: Message, text: str):
+        message.content = text
+        self.refresh(message)
+
+    def refresh(self, message: Message):
+        row = self.row_of(message)
+        if row >= 0:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+
+@dataclass
+class DocumentRow:
+    filename: str
+    doc: Optional[Document] = None   # None — ещё извлекается
+    done: int = 0                    # страниц извлечено
+    total: int = 0
+
+
+class DocumentListModel(QAbstractListModel):
+    # Список документов боковой панели. Добавление и удаление — по одной строке,
+    # поэтому стоимость не зависит от числа уже загруженных документов.
+    # Подсказка собирается только при наведении.
+    DocumentRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.message = message
-        self._setup_ui()
-    
-    def _setup_ui(self):
-        self.setObjectName("messageBubble")
-        
-        layout = QVBoxLayout(self)
-        layout.setContentsMargins(12, 8, 12, 8)
-        layout.setSpacing(4)
+        self.rows: List[DocumentRow] = []
+        self.ready = 0
 
-        text_label = QLabel(self.message.content)
-        text_label.setWordWrap(True)
-        text_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-        
-        if self.message.role == 'user':
-            self.setStyleSheet(f"""
-                #messageBubble {{
-                    background-color: {COLORS['highlight']};
-                    border-radius: 12px;
-                    margin-left: 40px;
-                }}
-                QLabel {{ color: white; font-size: 13px; }}
-            """)
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"📄 {row.filename}\n{self._details(row)}"
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return self._tooltip(row)
+        if role == Qt.ItemDataRole.ForegroundRole and row.doc is None:
+            return QColor(COLORS['text_muted'])
+        if role == self.DocumentRole:
+            return row.doc
+        return None
+
+    @staticmethod
+    def _details(row: DocumentRow) -> str:
+        if row.doc is None:
+            progress = f" {row.done}/{row.total} стр." if row.total else ""
+            return f"⏳ извлечение{progress}"
+        return f"{row.doc.pages} стр. • {len(row.doc.content):,} симв.".replace(",", " ")
+
+    @staticmethod
+    def _tooltip(row: DocumentRow) -> str:
+        if row.doc is None:
+            return f"{row.filename}\nИзвлечение текста…"
+        doc = row.doc
+        preview = doc.content[:DOC_TOOLTIP_PREVIEW].strip()
+        if len(doc.content) > DOC_TOOLTIP_PREVIEW:
+            preview += "…"
+        lines = [
+            doc.filename,
+            f"Страниц: {doc.pages} | Символов: {len(doc.content):,} | "
+            f"~{estimate_tokens(doc.content):,} токенов",
+        ]
+        if doc.sha256:
+            lines.append(f"SHA-256: {doc.sha256[:16]}…")
+        return "\n".join(lines + ["", preview])
+
+    def reset(self, documents: List[Document]):
+        self.beginResetModel()
+        self.rows = [DocumentRow(filename=doc.filename, doc=doc) for doc in documents]
+        self.ready = len(self.rows)
+        self.endResetModel()
+
+    def add_pending(self, filename: str) -> DocumentRow:
+        row = DocumentRow(filename=filename)
+        self._insert(row)
+        return row
+
+    def add(self, doc: Document) -> DocumentRow:
+        row = DocumentRow(filename=doc.filename, doc=doc)
+        # Счётчик меняется до сигнала вставки: по нему обновляется заголовок списка
+        self.ready += 1
+        self._insert(row)
+        return row
+
+    def set_progress(self, row: DocumentRow, done: int, total: int):
+        row.done, row.total = done, total
+        self._changed(row)
+
+    def resolve(self, row: DocumentRow, doc: Document):
+        # Ожидающая строка становится готовым документом на том же месте
+        if self.row_of(row) < 0:
+            return  # список сменился вместе с сессией
+        row.filename, row.doc = doc.filename, doc
+        self.ready += 1
+        self._changed(row)
+
+    def remove(self, row: DocumentRow):
+        index = self.row_of(row)
+        if index < 0:
+            return
+        self.beginRemoveRows(QModelIndex(), index, index)
+        del self.rows[index]
+        if row.doc is not None:
+            self.ready -= 1
+        self.endRemoveRows()
+
+    def row_of(self, row: DocumentRow) -> int:
+        # Меняются почти всегда последние строки — ищем с конца
+        for index in range(len(self.rows) - 1, -1, -1):
+            if self.rows[index] is row:
+                return index
+        return -1
+
+    def _insert(self, row: DocumentRow):
+        index = len(self.rows)
+        self.beginInsertRows(QModelIndex(), index, index)
+        self.rows.append(row)
+        self.endInsertRows()
+
+    def _changed(self, row: DocumentRow):
+        index = self.row_of(row)
+        if index >= 0:
+            model_index = self.index(index)
+            self.dataChanged.emit(model_index, model_index)
+
+
+class MessageLayout:
+    # Раскладка сообщения из независимых блоков, у каждого свой QTextDocument.
+    # Дописанный текст разбирается и размечается с начала последнего блока,
+    # поэтому стоимость обновления зависит от нового текста, а не от всего ответа.
+    # Высота кода считается по числу строк: длинный код размечается при первом показе.
+    BLOCK_SPACING = 6
+    CODE_PADDING = 6
+
+    def __init__(self, delegate: "MessageDelegate", markdown: bool):
+        self.delegate = delegate
+        self.markdown = markdown
+        self.text = ""
+        self.width = 0
+        self.blocks: List[MarkdownBlock] = []
+        self.docs: List[Optional[QTextDocument]] = []
+        self.heights: List[int] = []
+        self.tops: List[int] = []
+        self.height = 0
+
+    def update(self, text: str):
+        if text == self.text:
+            return
+        if not self.markdown:
+            blocks = [MarkdownBlock(0, text, "plain")]
+        elif self.blocks and text.startswith(self.text):
+            tail = self.blocks[-1].offset
+            blocks = self.blocks[:-1] + split_markdown(text[tail:], tail)
         else:
-            self.setStyleSheet(f"""
-                #messageBubble {{
-                    background-color: {COLORS['bg_tertiary']};
-                    border-radius: 12px;
-                    margin-right: 40px;
-                }}
-                QLabel {{ color: {COLORS['text_primary']}; font-size: 13px; }}
-            """)
-        
-        layout.addWidget(text_label)
+            blocks = split_markdown(text)
+
+        same = 0
+        limit = min(len(blocks), len(self.blocks))
+        while same < limit and blocks[same].source == self.blocks[same].source \
+                and blocks[same].kind == self.blocks[same].kind:
+            same += 1
+        self.docs[same:] = [self._build(block) for block in blocks[same:]]
+        self.heights[same:] = [self._measure(block, doc) for block, doc in zip(blocks[same:], self.docs[same:])]
+        self.blocks = blocks
+        self.text = text
+        self._stack()
+
+    def set_width(self, width: int):
+        if width == self.width:
+            return
+        self.width = width
+        for n, (block, doc) in enumerate(zip(self.blocks, self.docs)):
+            if block.kind != "code":
+                doc.setTextWidth(width)
+                self.heights[n] = self._measure(block, doc)
+        self._stack()
+
+    def _stack(self):
+        self.tops = []
+        y = 0
+        for height in self.heights:
+            self.tops.append(y)
+            y += height + self.BLOCK_SPACING
+        self.height = max(0, y - self.BLOCK_SPACING)
 
-        time_label = QLabel(self.message.timestamp.strftime("%H:%M"))
-        time_label.setStyleSheet(f"color: {COLORS['text_muted']}; font-size: 10px;")
-        layout.addWidget(time_label)
+    def _build(self, block: MarkdownBlock) -> Optional[QTextDocument]:
+        if block.kind == "code":
+            code = markdown_code(block)
+            if code.count("\n") + 1 > CODE_LAZY_LINES:
+                return None
+            return self.delegate.code_document(code)
+        doc = self.delegate.text_document()
+        if block.kind == "plain":
+            doc.setPlainText(block.source)
+        else:
+            doc.setHtml(self.delegate.markdown.render(block))
+        if self.width:
+            doc.setTextWidth(self.width)
+        return doc
+
+    def _measure(self, block: MarkdownBlock, doc: Optional[QTextDocument]) -> int:
+        if block.kind == "code":
+            lines = markdown_code(block).count("\n") + 1
+            return lines * self.delegate.code_line_height + 2 * self.CODE_PADDING
+        return math.ceil(doc.size().height())
+
+    def draw(self, painter: QPainter, context, top: float, bottom: float):
+        # top/bottom — видимая полоса в координатах сообщения; остальные блоки не рисуются
+        for n, block in enumerate(self.blocks):
+            y = self.tops[n]
+            if y + self.heights[n] < top or y > bottom:
+                continue
+            painter.save()
+            painter.translate(0, y)
+            if block.kind == "code":
+                if self.docs[n] is None:
+                    self.docs[n] = self.delegate.code_document(markdown_code(block))
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor(COLORS['bg_secondary']))
+                painter.drawRoundedRect(QRectF(0, 0, self.width, self.heights[n]), 6, 6)
+                painter.setClipRect(QRectF(0, 0, self.width, self.heights[n]))
+                painter.translate(self.CODE_PADDING, self.CODE_PADDING)
+            self.docs[n].documentLayout().draw(painter, context)
+            painter.restore()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    # Рисует «пузыри» сообщений без отдельного виджета на каждое сообщение.
+    # Раскладка текста кэшируется по ширине; высоты хранятся отдельно и дёшево.
+    # Ответы ассистента размечаются как Markdown, сообщения пользователя — как есть.
+    PADDING_H = 12
+    PADDING_V = 8
+    INDENT = 40
+    SPACING = 12
+    RADIUS = 12
+
+    def __init__(self, view: QListView):
+        super().__init__(view)
+        self.view = view
+        self.text_font = QFont(view.font())
+        self.text_font.setPixelSize(13)
+        self.time_font = QFont(view.font())
+        self.time_font.setPixelSize(10)
+        self.time_height = QFontMetrics(self.time_font).height()
+        self.code_font = QFont("monospace")
+        self.code_font.setStyleHint(QFont.StyleHint.TypeWriter)
+        self.code_font.setPixelSize(12)
+        self.code_line_height = QFontMetrics(self.code_font).lineSpacing()
+        self.markdown = MarkdownRenderer()
+        self._layouts: "OrderedDict[int, tuple]" = OrderedDict()
+        self._heights: Dict[int, tuple] = {}
+
+    def clear_cache(self):
+        self._layouts.clear()
+        self._heights.clear()
+
+    def _text_width(self, width: int) -> int:
+        return max(40, width - self.INDENT - 2 * self.PADDING_H)
+
+    def text_document(self) -> QTextDocument:
+        doc = QTextDocument()
+        doc.setDocumentMargin(0)
+        doc.setDefaultFont(self.text_font)
+        doc.setDefaultStyleSheet(f"a {{ color: {COLORS['highlight']}; }}")
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+        doc.setDefaultTextOption(option)
+        return doc
+
+    def code_document(self, code: str) -> QTextDocument:
+        # Код не переносится: высота блока заранее известна по числу строк
+        doc = QTextDocument()
+        doc.setDocumentMargin(0)
+        doc.setDefaultFont(self.code_font)
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapMode.NoWrap)
+        doc.setDefaultTextOption(option)
+        doc.setPlainText(code)
+        return doc
+
+    def _layout(self, message: Message, text_width: int) -> MessageLayout:
+        key = id(message)
+        entry = self._layouts.get(key)
+        if entry is not None and entry[0] is message:
+            layout = entry[1]
+            self._layouts.move_to_end(key)
+        else:
+            layout = MessageLayout(self, markdown=message.role != 'user')
+            self._layouts[key] = (message, layout)
+            while len(self._layouts) > LAYOUT_CACHE_SIZE:
+                self._layouts.popitem(last=False)
+        layout.set_width(text_width)
+        layout.update(message.content)
+        return layout
+
+    def _text_height(self, message: Message, text_width: int) -> int:
+        key = id(message)
+        cached = self._heights.get(key)
+        # Сравнивается сам текст, а не длина: set_text может заменить его строкой той же длины
+        if cached is not None and cached[0] == text_width and cached[1] == message.content:
+            return cached[2]
+        height = self._layout(message, text_width).height
+        self._heights[key] = (text_width, message.content, height)
+        return height
+
+    def sizeHint(self, option, index: QModelIndex) -> QSize:
+        message = index.data(MessageListModel.MessageRole)
+        width = self.view.viewport().width()
+        height = self._text_height(message, self._text_width(width))
+        return QSize(width, 2 * self.PADDING_V + height + 4 + self.time_height + self.SPACING)
+
+    def paint(self, painter: QPainter, option, index: QModelIndex):
+        message = index.data(MessageListModel.MessageRole)
+        rect = option.rect
+        is_user = message.role == 'user'
+        bubble = QRectF(
+            rect.left() + (self.INDENT if is_user else 0),
+            rect.top(),
+            rect.width() - self.INDENT,
+            rect.height() - self.SPACING
+        )
+        layout = self._layout(message, self._text_width(rect.width()))
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(COLORS['highlight'] if is_user else COLORS['bg_tertiary']))
+        painter.drawRoundedRect(bubble, self.RADIUS, self.RADIUS)
+
+        origin_y = bubble.top() + self.PADDING_V
+        painter.translate(bubble.left() + self.PADDING_H, origin_y)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(
+            QPalette.ColorRole.Text,
+            QColor('white' if is_user else COLORS['text_primary'])
+        )
+        viewport = self.view.viewport().rect()
+        layout.draw(painter, context, viewport.top() - origin_y, viewport.bottom() - origin_y)
+
+        painter.setFont(self.time_font)
+        painter.setPen(QColor(COLORS['text_muted']))
+        painter.drawText(
+            QRectF(0, layout.height + 4, layout.width, self.time_height),
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+            message.timestamp.strftime("%H:%M") + ("  •  ⚡ из кэша" if message.cached else "")
+        )
+        painter.restore()
+
+
+class TranscriptView(QListView):
+
+    def __init__(self, model: MessageListModel, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.message_delegate = MessageDelegate(self)
+        self.setItemDelegate(self.message_delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        # Полоса прокрутки видна всегда: её появление меняло бы ширину строк и высоты
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setFrameShape(QFrame.Shape.NoFrame)
+        self.verticalScrollBar().setSingleStep(20)
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.customContextMenuRequested.connect(self._show_context_menu)
+        # Изменение текста (стриминг) меняет высоту строки
+        model.dataChanged.connect(
+            lambda top_left, *_: self.message_delegate.sizeHintChanged.emit(top_left)
+        )
+        model.modelReset.connect(self.message_delegate.clear_cache)
+
+    def keyPressEvent(self, event: QKeyEvent):
+        if event.matches(QKeySequence.StandardKey.Copy):
+            self._copy_current()
+            return
+        super().keyPressEvent(event)
+
+    def _copy_current(self):
+        index = self.currentIndex()
+        if index.isValid():
+            QApplication.clipboard().setText(index.data())
+
+    def _show_context_menu(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return
+        self.setCurrentIndex(index)
+        menu = QMenu(self)
+        menu.addAction("Копировать", self._copy_current)
+        menu.exec(self.viewport().mapToGlobal(pos))
+
+
+class UiScheduler(QObject):
+    # Единая точка обновления ленты и статуса. Вставки, изменения текста,
+    # статус и прокрутка копятся и применяются одним проходом не чаще раза
+    # в кадр. Прокрутка следует за концом ленты, только пока пользователь внизу.
+
+    def __init__(self, model: MessageListModel, view: QListView, status: QLabel,
+                 interval_ms: int = UI_FRAME_MS, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.view = view
+        self.status = status
+        self.follow = True
+        self._inserts: List[Message] = []
+        self._dirty: Dict[int, Message] = {}
+        self._status: Optional[str] = None
+        self._scroll = False
+        self._force_scroll = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+        view.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+
+    def add_message(self, message: Message):
+        self._inserts.append(message)
+        self._schedule()
+
+    def append_text(self, message: Message, text: str):
+        message.content += text
+        self._mark(message)
+
+    def set_text(self, message: Message, text: str):
+        message.content = text
+        self._mark(message)
+
+    def set_status(self, text: str):
+        self._status = text
+        self._schedule()
+
+    def scroll_to_bottom(self, force: bool = False):
+        # force — действие самого пользователя (отправка, смена сессии)
+        self._scroll = True
+        self._force_scroll = self._force_scroll or force
+        self._schedule()
+
+    def clear(self):
+        # Смена сессии: отложенные сообщения относятся к старой ленте
+        self._inserts.clear()
+        self._dirty.clear()
+
+    def _mark(self, message: Message):
+        self._dirty[id(message)] = message
+        self._schedule()
+
+    def _schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def _on_scrolled(self, value: int):
+        bar = self.view.verticalScrollBar()
+        self.follow = value >= bar.maximum() - FOLLOW_SLACK_PX
+
+    def flush(self):
+        started = time.perf_counter()
+        inserts, self._inserts = self._inserts, []
+        dirty, self._dirty = self._dirty, {}
+        # Сообщение из этой же пачки вставок уже содержит свежий текст
+        inserted = {id(message) for message in inserts}
+        self.model.extend(inserts)
+        for key, message in dirty.items():
+            if key not in inserted:
+                self.model.refresh(message)
+        if self._status is not None:
+            self.status.setText(self._status)
+            self._status = None
+        if self._scroll and (self.follow or self._force_scroll):
+            self.view.scrollToBottom()
+            self.follow = True
+        self._scroll = self._force_scroll = False
+        METRICS.inc("mkai_ui_flushes_total")
+        METRICS.observe("mkai_ui_flush_ms", (time.perf_counter() - started) * 1000)
+
+
+class StallMonitor(QObject):
+    # Опоздание тика короткого таймера = время, на которое GUI-поток был занят
+    # (раскладка, отрисовка, синхронный ввод-вывод), в отличие от медленного сервера
+
+    def __init__(self, interval_ms: int = STALL_TICK_MS,
+                 threshold_ms: int = STALL_THRESHOLD_MS, parent=None):
+        super().__init__(parent)
+        self.interval_ms = interval_ms
+        self.threshold_ms = threshold_ms
+        self.last = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+        self.timer.start(interval_ms)
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = (now - self.last) * 1000 - self.interval_ms
+        self.last = now
+        METRICS.observe("mkai_ui_tick_lag_ms", max(0.0, lag))
+        if lag > self.threshold_ms:
+            METRICS.inc("mkai_ui_stalls_total")
+            METRICS.inc("mkai_ui_stall_ms_total", lag)
+
+
+class MetricsPanel(QScrollArea):
+    # Сводка METRICS в боковой панели; обновляется, только пока видна
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("metricsPanel")
+        self.setWidgetResizable(True)
+        self.setMaximumHeight(260)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+
+        content = QWidget()
+        layout = QVBoxLayout(content)
+        layout.setContentsMargins(10, 8, 10, 8)
+        layout.setSpacing(8)
+
+        self.text = QLabel()
+        self.text.setObjectName("metricsText")
+        self.text.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        layout.addWidget(self.text)
+
+        buttons = QHBoxLayout()
+        for title, fmt in (("JSON", "json"), ("Prometheus", "prom")):
+            btn = QPushButton(title)
+            btn.setObjectName("metricsButton")
+            btn.setCursor(Qt.CursorShape.PointingHandCursor)
+            btn.clicked.connect(lambda checked, fmt=fmt: self._export(fmt))
+            buttons.addWidget(btn)
+        layout.addLayout(buttons)
+        self.setWidget(content)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(METRICS_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        lines = ["HTTP, мс        p50   p95     n"]
+        for labels, h in METRICS.series("mkai_http_request_ms"):
+            lines.append(f"{labels.get('endpoint', ''):<12}{h['p50_ms']:>7.0f}{h['p95_ms']:>6.0f}{h['count']:>6}")
+        for labels, h in METRICS.series("mkai_chat_first_token_ms"):
+            lines.append(f"{'1-й токен':<12}{h['p50_ms']:>7.0f}{h['p95_ms']:>6.0f}{h['count']:>6}")
+        lines.append(
+            f"повторы {METRICS.total('mkai_http_retries_total'):.0f}  "
+            f"ошибки {METRICS.total('mkai_http_errors_total') + METRICS.total('mkai_errors_total'):.0f}"
+        )
+        lines.append(
+            f"↑ {METRICS.total('mkai_http_sent_bytes_total') / 1024:.0f} КБ  "
+            f"↓ {METRICS.total('mkai_http_received_bytes_total') / 1024:.0f} КБ"
+        )
+        for cache in ("search", "documents"):
+            hits = METRICS.total("mkai_cache_requests_total", cache=cache, result="hit")
+            total = METRICS.total("mkai_cache_requests_total", cache=cache)
+            if total:
+                lines.append(f"кэш {cache:<10}{hits / total:>6.0%} из {total:.0f}")
+
+        lag = next((h for _, h in METRICS.series("mkai_ui_tick_lag_ms")), {})
+        lines.append(
+            f"UI: зависаний {METRICS.total('mkai_ui_stalls_total'):.0f}, "
+            f"p95 {lag.get('p95_ms', 0):.0f}, макс {lag.get('max_ms', 0):.0f} мс"
+        )
+        gauges = METRICS.snapshot()["gauges"]
+        lines.append(
+            f"виджетов {gauges.get('mkai_ui_widgets', 0):.0f}, "
+            f"сообщений {gauges.get('mkai_ui_messages', 0):.0f}"
+        )
+        self.text.setText("\n".join(lines))
+
+    def _export(self, fmt: str):
+        suffix = "json" if fmt == "json" else "prom"
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Сохранить метрики", f"mkai-metrics.{suffix}", f"*.{suffix}"
+        )
+        if path:
+            text = METRICS.to_json() if fmt == "json" else METRICS.to_prometheus()
+            Path(path).write_text(text, encoding="utf-8")
 
 
 class StageButton(QPushButton):
@@ -236,52 +1183,61 @@ class StageButton(QPushButton):
         self._setup_ui()
     
     def _setup_ui(self):
+        self.setObjectName("stageButton")
         self.setFixedHeight(44)
         self.setCursor(Qt.CursorShape.PointingHandCursor)
 
         self.setText(f"{self.stage.value[1]}")
+        self.set_state(self.is_active, self.is_completed)
 
-        if self.is_active:
-            self.setStyleSheet(f"""
-                QPushButton {{
-                    background-color: {COLORS['highlight']};
-                    color: white;
-                    border: none;
-                    border-radius: 6px;
-                    text-align: left;
-                    padding-left: 12px;
-                    font-size: 12px;
-                    font-weight: 500;
-                }}
-            """)
-        elif self.is_completed:
-            self.setStyleSheet(f"""
-                QPushButton {{
-                    background-color: {COLORS['success']};
-                    color: white;
-                    border: none;
-                    border-radius: 6px;
-                    text-align: left;
-                    padding-left: 12px;
-                    font-size: 12px;
-                }}
-            """)
+    def set_state(self, is_active: bool, is_completed: bool):
+        self.is_active = is_active
+        self.is_completed = is_completed
+        state = "active" if is_active else "completed" if is_completed else "idle"
+        if self.property("state") != state:
+            self.setProperty("state", state)
+            repolish(self)
+
+
+# ============================================================
+# ПРОФИЛЬ ЗАПУСКА
+# ============================================================
+
+class StartupProfiler:
+    # MKAI_PROFILE_STARTUP=1 — длительности фаз запуска в stderr,
+    # MKAI_PROFILE_STARTUP=путь.json — в JSON-файл
+
+    def __init__(self, target: str = "", origin: float = _STARTUP_T0):
+        self.target = target
+        self.enabled = target not in ("", "0")
+        self.origin = origin
+        self.last = origin
+        self.phases: List[tuple] = []
+
+    def mark(self, phase: str):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled or not self.phases:
+            return
+        total_ms = (self.last - self.origin) * 1000
+        if self.target.endswith(".json"):
+            Path(self.target).write_text(json.dumps({
+                "phases": {phase: round(sec * 1000, 1) for phase, sec in self.phases},
+                "total_ms": round(total_ms, 1),
+            }, ensure_ascii=False, indent=2), encoding="utf-8")
         else:
-            self.setStyleSheet(f"""
-                QPushButton {{
-                    background-color: transparent;
-                    color: {COLORS['text_secondary']};
-                    border: none;
-                    border-radius: 6px;
-                    text-align: left;
-                    padding-left: 12px;
-                    font-size: 12px;
-                }}
-                QPushButton:hover {{
-                    background-color: {COLORS['accent']};
-                    color: {COLORS['text_primary']};
-                }}
-            """)
+            for phase, sec in self.phases:
+                print(f"[startup] {phase:<24}{sec * 1000:8.1f} мс", file=sys.stderr)
+            print(f"[startup] {'всего':<24}{total_ms:8.1f} мс", file=sys.stderr)
+        self.phases = []
+
+
+STARTUP_PROFILER = StartupProfiler(os.environ.get("MKAI_PROFILE_STARTUP", ""))
 
 
 # ============================================================
@@ -289,46 +1245,81 @@ class StageButton(QPushButton):
 # ============================================================
 
 class TaskSolverWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, session_id: str = SESSION_ID):
         super().__init__()
         
-        self.api = APIClient()
+        self.api = APIClient(
+            search_cache=SearchCache(path=DATA_DIR / "search.db"),
+            answer_cache=AnswerCache() if ANSWER_CACHE_ENABLED else None
+        )
+        self.store = SessionStore()
+        self.session_id = session_id
+        self._pdf_extractor: Optional[PDFExtractor] = None
         self.messages: List[Message] = []
         self.documents: List[Document] = []
         self.search_results: List[SearchResult] = []
+        self.doc_index = DocumentIndex()
         self.current_stage = Stage.ANALYSIS
-        self.chat_worker: Optional[ChatWorker] = None
-        self.search_worker: Optional[SearchWorker] = None
+        self.engine = AsyncEngine()
+        self.chat_task: Optional[EngineTask] = None
+        self.chat_stage = ""  # этап, на котором задан текущий вопрос
+        self.message_model = MessageListModel(self.messages)
+        self.docs_model = DocumentListModel()
+        self.stream_message: Optional[Message] = None
+        self.history_exhausted = True
+        self.conversation = ConversationContext()
+        self.search_aggregator = SearchAggregator()
+        self.search_message: Optional[Message] = None
+        self.search_tasks: List[EngineTask] = []
+        self.search_pending = 0
+        self.search_total = 0
+        self.auto_active = False
+        self.auto_task = ""
+        self.auto_stages: List[Stage] = []  # оставшиеся этапы авторешения
+        self.auto_waiting = False           # «Поиск» ждёт упреждающую выдачу
+        STARTUP_PROFILER.mark("клиенты и хранилища")
         
         self._setup_window()
         self._setup_ui()
+        self.ui = UiScheduler(self.message_model, self.transcript, self.status_label, parent=self)
         self._connect_signals()
+        self._register_metrics()
+        STARTUP_PROFILER.mark("интерфейс")
+        self._open_session(session_id)
+        STARTUP_PROFILER.mark("сессия")
+
+    @property
+    def pdf_extractor(self) -> PDFExtractor:
+        # Кэш документов и пул процессов нужны только при первой загрузке PDF
+        if self._pdf_extractor is None:
+            self._pdf_extractor = PDFExtractor(self.api, cache=DocumentCache())
+        return self._pdf_extractor
+
+    def _register_metrics(self):
+        self.stall_monitor = StallMonitor(parent=self)
+        METRICS.gauge("mkai_ui_widgets", lambda: len(QApplication.allWidgets()))
+        METRICS.gauge("mkai_ui_messages", lambda: self.message_model.rowCount())
+        METRICS.gauge("mkai_ui_layout_cache", lambda: len(self.transcript.message_delegate._layouts))
+        METRICS.gauge("mkai_engine_tasks", lambda: len(self.engine.tasks))
+
+    def _toggle_metrics(self, checked: bool):
+        # Панель создаётся при первом открытии
+        if self.metrics_panel is None:
+            self.metrics_panel = MetricsPanel()
+            self.metrics_slot.addWidget(self.metrics_panel)
+        self.metrics_panel.setVisible(checked)
+
+    def finish_startup(self):
+        # Вызывается после первой отрисовки: то, что не нужно для первого кадра
+        STARTUP_PROFILER.mark("первая отрисовка")
+        STARTUP_PROFILER.report()
+        self.engine.submit(lambda task: self.engine.run_blocking(lambda: self.api.session))
     
     def _setup_window(self):
         self.setWindowTitle("MKAI")
         self.setMinimumSize(1200, 800)
 
-        self.setStyleSheet(f"""
-            QMainWindow {{
-                background-color: {COLORS['bg_primary']};
-            }}
-            QWidget {{
-                background-color: {COLORS['bg_primary']};
-                color: {COLORS['text_primary']};
-            }}
-            QScrollBar:vertical {{
-                background-color: {COLORS['bg_secondary']};
-                width: 6px;
-                border-radius: 3px;
-            }}
-            QScrollBar::handle:vertical {{
-                background-color: {COLORS['accent']};
-                border-radius: 3px;
-            }}
-            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {{
-                height: 0px;
-            }}
-        """)
+        apply_stylesheet(QApplication.instance())
     
     def _setup_ui(self):
         central = QWidget()
@@ -339,88 +1330,50 @@ class TaskSolverWindow(QMainWindow):
         main_layout.setSpacing(0)
 
         chat_container = QWidget()
-        chat_container.setStyleSheet(f"background-color: {COLORS['bg_primary']};")
         chat_layout = QVBoxLayout(chat_container)
         chat_layout.setContentsMargins(24, 20, 24, 20)
         chat_layout.setSpacing(16)
 
         header = QLabel("MKAI")
-        header.setStyleSheet(f"""
-            font-size: 18px;
-            font-weight: 600;
-            color: {COLORS['text_primary']};
-            padding: 4px 0;
-        """)
-        chat_layout.addWidget(header)
-
-        self.messages_widget = QWidget()
-        self.messages_layout = QVBoxLayout(self.messages_widget)
-        self.messages_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.messages_layout.setSpacing(12)
-        self.messages_layout.setContentsMargins(0, 0, 0, 0)
-        
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidget(self.messages_widget)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-        self.scroll_area.setStyleSheet(f"""
-            QScrollArea {{
-                border: none;
-                background-color: {COLORS['bg_primary']};
-            }}
-        """)
-        chat_layout.addWidget(self.scroll_area, 1)
-
-        self._show_welcome()
+        header.setObjectName("header")
+
+        self.status_label = QLabel("")
+        self.status_label.setObjectName("statusLabel")
+
+        self.metrics_btn = QPushButton("📊")
+        self.metrics_btn.setObjectName("headerButton")
+        self.metrics_btn.setToolTip("Метрики производительности")
+        self.metrics_btn.setCheckable(True)
+        self.metrics_btn.setFixedSize(28, 28)
+        self.metrics_btn.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.metrics_panel: Optional[MetricsPanel] = None
+
+        header_layout = QHBoxLayout()
+        header_layout.addWidget(header)
+        header_layout.addStretch()
+        header_layout.addWidget(self.status_label)
+        header_layout.addWidget(self.metrics_btn)
+        chat_layout.addLayout(header_layout)
+
+        self.transcript = TranscriptView(self.message_model)
+        self.transcript.setObjectName("transcript")
+        chat_layout.addWidget(self.transcript, 1)
 
         input_container = QFrame()
-        input_container.setStyleSheet(f"""
-            QFrame {{
-                background-color: {COLORS['bg_secondary']};
-                border: 1px solid {COLORS['border']};
-                border-radius: 12px;
-            }}
-        """)
+        input_container.setObjectName("inputContainer")
         input_layout = QHBoxLayout(input_container)
         input_layout.setContentsMargins(16, 12, 12, 12)
         input_layout.setSpacing(12)
         
         self.input_field = QLineEdit()
+        self.input_field.setObjectName("inputField")
         self.input_field.setPlaceholderText("Введите сообщение...")
-        self.input_field.setStyleSheet(f"""
-            QLineEdit {{
-                background: transparent;
-                border: none;
-                color: {COLORS['text_primary']};
-                font-size: 14px;
-            }}
-            QLineEdit::placeholder {{
-                color: {COLORS['text_muted']};
-            }}
-        """)
         input_layout.addWidget(self.input_field, 1)
         
         self.send_btn = QPushButton("→")
         self.send_btn.setFixedSize(36, 36)
         self.send_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        self.send_btn.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {COLORS['highlight']};
-                color: white;
-                border: none;
-                border-radius: 18px;
-                font-size: 16px;
-                font-weight: bold;
-            }}
-            QPushButton:hover {{
-                background-color: #2563EB;
-            }}
-            QPushButton:disabled {{
-                background-color: {COLORS['accent']};
-                color: {COLORS['text_muted']};
-            }}
-        """)
+        self.send_btn.setObjectName("sendButton")
         input_layout.addWidget(self.send_btn)
         
         chat_layout.addWidget(input_container)
@@ -429,7 +1382,7 @@ class TaskSolverWindow(QMainWindow):
 
         separator = QFrame()
         separator.setFixedWidth(1)
-        separator.setStyleSheet(f"background-color: {COLORS['border']};")
+        separator.setObjectName("separator")
         main_layout.addWidget(separator)
 
         self._setup_sidebar(main_layout)
@@ -438,19 +1391,14 @@ class TaskSolverWindow(QMainWindow):
         sidebar = QWidget()
         sidebar.setMinimumWidth(240)
         sidebar.setMaximumWidth(280)
-        sidebar.setStyleSheet(f"background-color: {COLORS['bg_secondary']};")
+        sidebar.setObjectName("sidebar")
         
         sidebar_layout = QVBoxLayout(sidebar)
         sidebar_layout.setContentsMargins(16, 20, 16, 16)
         sidebar_layout.setSpacing(20)
 
         stages_label = QLabel("ЭТАПЫ")
-        stages_label.setStyleSheet(f"""
-            font-size: 10px;
-            font-weight: 600;
-            color: {COLORS['text_muted']};
-            letter-spacing: 1.5px;
-        """)
+        stages_label.setObjectName("sectionLabel")
         sidebar_layout.addWidget(stages_label)
         
         self.stage_buttons: List[StageButton] = []
@@ -466,29 +1414,12 @@ class TaskSolverWindow(QMainWindow):
         sidebar_layout.addSpacing(12)
 
         actions_label = QLabel("ДЕЙСТВИЯ")
-        actions_label.setStyleSheet(f"""
-            font-size: 10px;
-            font-weight: 600;
-            color: {COLORS['text_muted']};
-            letter-spacing: 1.5px;
-        """)
+        actions_label.setObjectName("sectionLabel")
         sidebar_layout.addWidget(actions_label)
 
         self.search_input = QLineEdit()
+        self.search_input.setObjectName("searchInput")
         self.search_input.setPlaceholderText("Поиск...")
-        self.search_input.setStyleSheet(f"""
-            QLineEdit {{
-                background-color: {COLORS['bg_tertiary']};
-                border: 1px solid {COLORS['border']};
-                border-radius: 6px;
-                padding: 10px 12px;
-                color: {COLORS['text_primary']};
-                font-size: 12px;
-            }}
-            QLineEdit::placeholder {{
-                color: {COLORS['text_muted']};
-            }}
-        """)
         sidebar_layout.addWidget(self.search_input)
 
         actions_layout = QVBoxLayout()
@@ -496,40 +1427,46 @@ class TaskSolverWindow(QMainWindow):
         
         self.search_btn = self._create_action_button("🔍  Веб-поиск")
         self.scholar_btn = self._create_action_button("📚  Научные статьи")
+        self.fanout_btn = self._create_action_button("🌐  Искать везде")
         self.upload_btn = self._create_action_button("📄  Загрузить PDF")
+        self.sessions_btn = self._create_action_button("🕘  Сессии")
+        self.auto_btn = self._create_action_button("⚡  Авторешение")
         
+        actions_layout.addWidget(self.auto_btn)
         actions_layout.addWidget(self.search_btn)
         actions_layout.addWidget(self.scholar_btn)
+        actions_layout.addWidget(self.fanout_btn)
         actions_layout.addWidget(self.upload_btn)
+        actions_layout.addWidget(self.sessions_btn)
         
         sidebar_layout.addLayout(actions_layout)
 
         sidebar_layout.addSpacing(12)
         
         self.docs_label = QLabel("ДОКУМЕНТЫ: 0")
-        self.docs_label.setStyleSheet(f"""
-            font-size: 10px;
-            font-weight: 600;
-            color: {COLORS['text_muted']};
-            letter-spacing: 1.5px;
-        """)
+        self.docs_label.setObjectName("sectionLabel")
         sidebar_layout.addWidget(self.docs_label)
         
-        self.docs_list = QWidget()
-        self.docs_layout = QVBoxLayout(self.docs_list)
-        self.docs_layout.setContentsMargins(0, 0, 0, 0)
-        self.docs_layout.setSpacing(4)
-        sidebar_layout.addWidget(self.docs_list)
-        
-        sidebar_layout.addStretch()
+        self.docs_list = QListView()
+        self.docs_list.setObjectName("docsList")
+        self.docs_list.setModel(self.docs_model)
+        # Все строки одной высоты: представлению не нужно измерять каждую
+        self.docs_list.setUniformItemSizes(True)
+        self.docs_list.setTextElideMode(Qt.TextElideMode.ElideMiddle)
+        self.docs_list.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.docs_list.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.docs_list.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.docs_list.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.docs_list.setMinimumHeight(DOCS_LIST_MIN_HEIGHT)
+        # Список занимает свободное место панели и прокручивается, когда не помещается
+        sidebar_layout.addWidget(self.docs_list, 1)
+
+        self.metrics_slot = QVBoxLayout()
+        sidebar_layout.addLayout(self.metrics_slot)
 
         model_info = QLabel("GLM-5 • Zhipu AI")
         model_info.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        model_info.setStyleSheet(f"""
-            font-size: 10px;
-            color: {COLORS['text_muted']};
-            padding: 8px;
-        """)
+        model_info.setObjectName("modelInfo")
         sidebar_layout.addWidget(model_info)
         
         parent_layout.addWidget(sidebar, 1)
@@ -538,30 +1475,107 @@ class TaskSolverWindow(QMainWindow):
         btn = QPushButton(text)
         btn.setFixedHeight(36)
         btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        btn.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {COLORS['bg_tertiary']};
-                color: {COLORS['text_secondary']};
-                border: 1px solid {COLORS['border']};
-                border-radius: 6px;
-                text-align: left;
-                padding-left: 12px;
-                font-size: 12px;
-            }}
-            QPushButton:hover {{
-                background-color: {COLORS['accent']};
-                color: {COLORS['text_primary']};
-                border-color: {COLORS['highlight']};
-            }}
-        """)
+        btn.setObjectName("actionButton")
         return btn
     
     def _connect_signals(self):
-        self.send_btn.clicked.connect(self._send_message)
+        self.send_btn.clicked.connect(self._on_send_clicked)
         self.input_field.returnPressed.connect(self._send_message)
+        self.auto_btn.clicked.connect(self._start_auto_run)
+        self.metrics_btn.toggled.connect(self._toggle_metrics)
         self.search_btn.clicked.connect(self._do_search)
         self.scholar_btn.clicked.connect(lambda: self._do_search(scholar=True))
+        self.fanout_btn.clicked.connect(lambda: self._do_search(fanout=True))
         self.upload_btn.clicked.connect(self._upload_pdf)
+        self.sessions_btn.clicked.connect(self._choose_session)
+        self.transcript.verticalScrollBar().valueChanged.connect(self._on_transcript_scrolled)
+        for signal in (self.docs_model.rowsInserted, self.docs_model.rowsRemoved,
+                       self.docs_model.modelReset, self.docs_model.dataChanged):
+            signal.connect(self._update_docs_label)
+
+    def _open_session(self, session_id: str):
+        self.session_id = session_id
+        self.api.session_id = session_id
+        self.setWindowTitle(f"MKAI • {session_id}")
+
+        # Только последняя страница истории — старые сообщения догружаются при прокрутке вверх
+        history = self.store.load_messages(session_id)
+        self.history_exhausted = len(history) < HISTORY_PAGE_SIZE
+        self.stream_message = None
+        self._finish_auto_run()
+        # Поиск прежней сессии не должен дописать выдачу в новую
+        for task in self.search_tasks:
+            task.cancel()
+        self.search_tasks = []
+        self.search_message = None
+        self.ui.clear()
+        self.message_model.reset(history)
+        self.conversation = ConversationContext.from_state(
+            self.store.load_state(session_id, "context"), history
+        )
+
+        self.documents = self.store.load_documents(session_id)
+        self.doc_index = DocumentIndex()
+        self.docs_model.reset(self.documents)
+        if self.documents:
+            # Индекс строится в фоне, чтобы не задерживать первую отрисовку окна
+            documents = list(self.documents)
+            self.engine.submit(
+                lambda task: self.engine.run_blocking(DocumentIndex.build, documents),
+                finished=lambda index: self._on_doc_index_ready(session_id, index, len(documents)),
+            )
+
+        self.search_results = [
+            SearchResult(**r) for r in self.store.load_state(session_id, "search_results", [])
+        ]
+        stage_name = self.store.load_state(session_id, "stage", Stage.ANALYSIS.value[0])
+        self._set_stage(next((s for s in Stage if s.value[0] == stage_name), Stage.ANALYSIS))
+
+        if not history:
+            self._show_welcome()
+        self.ui.scroll_to_bottom(force=True)
+
+    def _on_doc_index_ready(self, session_id: str, index: DocumentIndex, indexed: int):
+        if session_id != self.session_id:
+            return
+        # Документы, загруженные, пока индекс строился
+        for doc in self.documents[indexed:]:
+            index.add(doc)
+        self.doc_index = index
+
+    def _choose_session(self):
+        if self.chat_task and self.chat_task.is_running():
+            self.ui.set_status("Дождитесь ответа, чтобы сменить сессию")
+            return
+
+        sessions = self.store.list_sessions()
+        items = ["＋ Новая сессия"] + [
+            f"{sid} — {title or 'без названия'} ({count} сообщ., "
+            f"{datetime.fromtimestamp(updated):%d.%m %H:%M})"
+            for sid, title, updated, count in sessions
+        ]
+        item, ok = QInputDialog.getItem(self, "Сессии", "Открыть сессию:", items, 0, False)
+        if not ok:
+            return
+        index = items.index(item)
+        self._open_session(str(uuid.uuid4())[:8] if index == 0 else sessions[index - 1][0])
+
+    def _on_transcript_scrolled(self, value: int):
+        if value == 0 and not self.history_exhausted:
+            self._load_older_history()
+
+    def _load_older_history(self):
+        oldest_id = next((m.id for m in self.messages if m.id is not None), None)
+        if oldest_id is None:
+            self.history_exhausted = True
+            return
+        page = self.store.load_messages(self.session_id, before_id=oldest_id)
+        self.history_exhausted = len(page) < HISTORY_PAGE_SIZE
+        if page:
+            self.message_model.prepend(page)
+            self.transcript.scrollTo(
+                self.message_model.index(len(page)), QAbstractItemView.ScrollHint.PositionAtTop
+            )
     
     def _show_welcome(self):
         welcome = Message(
@@ -575,97 +1589,267 @@ class TaskSolverWindow(QMainWindow):
                    '• Выполнение\n'
                    '• Решение'
         )
-        self._add_message(welcome)
+        self._add_message(welcome, persist=False)
     
-    def _add_message(self, message: Message):
-        self.messages.append(message)
-        bubble = MessageBubble(message)
-        self.messages_layout.addWidget(bubble)
+    def _add_message(self, message: Message, persist: bool = True, follow: bool = False):
+        # Вставка и прокрутка применяются в ближайший кадр вместе с остальными обновлениями
+        self.ui.add_message(message)
+        if persist:
+            self.store.append_message(self.session_id, message)
+        self.ui.scroll_to_bottom(force=follow)
 
-        QTimer.singleShot(50, self._scroll_to_bottom)
-    
-    def _scroll_to_bottom(self):
-        scrollbar = self.scroll_area.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+    def _on_send_clicked(self):
+        # Во время генерации кнопка отправки работает как «Стоп»
+        if self.chat_task and self.chat_task.is_running():
+            self._cancel_chat()
+        else:
+            self._send_message()
 
     def _send_message(self):
         text = self.input_field.text().strip()
-        if not text or (self.chat_worker and self.chat_worker.isRunning()):
+        if not text or (self.chat_task and self.chat_task.is_running()) or self.auto_active:
             return
 
-        user_msg = Message(role='user', content=text)
-        self._add_message(user_msg)
         self.input_field.clear()
+        self._submit_chat(text)
+
+    def _submit_chat(self, text: str):
+        stage = self.chat_stage = self.current_stage.value[0]
+        user_msg = Message(role='user', content=text, stage=stage)
+        self._add_message(user_msg, follow=True)
 
-        context = ""
-        if self.search_results:
-            context = "\n".join([
-                f"[{r.domain}] {r.title}: {r.snippet[:150]}"
-                for r in self.search_results[:5]
-            ])
+        context = format_search_context(self.search_results)
         
-        docs = [d.content[:3000] for d in self.documents]
+        docs = self.doc_index.select(text)
+        conversation = self.conversation.build(
+            reserved_tokens=estimate_tokens(text) + estimate_tokens(context)
+            + sum(estimate_tokens(d.text) for d in docs)
+        )
+        self._remember_turn(user_msg)
 
-        self.chat_worker = ChatWorker(
-            self.api, text, self.current_stage.value[0], context, docs
+        self.chat_task = self.engine.submit(
+            lambda task: self.engine.run_blocking(
+                self.api.chat_stream, text, stage, context, docs,
+                on_chunk=task.chunk.emit, conversation=conversation, cancel=task.token
+            ),
+            priority=True,
+            chunk=self._on_chat_chunk,
+            finished=self._on_chat_response,
+            failed=lambda error: self._on_chat_response({"success": False, "error": error}),
+            cancelled=self._on_chat_cancelled,
         )
-        self.chat_worker.finished.connect(self._on_chat_response)
-        self.chat_worker.start()
         
-        self.send_btn.setEnabled(False)
+        self.send_btn.setText("■")
+        self.send_btn.setToolTip("Остановить генерацию")
+
+    def _reset_send_button(self):
+        self.send_btn.setText("→")
+        self.send_btn.setToolTip("")
+
+    def _cancel_chat(self):
+        task = self.chat_task
+        task.cancel()
+        # Обрыв соединения не всегда останавливает генерацию — просим сервер явно
+        self.engine.submit(
+            lambda _: self.engine.run_blocking(self.api.cancel_chat, task.token), priority=True
+        )
+        self._finish_auto_run()
+
+    def _on_chat_cancelled(self):
+        self._reset_send_button()
+        message, self.stream_message = self.stream_message, None
+        if message is None:
+            self._add_message(Message(role='assistant', content="⏹ Остановлено"))
+            return
+        # Частичный ответ остаётся в истории и в контексте диалога
+        self.ui.append_text(message, "\n\n⏹ Остановлено")
+        self.store.append_message(self.session_id, message)
+        self._remember_turn(message)
     
+    def _on_chat_chunk(self, text: str):
+        # Куски, доставленные после отмены или после итогового ответа (сигналы идут
+        # из разных потоков и могут обогнать друг друга), не должны открыть новое сообщение
+        task = self.sender()
+        if task is not self.chat_task or task.is_cancelled or task.delivered:
+            return
+        if self.stream_message is None:
+            # В хранилище попадает уже готовый ответ, см. _on_chat_response
+            self.stream_message = Message(role='assistant', content='', stage=self.chat_stage)
+            self._add_message(self.stream_message, persist=False)
+        self.ui.append_text(self.stream_message, text)
+        self.ui.scroll_to_bottom()
+
     def _on_chat_response(self, result: dict):
-        self.send_btn.setEnabled(True)
+        self._reset_send_button()
+        message, self.stream_message = self.stream_message, None
         
         if result.get("success"):
-            assistant_msg = Message(role='assistant', content=result["response"])
+            if message is not None:
+                message.cached = bool(result.get("cached"))
+                self.ui.set_text(message, result["response"])
+                self.store.append_message(self.session_id, message)
+            else:
+                message = Message(
+                    role='assistant', content=result["response"], stage=self.chat_stage,
+                    cached=bool(result.get("cached"))
+                )
+                self._add_message(message)
+            self._remember_turn(message)
+            if self.auto_active:
+                self._advance_auto_run(message)
+            return
+
+        error = f"❌ Ошибка: {result.get('error', 'Неизвестная ошибка')}"
+        if message is not None:
+            self.ui.append_text(message, f"\n\n{error}")
+            self.store.append_message(self.session_id, message)
         else:
-            assistant_msg = Message(
-                role='assistant',
-                content=f"❌ Ошибка: {result.get('error', 'Неизвестная ошибка')}"
-            )
-        
-        self._add_message(assistant_msg)
+            self._add_message(Message(role='assistant', content=error))
+        self._finish_auto_run()
     
+    def _start_auto_run(self):
+        if (self.chat_task and self.chat_task.is_running()) or self.auto_active:
+            return
+        # Задача — из поля ввода, иначе последний вопрос пользователя
+        text = self.input_field.text().strip() or next(
+            (m.content for m in reversed(self.messages) if m.role == 'user' and m.stage), ""
+        )
+        if not text:
+            return
+
+        self.input_field.clear()
+        stages = list(Stage)
+        self.auto_active = True
+        self.auto_task = text
+        self.auto_stages = stages[stages.index(self.current_stage):]
+        self.auto_btn.setEnabled(False)
+        # Этапы переключает сам автопрогон — ручной выбор сбил бы цепочку
+        for btn in self.stage_buttons:
+            btn.setEnabled(False)
+        self._run_next_stage(first=True)
+
+    def _run_next_stage(self, first: bool = False):
+        if not self.auto_stages:
+            self._finish_auto_run()
+            return
+        stage = self.auto_stages[0]
+        if stage == Stage.RESEARCH and self.search_pending:
+            # Этап стартует из _on_search_results, когда придёт упреждающая выдача
+            self.auto_waiting = True
+            return
+
+        self.auto_waiting = False
+        self.auto_stages.pop(0)
+        self._set_stage(stage)
+        self._submit_chat(StagePipeline.stage_prompt(stage, self.auto_task, first))
+
+    def _advance_auto_run(self, message: Message):
+        # Поиск для «Поиска» идёт параллельно с генерацией «Плана»
+        if message.stage == Stage.GOALS.value[0] and Stage.RESEARCH in self.auto_stages:
+            queries = derive_search_queries(message.content)
+            if queries and not self.search_pending:
+                self._start_search([(query, "general", 1) for query in queries])
+        self._run_next_stage()
+
+    def _finish_auto_run(self):
+        self.auto_active = False
+        self.auto_stages = []
+        self.auto_waiting = False
+        self.auto_btn.setEnabled(True)
+        for btn in self.stage_buttons:
+            btn.setEnabled(True)
+    
+    def _remember_turn(self, message: Message):
+        self.conversation.add(message)
+        self.store.save_state(self.session_id, "context", self.conversation.to_state())
+
     def _set_stage(self, stage: Stage):
         self.current_stage = stage
+        self.store.save_state(self.session_id, "stage", stage.value[0])
 
+        stages = list(Stage)
         for btn in self.stage_buttons:
-            btn.is_active = btn.stage == stage
-            btn.is_completed = list(Stage).index(btn.stage) < list(Stage).index(stage)
-            btn._setup_ui()
+            btn.set_state(
+                is_active=btn.stage == stage,
+                is_completed=stages.index(btn.stage) < stages.index(stage)
+            )
     
-    def _do_search(self, scholar: bool = False):
+    def _do_search(self, scholar: bool = False, fanout: bool = False):
         query = self.search_input.text().strip()
         if not query:
             return
-        
-        source = "scholar" if scholar else "general"
-        self.search_worker = SearchWorker(self.api, query, source)
-        self.search_worker.finished.connect(self._on_search_results)
-        self.search_worker.start()
-        
-        self.search_btn.setEnabled(False)
-        self.scholar_btn.setEnabled(False)
+
+        if fanout:
+            calls = [(query, source, page) for source in SEARCH_SOURCES
+                     for page in range(1, SEARCH_FANOUT_PAGES + 1)]
+        else:
+            calls = [(query, "scholar" if scholar else "general", 1)]
+        self._start_search(calls)
+
+    def _start_search(self, calls: List[tuple]):
+        # calls — (запрос, источник, страница); выдачи сливаются в одну
+        # Новый поиск вытесняет незавершённый: его запросы обрываются
+        for task in self.search_tasks:
+            task.cancel()
+        # Прежние результаты не теряются, но весят меньше свежих
+        self.search_aggregator = SearchAggregator()
+        self.search_aggregator.add(self.search_results, weight=0.5, fresh=False)
+        self.search_pending = len(calls)
+        self.search_total = len(calls)
+        self.search_message = None
+
+        session_id = self.session_id
+        self.search_tasks = [
+            self.engine.submit(
+                lambda task, query=query, source=source, page=page: self.engine.run_blocking(
+                    self.api.search, query, source, page=page, cancel=task.token
+                ),
+                finished=lambda results, page=page: self._on_search_results(
+                    session_id, results, page
+                ),
+                failed=lambda error: self._on_search_results(session_id, [], 1),
+            )
+            for query, source, page in calls
+        ]
     
-    def _on_search_results(self, results: List[SearchResult]):
-        self.search_btn.setEnabled(True)
-        self.scholar_btn.setEnabled(True)
-        self.search_results = results
+    def _on_search_results(self, session_id: str, results: List[SearchResult], page: int = 1):
+        if session_id != self.session_id:
+            return  # выдача сессии, из которой уже ушли
+        self.search_pending -= 1
+        self.search_aggregator.add(results, offset=(page - 1) * SEARCH_PAGE_SIZE)
+        found = len(self.search_aggregator.fresh)
+        done = self.search_pending == 0
+
+        if found:
+            # Результаты показываются по мере прихода, не дожидаясь самого медленного запроса
+            self.search_results = self.search_aggregator.ranked()
+            progress = "" if done else f" (источников: {self.search_total - self.search_pending}/{self.search_total})"
+            content = (
+                f"🔍 Найдено {found} результатов{progress}. Топ-3:\n\n" +
+                "\n\n".join([
+                    f"**{r.title}**\n{r.domain}\n{r.snippet[:200]}..."
+                    for r in self.search_results[:3]
+                ])
+            )
+            if self.search_message is None:
+                self.search_message = Message(role='assistant', content=content)
+                self._add_message(self.search_message, persist=False)
+            else:
+                self.ui.set_text(self.search_message, content)
         
-        if results:
-            msg = Message(
-                role='assistant',
-                content=f"🔍 Найдено {len(results)} результатов. Топ-3:\n\n" +
-                       "\n\n".join([
-                           f"**{r.title}**\n{r.domain}\n{r.snippet[:200]}..."
-                           for r in results[:3]
-                       ])
+        if not done:
+            return
+
+        self.search_tasks = []
+        if self.search_message is not None:
+            self.store.append_message(self.session_id, self.search_message)
+            self.store.save_state(
+                self.session_id, "search_results", [asdict(r) for r in self.search_results]
             )
-            self._add_message(msg)
         else:
-            msg = Message(role='assistant', content="Ничего не найдено.")
-            self._add_message(msg)
+            self._add_message(Message(role='assistant', content="Ничего не найдено."))
+        if self.auto_waiting:
+            self._run_next_stage()
     
     def _upload_pdf(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -675,10 +1859,39 @@ class TaskSolverWindow(QMainWindow):
         if not file_path:
             return
         
-        doc = self.api.extract_pdf(file_path)
+        self.upload_btn.setEnabled(False)
+        self.ui.set_status(f"Извлечение: {Path(file_path).name}…")
+        # Документ виден в списке сразу, со статусом извлечения
+        row = self.docs_model.add_pending(Path(file_path).name)
+        extractor = self.pdf_extractor
+        session_id = self.session_id
+        self.engine.submit(
+            lambda task: self.engine.run_blocking(
+                extractor.extract, file_path, on_progress=task.progress.emit
+            ),
+            progress=lambda done, total: self._on_pdf_progress(row, done, total),
+            finished=lambda doc: self._on_pdf_extracted(session_id, row, doc),
+            failed=lambda error: self._on_pdf_extracted(session_id, row, None),
+        )
+
+    def _on_pdf_progress(self, row: DocumentRow, done: int, total: int):
+        self.ui.set_status(f"Извлечение PDF: {done}/{total} стр.")
+        self.docs_model.set_progress(row, done, total)
+
+    def _on_pdf_extracted(self, session_id: str, row: DocumentRow, doc: Optional[Document]):
+        self.upload_btn.setEnabled(True)
+        self.ui.set_status("")
+        if session_id != self.session_id:
+            # Сессию сменили во время извлечения — документ сохраняется в ту,
+            # куда его загружали; список и индекс текущей сессии не трогаем
+            if doc:
+                self.store.add_document(session_id, doc)
+            return
         if doc:
             self.documents.append(doc)
-            self._update_docs_list()
+            self.doc_index.add(doc)
+            self.store.add_document(self.session_id, doc)
+            self.docs_model.resolve(row, doc)
             
             msg = Message(
                 role='assistant',
@@ -687,38 +1900,83 @@ class TaskSolverWindow(QMainWindow):
             )
             self._add_message(msg)
         else:
+            self.docs_model.remove(row)
             msg = Message(role='assistant', content="❌ Ошибка загрузки документа")
             self._add_message(msg)
     
-    def _update_docs_list(self):
-        while self.docs_layout.count():
-            self.docs_layout.takeAt(0).widget().deleteLater()
-
-        for doc in self.documents:
-            label = QLabel(f"• {doc.filename[:20]}...")
-            label.setStyleSheet(f"color: {COLORS['text_secondary']}; font-size: 11px;")
-            self.docs_layout.addWidget(label)
-        
-        self.docs_label.setText(f"ДОКУМЕНТЫ: {len(self.documents)}")
+    def _update_docs_label(self, *_):
+        pending = len(self.docs_model.rows) - self.docs_model.ready
+        suffix = f" (+{pending} в обработке)" if pending else ""
+        self.docs_label.setText(f"ДОКУМЕНТЫ: {self.docs_model.ready}{suffix}")
+
+    def closeEvent(self, event):
+        self.engine.shutdown()
+        if self._pdf_extractor is not None:
+            self._pdf_extractor.shutdown()
+        self.store.close()
+        super().closeEvent(event)
 
 
 # ============================================================
 # ЗАПУСК
 # ============================================================
 
+def close_splash():
+    # Заставка PyInstaller (--splash) закрывается, когда окно готово
+    try:
+        import pyi_splash
+    except ImportError:
+        return
+    pyi_splash.close()
+
+
+def run_smoke_test(window: "TaskSolverWindow", path: str):
+    # MKAI_SMOKE_TEST=путь.json: задействует ленивые импорты, записывает список
+    # загруженных модулей (по нему build_exe.py собирает hiddenimports/excludes) и выходит
+    window.api.session
+    window.pdf_extractor
+    try:
+        importlib.import_module("pypdf")  # импортируется в PDFExtractor только при разборе файла
+    except ImportError:
+        pass
+    try:
+        importlib.import_module("numpy")  # импортируется в AnswerCache, только если кэш ответов включён
+    except ImportError:
+        pass
+    Path(path).write_text(json.dumps({
+        "frozen": bool(getattr(sys, "frozen", False)),
+        "modules": sorted(sys.modules),
+    }, indent=2), encoding="utf-8")
+    window.close()
+    QApplication.instance().quit()
+
+
 def main():
+    # Нужно для пула процессов PDFExtractor в собранном .exe
+    multiprocessing.freeze_support()
+    STARTUP_PROFILER.mark("импорт модулей")
+
+    parser = argparse.ArgumentParser(prog="MKAI")
+    parser.add_argument("--session", default=SESSION_ID, help="ID сессии для продолжения")
+    args, qt_args = parser.parse_known_args(sys.argv[1:])
+
     QApplication.setHighDpiScaleFactorRoundingPolicy(
         Qt.HighDpiScaleFactorRoundingPolicy.PassThrough
     )
     
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyle("Fusion")
 
     font = QFont("Segoe UI", 10)
     app.setFont(font)
+    STARTUP_PROFILER.mark("QApplication")
     
-    window = TaskSolverWindow()
+    window = TaskSolverWindow(session_id=args.session)
     window.show()
+    close_splash()
+    QTimer.singleShot(0, window.finish_startup)
+    if os.environ.get("MKAI_SMOKE_TEST"):
+        QTimer.singleShot(0, lambda: run_smoke_test(window, os.environ["MKAI_SMOKE_TEST"]))
     
     sys.exit(app.exec())
 
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_server import MockConfig, MockServer  # noqa: E402
+from task_solver_core import APIClient  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    server = MockServer(MockConfig(latency=0, jitter=0, chunk_delay=0, payload_size=200)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def api(server):
+    return APIClient(server.url, backoff_base=0.01)
@@ -0,0 +1,47 @@
+import pytest
+
+from task_solver_core import AnswerCache, Stage, StagePipeline
+
+pytest.importorskip("numpy")
+
+
+def planning_prompt(task: str) -> str:
+    return StagePipeline.stage_prompt(Stage.PLANNING, task, first=False)
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache()
+
+
+def test_exact_hit_ignores_case_and_punctuation(cache):
+    cache.put("analysis", "Как решить уравнение x^2-5x+6=0?", "", "x = 2, x = 3")
+    assert cache.get("analysis", "как решить уравнение  x^2-5x+6=0", "") == "x = 2, x = 3"
+
+
+def test_near_hit_for_rephrased_question(cache):
+    cache.put("analysis", "Объясни подробно, как решить уравнение x^2-5x+6=0", "", "ответ")
+    assert cache.get("analysis", "Объясни подробно как решать уравнение x^2-5x+6=0", "") == "ответ"
+
+
+def test_miss_for_other_stage_context_or_expired(cache):
+    cache.put("analysis", "Что такое BM25?", "ctx", "ответ")
+    assert cache.get("goals", "Что такое BM25?", "ctx") is None
+    assert cache.get("analysis", "Что такое BM25?", "other") is None
+
+    expired = AnswerCache(ttl=-1)
+    expired.put("analysis", "Что такое BM25?", "", "ответ")
+    assert expired.get("analysis", "Что такое BM25?", "") is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Какой бюджет заложить на 2024 год?", "Какой бюджет заложить на 2025 год?"),
+    (planning_prompt("Как снизить затраты на 10% в отделе логистики без сокращения персонала"),
+     planning_prompt("Как снизить затраты на 40% в отделе логистики без сокращения персонала")),
+    ("Реши уравнение x^2-5x+6=0", "Реши уравнение x^2-7x+12=0"),
+    ("Реши уравнение x^2-5x+6=0", "Реши уравнение x^2+5x-6=0"),
+    ("Сравни функции parse_config и load_config", "Сравни функции parse_config и load_settings"),
+])
+def test_changed_numbers_or_identifiers_are_not_near_hits(cache, cached, asked):
+    cache.put("planning", cached, "", "ответ на другой вопрос")
+    assert cache.get("planning", asked, "") is None
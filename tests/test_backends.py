@@ -0,0 +1,132 @@
+import pytest
+
+from mock_server import MockConfig, MockServer
+from task_solver_core import HEDGE_MIN_DELAY, METRICS, APIClient, BackendPool
+
+
+def start_server(**overrides) -> MockServer:
+    config = dict(latency=0, jitter=0, chunk_delay=0, payload_size=200)
+    config.update(overrides)
+    return MockServer(MockConfig(**config)).start()
+
+
+@pytest.fixture
+def servers():
+    started = [start_server(), start_server()]
+    yield started
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def api(servers):
+    api = APIClient([server.url for server in servers], backoff_base=0.01)
+    # Первый проход фоновой проверки завершается до теста — дальше проверки вызываются явно
+    api.session
+    api.pool.stop()
+    api.pool._thread.join()
+    yield api
+    api.pool.stop()
+
+
+def probe_all(api: APIClient):
+    api.pool._probe_loop(api._probe)
+
+
+def split(servers, api, path: str) -> tuple:
+    # (сервер, на который уйдёт следующий запрос, его бэкенд, второй бэкенд)
+    primary = api.pool.pick(path)
+    secondary = api.pool.pick(path, exclude=(primary,))
+    return next(s for s in servers if s.url == primary.url), primary, secondary
+
+
+def test_pick_prefers_lowest_ewma_with_inflight_penalty():
+    pool = BackendPool(["http://a", "http://b"])
+    a, b = pool.backends
+    pool.observe(a, "/chat", 100)
+    pool.observe(b, "/chat", 60)
+    assert pool.pick("/chat") is b
+
+    with pool.track(b):
+        assert pool.pick("/chat") is a
+
+    pool.observe(b, "/chat", 300)
+    assert b.latency["/chat"] == pytest.approx(0.3 * 300 + 0.7 * 60)
+    assert pool.pick("/chat") is a
+
+
+def test_pick_skips_failed_backend_until_it_recovers():
+    pool = BackendPool(["http://a", "http://b"])
+    a, b = pool.backends
+    pool.fail(a)
+    assert pool.pick("/search") is b
+
+    pool.observe(a, "/", 5)
+    assert a.healthy and a.failures == 0
+
+
+def test_requests_are_routed_to_the_faster_backend(servers, api):
+    slow, fast = servers
+    slow.config.latency = 0.1
+    for backend in api.pool.backends:
+        api._request("GET", "/search", params={"q": "замер"}, backend=backend).close()
+
+    response = api._request("GET", "/search", params={"q": "запрос"})
+
+    assert response.backend.url == fast.url
+    assert response.backend.latency["/search"] < api.pool.backends[0].latency["/search"]
+
+
+def test_backend_with_5xx_leaves_rotation_until_health_probe(servers, api):
+    api.max_retries = 0
+    server, broken, healthy = split(servers, api, "/chat")
+    server.config.error_rate = 1.0
+
+    assert not api.chat("вопрос", "analysis")["success"]
+    assert not broken.healthy
+    assert api.pool.pick("/chat") is healthy
+    assert api.chat("вопрос", "analysis")["success"]
+
+    server.config.error_rate = 0.0
+    probe_all(api)
+
+    assert broken.healthy
+    assert len(api.pool.healthy()) == 2
+
+
+def test_5xx_fails_over_to_healthy_backend(servers, api):
+    server, broken, _ = split(servers, api, "/chat")
+    server.config.error_rate = 1.0
+    failovers = METRICS.total("mkai_http_failovers_total", endpoint="/chat")
+
+    result = api.chat("вопрос", "analysis")
+
+    assert result["success"], result
+    assert METRICS.total("mkai_http_failovers_total", endpoint="/chat") - failovers == 1
+    assert not broken.healthy
+
+
+def hedge_counts() -> tuple:
+    return (METRICS.total("mkai_http_hedged_total", endpoint="/search"),
+            METRICS.total("mkai_http_hedge_wins_total", endpoint="/search"))
+
+
+def test_slow_primary_is_hedged_and_loses(servers, api):
+    server, primary, secondary = split(servers, api, "/search")
+    server.config.latency = 1.0
+    hedged, wins = hedge_counts()
+
+    assert api.search("медленный запрос")
+
+    assert hedge_counts() == (hedged + 1, wins + 1)
+    # Проигравший получает нижнюю оценку задержки — не меньше времени до дубля
+    assert primary.latency["/search"] >= HEDGE_MIN_DELAY * 1000
+    assert api.pool.pick("/search") is secondary
+
+
+def test_fast_primary_is_not_hedged(servers, api):
+    hedged, wins = hedge_counts()
+
+    assert api.search("быстрый запрос")
+
+    assert hedge_counts() == (hedged, wins)
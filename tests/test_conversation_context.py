@@ -0,0 +1,56 @@
+from task_solver_core import ConversationContext, Message, estimate_tokens
+
+
+def turn(i: int, role: str = "user", stage: str = "analysis", size: int = 300) -> Message:
+    return Message(role, f"Реплика номер {i}. " + "слово " * size, stage=stage, id=i)
+
+
+def used_tokens(built: dict) -> int:
+    summary = estimate_tokens(built["summary"]) if built["summary"] else 0
+    return (sum(estimate_tokens(m["content"]) for m in built["history"]) + summary
+            + sum(estimate_tokens(note) for note in built["notes"].values()))
+
+
+def test_build_fits_budget_and_keeps_latest_turns():
+    context = ConversationContext(budget=2000)
+    for i in range(1, 21):
+        context.add(turn(i, "user" if i % 2 else "assistant"))
+
+    built = context.build(reserved_tokens=300)
+
+    assert used_tokens(built) <= 2000 - 300
+    assert built["history"][-1]["content"].startswith("Реплика номер 20.")
+    assert "Реплика номер 1." in built["summary"]
+    assert context.summarized_until > 0
+
+
+def test_reserved_tokens_shrink_history():
+    context = ConversationContext(budget=4000)
+    for i in range(1, 11):
+        context.add(turn(i))
+
+    assert len(context.build(2500)["history"]) < len(context.build(0)["history"])
+
+
+def test_notes_are_pinned_per_stage_and_skip_errors():
+    context = ConversationContext()
+    context.add(Message("assistant", "Цель: найти корни уравнения.", stage="goals"))
+    context.add(Message("assistant", "❌ Ошибка сервера", stage="goals"))
+    context.add(Message("assistant", "служебное сообщение"))
+
+    built = context.build()
+    assert built["notes"] == {"goals": "Цель: найти корни уравнения."}
+    assert [m["content"] for m in built["history"]] == [
+        "Цель: найти корни уравнения.", "❌ Ошибка сервера"
+    ]
+
+
+def test_state_roundtrip_skips_summarized_messages():
+    messages = [turn(i, "user" if i % 2 else "assistant", size=1000) for i in range(1, 13)]
+    context = ConversationContext()
+    for message in messages:
+        context.add(message)
+
+    restored = ConversationContext.from_state(context.to_state(), messages)
+
+    assert restored.build() == context.build()
@@ -0,0 +1,48 @@
+from task_solver_core import DOC_CHUNK_CHARS, Document, DocumentIndex, estimate_tokens
+
+FILLER = "Общие сведения о курсе и порядке сдачи работ. " * 60
+
+
+def make_docs() -> list:
+    return [
+        Document("физика.pdf", FILLER + "Закон Ома связывает напряжение, ток и сопротивление. " + FILLER),
+        Document("химия.pdf", FILLER + "Молярная масса воды равна восемнадцати граммам на моль. " + FILLER),
+    ]
+
+
+def test_chunks_cover_document_with_overlap():
+    doc = make_docs()[0]
+    chunks = DocumentIndex.build([doc]).chunks
+
+    assert chunks[0].start == 0 and chunks[-1].end == len(doc.content)
+    assert all(chunk.end - chunk.start <= DOC_CHUNK_CHARS for chunk in chunks)
+    assert all(b.start < a.end for a, b in zip(chunks, chunks[1:]))
+
+
+def test_search_ranks_chunk_with_rare_terms_first():
+    index = DocumentIndex.build(make_docs())
+
+    best = index.search("закон ома сопротивление", k=1)[0]
+    assert best.doc.filename == "физика.pdf"
+    assert "Закон Ома" in best.text
+
+    assert "Молярная масса" in index.search("молярная масса воды", k=1)[0].text
+
+
+def test_select_respects_token_budget():
+    index = DocumentIndex.build(make_docs())
+    budget = estimate_tokens(index.chunks[0].text) + 10
+
+    selected = index.select("сведения курсе сдачи работ", k=6, token_budget=budget)
+
+    assert selected
+    assert sum(estimate_tokens(chunk.text) for chunk in selected) <= budget
+
+
+def test_select_falls_back_to_document_starts():
+    docs = make_docs()
+
+    selected = DocumentIndex.build(docs).select("квантовая хромодинамика")
+
+    assert [chunk.start for chunk in selected] == [0, 0]
+    assert [chunk.doc for chunk in selected] == docs
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from task_solver_core import METRICS, Document, DocumentChunk, DocumentRegistry
+
+
+def make_chunks(text: str = "текст документа " * 300) -> list:
+    doc = Document(filename="a.txt", content=text, pages=1)
+    return [DocumentChunk(doc, 0, 500), DocumentChunk(doc, 1000, 1500)]
+
+
+def uploads() -> float:
+    return METRICS.total("mkai_http_requests_total", endpoint="/documents")
+
+
+def test_documents_uploaded_once_and_sent_by_reference(server, api):
+    chunks = make_chunks()
+    before = uploads()
+
+    assert api.chat("вопрос", "analysis", docs=chunks)["success"]
+    assert api.chat_stream("ещё вопрос", "analysis", docs=chunks)["success"]
+
+    sha = DocumentRegistry.content_hash(chunks[0].doc)
+    assert uploads() - before == 1
+    assert list(server.httpd.documents) == [sha]
+    assert server.httpd.last_chat["documents"] == []
+    assert server.httpd.last_chat["documentRefs"] == [
+        {"sha256": sha, "start": 0, "end": 500},
+        {"sha256": sha, "start": 1000, "end": 1500},
+    ]
+
+
+def test_lost_documents_are_uploaded_again_on_409(server, api):
+    chunks = make_chunks()
+    assert api.chat("вопрос", "analysis", docs=chunks)["success"]
+    server.httpd.documents.clear()  # перезапуск сервера
+    reuploads = METRICS.total("mkai_documents_reuploads_total")
+
+    result = api.chat("вопрос после перезапуска", "analysis", docs=chunks)
+
+    assert result["success"], result
+    assert METRICS.total("mkai_documents_reuploads_total") - reuploads == 1
+    assert DocumentRegistry.content_hash(chunks[0].doc) in server.httpd.documents
+    assert "documentRefs" in server.httpd.last_chat
+
+
+def test_failed_reupload_falls_back_to_text_without_stale_refs(server, api):
+    chunks = make_chunks()
+    assert api.chat("вопрос", "analysis", docs=chunks)["success"]
+    server.httpd.documents.clear()
+    server.config.documents_status = 501
+
+    result = api.chat("вопрос", "analysis", docs=chunks)
+
+    assert result["success"], result
+    assert "documentRefs" not in server.httpd.last_chat
+    assert server.httpd.last_chat["documents"] == [chunk.formatted for chunk in chunks]
+
+
+@pytest.mark.parametrize("status", [404, 405, 501])
+def test_server_without_registry_gets_text(server, api, status):
+    server.config.documents_status = status
+    chunks = make_chunks()
+    before = uploads()
+
+    assert api.chat("вопрос", "analysis", docs=chunks)["success"]
+    assert api.chat("ещё вопрос", "analysis", docs=chunks)["success"]
+
+    # Старый сервер запоминается: /documents больше не запрашивается
+    assert uploads() - before == 1
+    assert api.pool.backends[0].documents.supported is False
+    assert "documentRefs" not in server.httpd.last_chat
+    assert server.httpd.last_chat["documents"] == [chunk.formatted for chunk in chunks]
+
+
+HISTORY = [{"role": "user", "content": "длинная реплика на русском " * 40}] * 10
+
+
+def test_chat_body_is_utf8_and_gzipped_once_registry_confirmed(server, api):
+    assert api.chat("вопрос", "analysis", docs=make_chunks())["success"]
+    sent = METRICS.total("mkai_http_sent_bytes_total", endpoint="/chat")
+
+    assert api.chat("вопрос", "analysis", conversation={"history": HISTORY})["success"]
+
+    assert server.httpd.last_chat["history"] == HISTORY
+    plain = len(json.dumps(server.httpd.last_chat, ensure_ascii=False).encode("utf-8"))
+    assert METRICS.total("mkai_http_sent_bytes_total", endpoint="/chat") - sent < plain / 4
+
+
+@pytest.mark.parametrize("with_docs", [False, True])
+def test_server_without_gzip_gets_plain_json(server, api, with_docs):
+    server.config.documents_status = 404
+    server.config.accept_gzip = False
+
+    result = api.chat("вопрос", "analysis", docs=make_chunks() if with_docs else None,
+                      conversation={"history": HISTORY})
+
+    assert result["success"], result
+    assert server.httpd.last_chat["history"] == HISTORY
+
+
+def test_failed_upload_is_not_retried_every_message(server, api):
+    server.config.documents_status = 413
+    chunks = make_chunks()
+    before = uploads()
+
+    for question in ("первый", "второй", "третий"):
+        assert api.chat(question, "analysis", docs=chunks)["success"]
+
+    assert uploads() - before == 1
+    assert server.httpd.last_chat["documents"] == [chunk.formatted for chunk in chunks]
+
+
+def test_409_without_missing_list_reuploads_all_refs(server, api):
+    chunks = make_chunks()
+    assert api.chat("вопрос", "analysis", docs=chunks)["success"]
+    server.httpd.documents.clear()
+    server.config.report_missing = False
+
+    result = api.chat("вопрос после перезапуска", "analysis", docs=chunks)
+
+    assert result["success"], result
+    assert DocumentRegistry.content_hash(chunks[0].doc) in server.httpd.documents
+    assert "documentRefs" in server.httpd.last_chat
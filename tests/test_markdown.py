@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("PyQt6.QtWidgets")
+
+from task_solver_desktop import MarkdownRenderer, markdown_code, split_markdown  # noqa: E402
+
+TEXT = (
+    "# Решение\n"
+    "Первый абзац.\n"
+    "\n"
+    "```python\n"
+    "x = 1\n"
+    "\n"
+    "print(x)\n"
+    "```\n"
+    "- пункт\n"
+    "- ещё пункт\n"
+)
+
+
+def test_blocks_split_on_blank_lines_and_fences():
+    blocks = split_markdown(TEXT)
+
+    assert [block.kind for block in blocks] == ["text", "code", "text"]
+    assert blocks[1].source.startswith("```python") and blocks[1].source.endswith("```\n")
+    assert markdown_code(blocks[1]) == "x = 1\n\nprint(x)"
+    for block in blocks:
+        assert TEXT[block.offset:block.offset + len(block.source)] == block.source
+
+
+def test_offset_shifts_blocks():
+    assert [b.offset for b in split_markdown(TEXT, offset=100)] == [
+        b.offset + 100 for b in split_markdown(TEXT)
+    ]
+
+
+def test_unclosed_fence_is_code_until_end():
+    text = "Текст\n\n```\ncode line\nmore"
+    blocks = split_markdown(text)
+
+    assert blocks[-1].kind == "code"
+    assert markdown_code(blocks[-1]) == "code line\nmore"
+
+
+def test_appended_text_keeps_earlier_blocks():
+    # Дописанный текст меняет только последний блок — остальные берутся из кэша
+    prefix = split_markdown(TEXT[:60])
+    full = split_markdown(TEXT)
+
+    assert prefix[:-1] == full[:len(prefix) - 1]
+
+
+def test_renderer_caches_by_source():
+    renderer = MarkdownRenderer(cache_size=2)
+    block = split_markdown("**жирный** и `код`")[0]
+
+    html = renderer.render(block)
+
+    assert "<b>жирный</b>" in html and "код</code>" in html
+    assert renderer.render(block) is html
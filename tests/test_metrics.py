@@ -0,0 +1,30 @@
+import pytest
+
+from mock_server import MockConfig, MockServer
+from task_solver_core import METRICS, APIClient, CancelToken
+
+
+def received() -> float:
+    return METRICS.total("mkai_http_received_bytes_total", endpoint="/search")
+
+
+@pytest.mark.parametrize("cancellable", [False, True])
+def test_search_counts_received_bytes(server, api, cancellable):
+    before = received()
+
+    results = api.search("запрос", cancel=CancelToken() if cancellable else None)
+
+    assert results
+    assert received() > before
+
+
+def test_hedged_search_counts_received_bytes(server):
+    second = MockServer(MockConfig(latency=0, jitter=0, chunk_delay=0, payload_size=200)).start()
+    api = APIClient([server.url, second.url], backoff_base=0.01)
+    try:
+        before = received()
+        assert api.search("запрос")
+        assert received() > before
+    finally:
+        api.pool.stop()
+        second.stop()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from task_solver_core import RequestCancelled, SearchCache, SearchResult
+
+RESULTS = [SearchResult(title="Заголовок", url="https://example.org/1", snippet="", domain="example.org")]
+
+
+def test_key_ignores_case_and_spacing():
+    assert SearchCache.make_key("  Теорема  ПИФАГОРА ", 10, "general") == \
+        SearchCache.make_key("теорема пифагора", 10, "general")
+    assert SearchCache.make_key("теорема", 10, "general") != SearchCache.make_key("теорема", 10, "news")
+
+
+def test_hit_after_fetch_and_expiry():
+    cache = SearchCache(ttl=60)
+    calls = []
+    fetch = lambda: calls.append(1) or RESULTS
+
+    assert cache.get_or_fetch("k", fetch) == RESULTS
+    assert cache.get_or_fetch("k", fetch) == RESULTS
+    assert (len(calls), cache.hits, cache.misses) == (1, 1, 1)
+
+    cache.entries["k"] = (time.time() - 1, RESULTS)
+    cache.get_or_fetch("k", fetch)
+    assert len(calls) == 2
+
+
+def test_concurrent_identical_requests_are_coalesced():
+    cache = SearchCache()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return RESULTS
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch("k", fetch)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while cache.coalesced < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [RESULTS] * 5
+
+
+def test_cancelled_owner_does_not_cancel_waiters():
+    cache = SearchCache()
+    started, release = threading.Event(), threading.Event()
+
+    def cancelled_fetch():
+        started.set()
+        release.wait(5)
+        raise RequestCancelled()
+
+    def owner():
+        with pytest.raises(RequestCancelled):
+            cache.get_or_fetch("k", cancelled_fetch)
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    started.wait(5)
+    waiter = []
+    other = threading.Thread(target=lambda: waiter.append(cache.get_or_fetch("k", lambda: RESULTS)))
+    other.start()
+    while cache.coalesced < 1:
+        time.sleep(0.01)
+    release.set()
+    thread.join()
+    other.join()
+
+    assert waiter == [RESULTS]
+    assert "k" not in cache._inflight
@@ -0,0 +1,55 @@
+import pytest
+
+from task_solver_core import APIClient
+
+
+class FakeResponse:
+    # Отдаёт тело заданными кусками, как requests при chunk_size=None
+
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+
+    def iter_content(self, chunk_size=None):
+        return iter(self.chunks)
+
+
+def split_bytes(text: str, size: int) -> list:
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.fixture
+def client():
+    return APIClient("http://localhost:1/api")
+
+
+def deltas(events) -> str:
+    return "".join(APIClient._extract_delta(event) for event in events)
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_sse_survives_arbitrary_chunk_boundaries(client, size):
+    body = ('data: {"delta": "При"}\r\n\r\n'
+            ': комментарий\n\n'
+            'data: {"delta": "вет, "}\n\n'
+            'data: {"choices": [{"delta": {"content": "мир"}}]}\n\n'
+            'data: [DONE]\n\n'
+            'data: {"delta": "после конца"}\n\n')
+
+    assert deltas(client._iter_sse(FakeResponse(*split_bytes(body, size)))) == "Привет, мир"
+
+
+def test_sse_multiline_data_and_unterminated_tail(client):
+    events = list(client._iter_sse(FakeResponse(b"data: first\ndata: second\n\ndata: tail")))
+
+    assert events == [{"delta": "first\nsecond"}, {"delta": "tail"}]
+
+
+@pytest.mark.parametrize("size", [1, 5, 1000])
+def test_ndjson_skips_blank_lines(client, size):
+    body = '{"token": "раз"}\n\n{"text": "-два"}\n"три"\n{"done": true}'
+
+    events = list(client._iter_ndjson(FakeResponse(*split_bytes(body, size))))
+
+    assert deltas(events) == "раз-дватри"
+    assert events[-1] == {"done": True}